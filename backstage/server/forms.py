@@ -6,7 +6,8 @@ from dispatcher.models import Server
 class ServerEditForm(forms.ModelForm):
   class Meta:
     model = Server
-    fields = ['name', 'ip', 'port', 'token', 'concurrency', 'runtime_multiplier', 'version', 'master']
+    fields = ['name', 'ip', 'port', 'token', 'concurrency', 'runtime_multiplier', 'version', 'master', 'languages',
+              'interactor']
 
 
 class ServerUpdateTokenForm(forms.Form):
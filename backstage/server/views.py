@@ -1,27 +1,35 @@
 import logging
-import multiprocessing
 import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from django.conf import settings
 from django.contrib import messages
 from django.core.cache import cache
 from django.db import transaction
 from django.db.models import F
 from django.shortcuts import HttpResponseRedirect, reverse, get_object_or_404
-from django.views.generic import FormView
+from django.views.generic import FormView, TemplateView
 from django.views.generic import View
 from django.views.generic.list import ListView
+from django_q.tasks import async_task
 from django_redis import get_redis_connection
 
+from dispatcher.calibration import calibrate_servers, apply_calibration
+from dispatcher.capability import record_programs, index_servers
 from dispatcher.manage import update_token, list_spj, upload_spj
-from dispatcher.models import Server, ServerProblemStatus
+from dispatcher.health import get_health
+from dispatcher.metrics import read_metrics, summarize, reset_metrics
+from dispatcher.models import Server, ServerProblemStatus, ServerCalibration
+from dispatcher.scheduler import get_server_stats, compute_weights
 from dispatcher.semaphore import Semaphore
-from polygon.rejudge import rejudge_submission_set
+from dispatcher.sync import sync_server
+from polygon.models import RejudgeJob
+from polygon.rejudge import rejudge_submission_set, pause_rejudge_job, resume_rejudge_job, cancel_rejudge_job
 from problem.models import Problem, SpecialProgram
-from problem.tasks import upload_problem_to_judge_server
 from submission.models import Submission
-from submission.util import SubmissionStatus
+from submission.util import SubmissionStatus, STATUS_CHOICE
 from .forms import ServerEditForm, ServerUpdateTokenForm
 from ..base_views import BaseCreateView, BaseUpdateView, BaseBackstageMixin
 
@@ -57,19 +65,39 @@ class ServerList(BaseBackstageMixin, ListView):
     sem.exists_or_init()
     try:
       data['semaphore_available_count'] = sem.available_count
-      data['semaphore_available_keys'] = redis_server.lrange(sem.available_key, 0,
-                                                             sem.available_count)  # 1 more actually
-      data['semaphore_available_keys'] = list(map(lambda s: s.decode(), data['semaphore_available_keys']))
+      data['semaphore_available_keys'] = sem.available_tokens()
+      data['semaphore_free'] = sem.free_counts()
       data['semaphore_grabbed_keys'] = {}
       for key, tt in redis_server.hgetall(sem.grabbed_key).items():
         data['semaphore_grabbed_keys'][key.decode()] = sem.current_time - float(tt.decode())
       data['server_synchronize_status_detail'] = cache.get('server_synchronize_status_detail', '')
       data['server_synchronize_status'] = cache.get('server_synchronize_status', 0)
+      data['semaphore_queue_status'] = sem.queue_status()
+      data['semaphore_leases'], data['semaphore_lease_stats'], data['semaphore_lease_events'] = sem.lease_status()
+      for event in data['semaphore_lease_events']:
+        event['time'] = datetime.fromtimestamp(event['time'])
       data['semaphore_ok'] = True
     except:
       pass
 
+    data['server_list'] = list(data['server_list'])
+    try:
+      stats = get_server_stats(redis_server, data['server_list'])
+      weights = compute_weights(stats)
+      free = data.get('semaphore_free', {})
+      health = get_health(data['server_list'], redis_server)
+      for server in data['server_list']:
+        server.health = health.get(server.pk)
+        server.stats = stats[server.pk]
+        server.stats["weight"] = weights[server.pk]
+        server.stats["free"] = free.get(server.pk, 0)
+    except:
+      logger.warning(traceback.format_exc())
+    for server in data['server_list']:
+      server.calibration = server.calibrations.first()
+
     data['crashed_submission_count'] = Submission.objects.filter(status=SubmissionStatus.SYSTEM_ERROR).count()
+    data['rejudge_job_list'] = RejudgeJob.objects.select_related("user").defer("submissions").order_by("-pk")[:20]
     return data
 
 
@@ -90,6 +118,7 @@ class ServerEnableOrDisable(BaseBackstageMixin, View):
     server.save(update_fields=['enabled'])
     try:
       Semaphore(get_redis_connection("judge")).reset()
+      index_servers()
     except:
       pass
     return HttpResponseRedirect(reverse('backstage:server'))
@@ -119,32 +148,24 @@ class ServerUpdateToken(BaseBackstageMixin, FormView):
     return HttpResponseRedirect(reverse('backstage:server'))
 
 
-def sync_and_update_status(server, problem):
-  status, _ = ServerProblemStatus.objects.get_or_create(server=server, problem=problem)
-  try:
-    upload_problem_to_judge_server(problem, server)
-    status.last_status = ''
-  except:
-    status.last_status = traceback.format_exc()
-  status.save()
-
-
 def upload_spj_exception_wrapper(server, program):
   res = upload_spj(server, program)
   if res["status"] != "received":
     logger.error("%s", res)
+  else:
+    record_programs(server, [program.fingerprint])
 
 
-def synchronize_func(server, problems):
-  with multiprocessing.Pool(server.concurrency) as p:
-    p.starmap(sync_and_update_status, [(server, problem) for problem in problems])
-  server.last_synchronize_time = datetime.now()
-  server.save(update_fields=['last_synchronize_time'])
+def synchronize_func(server, problems, refresh=False):
+  try:
+    sync_server(server, problems, refresh=refresh)
+  except:
+    logger.error(traceback.format_exc())
 
 
 def synchronize_func_v3(server, programs):
-  with multiprocessing.Pool(server.concurrency) as p:
-    p.starmap(upload_spj_exception_wrapper, [(server, program) for program in programs])
+  with ThreadPoolExecutor(server.concurrency) as executor:
+    list(executor.map(lambda program: upload_spj_exception_wrapper(server, program), programs))
 
 
 class ServerSynchronize(BaseBackstageMixin, View):
@@ -167,7 +188,8 @@ class ServerSynchronize(BaseBackstageMixin, View):
           filter(last_synchronize__lt=F('problem__update_time')).values_list("problem_id", flat=True)
         problems = Problem.objects.filter(id__in=problem_ids)
 
-      threading.Thread(target=synchronize_func, args=(server, list(problems))).start()
+      threading.Thread(target=synchronize_func, args=(server, list(problems)),
+                       kwargs={"refresh": request.GET.get("t") == "all"}).start()
     return HttpResponseRedirect(reverse('backstage:server'))
 
 
@@ -194,7 +216,8 @@ class ServerProblemStatusList(BaseBackstageMixin, ListView):
       return self.server.serverproblemstatus_set.select_related("problem").only("server_id", "problem_id",
                                                                                 "problem__title", "problem__alias",
                                                                                 "problem__update_time", "last_status",
-                                                                                "last_synchronize").all()
+                                                                                "last_synchronize", "last_bytes",
+                                                                                "last_seconds").all()
 
   def get_context_data(self, **kwargs):  # pylint: disable=arguments-differ
     data = super().get_context_data(**kwargs)
@@ -211,10 +234,74 @@ class ServerSemaphoreReset(BaseBackstageMixin, View):
     return HttpResponseRedirect(reverse('backstage:server'))
 
 
+class RejudgeJobControl(BaseBackstageMixin, View):
+  actions = {'pause': pause_rejudge_job, 'resume': resume_rejudge_job, 'cancel': cancel_rejudge_job}
+
+  def post(self, request, pk, action):
+    self.actions[action](get_object_or_404(RejudgeJob, pk=pk))
+    return HttpResponseRedirect(reverse('backstage:server'))
+
+
 class RejudgeAllCrashedSubmission(BaseBackstageMixin, View):
   def post(self, request, *args, **kwargs):
-    crashed = Submission.objects.filter(status=SubmissionStatus.SYSTEM_ERROR)
-    if len(crashed) > 0:
-      threading.Thread(target=rejudge_submission_set,
-                       args=(crashed,)).start()
+    crashed = Submission.objects.filter(status=SubmissionStatus.SYSTEM_ERROR).order_by("create_time")
+    if crashed.exists():
+      rejudge_submission_set(crashed, user=request.user, label="Crashed submissions")
     return HttpResponseRedirect(reverse('backstage:server'))
+
+
+class ServerMetrics(BaseBackstageMixin, TemplateView):
+  template_name = 'backstage/server/metrics.jinja2'
+
+  def get_context_data(self, **kwargs):
+    data = super().get_context_data(**kwargs)
+    metrics = read_metrics()
+    servers = {str(server.pk): server.name for server in Server.objects.all()}
+    data['server_rows'] = sorted((servers.get(key, key), row) for key, row in summarize(metrics, "server").items())
+    data['lang_rows'] = sorted(summarize(metrics, "lang").items())
+    data['verdict_names'] = {str(k): v for k, v in STATUS_CHOICE}
+    return data
+
+
+class ServerMetricsReset(BaseBackstageMixin, View):
+
+  def post(self, request):
+    reset_metrics()
+    messages.success(request, "Judge metrics have been reset.")
+    return HttpResponseRedirect(reverse('backstage:server_metrics'))
+
+
+class ServerCalibrationList(BaseBackstageMixin, ListView):
+  template_name = 'backstage/server/server_calibration.jinja2'
+  context_object_name = 'calibration_list'
+
+  def get_queryset(self):
+    self.server = get_object_or_404(Server, pk=self.kwargs["pk"])
+    return self.server.calibrations.all()[:100]
+
+  def get_context_data(self, **kwargs):  # pylint: disable=arguments-differ
+    data = super().get_context_data(**kwargs)
+    data['server'] = self.server
+    data['baseline_configured'] = bool(settings.JUDGE_CALIBRATION_BASELINE)
+    return data
+
+
+class ServerCalibrate(BaseBackstageMixin, View):
+
+  def post(self, request, pk):
+    server = get_object_or_404(Server, pk=pk)
+    if not settings.JUDGE_CALIBRATION_BASELINE:
+      messages.error(request, "JUDGE_CALIBRATION_BASELINE is not configured.")
+    else:
+      async_task(calibrate_servers, [server.pk])
+      messages.success(request, "Calibration started, it takes a few minutes.")
+    return HttpResponseRedirect(reverse('backstage:server_calibration', kwargs={"pk": pk}))
+
+
+class ServerCalibrationApply(BaseBackstageMixin, View):
+
+  def post(self, request, pk, cid):
+    calibration = get_object_or_404(ServerCalibration, pk=cid, server_id=pk)
+    apply_calibration(calibration)
+    messages.success(request, "Runtime multiplier set to %.3f." % calibration.server.runtime_multiplier)
+    return HttpResponseRedirect(reverse('backstage:server_calibration', kwargs={"pk": pk}))
@@ -13,7 +13,8 @@ from .contest.views import ContestList, ContestApplyRatingChanges, ContestWithdr
 from .problem.views import ProblemList, ProblemVisibleSwitch, ProblemTagList, ProblemTagCreate, ProblemTagEdit, \
   ProblemArchiveList, ProblemArchiveEdit, ProblemArchiveCreate, ProblemSourceBatchEdit, ProblemTagDelete
 from .server.views import ServerCreate, ServerUpdate, ServerList, ServerDelete, ServerRefresh, ServerEnableOrDisable, \
-  ServerUpdateToken, ServerSynchronize, ServerProblemStatusList, ServerSemaphoreReset, RejudgeAllCrashedSubmission
+  ServerUpdateToken, ServerSynchronize, ServerProblemStatusList, ServerSemaphoreReset, RejudgeAllCrashedSubmission, \
+  RejudgeJobControl, ServerMetrics, ServerMetricsReset, ServerCalibrationList, ServerCalibrate, ServerCalibrationApply
 from .site.views import SiteSettingsUpdate
 
 app_name = "backstage"
@@ -56,8 +57,16 @@ urlpatterns = [
   url(r'^server/(?P<pk>\d+)/edit/token/$', ServerUpdateToken.as_view(), name='server_update_token'),
   url(r'^server/(?P<pk>\d+)/status/$', ServerProblemStatusList.as_view(), name='server_problem_status'),
   url(r'^server/(?P<pk>\d+)/synchronize/$', ServerSynchronize.as_view(), name='server_synchronize'),
+  url(r'^server/(?P<pk>\d+)/calibration/$', ServerCalibrationList.as_view(), name='server_calibration'),
+  url(r'^server/(?P<pk>\d+)/calibration/run/$', ServerCalibrate.as_view(), name='server_calibrate'),
+  url(r'^server/(?P<pk>\d+)/calibration/(?P<cid>\d+)/apply/$', ServerCalibrationApply.as_view(),
+      name='server_calibration_apply'),
+  url(r'^server/metrics/$', ServerMetrics.as_view(), name='server_metrics'),
+  url(r'^server/metrics/reset/$', ServerMetricsReset.as_view(), name='server_metrics_reset'),
   url(r'^server/semaphore/reset/$', ServerSemaphoreReset.as_view(), name='server_semaphore_reset'),
   url(r'^server/rejudge/crashed/$', RejudgeAllCrashedSubmission.as_view(), name='rejudge_crashed_submission'),
+  url(r'^server/rejudge/jobs/(?P<pk>\d+)/(?P<action>pause|resume|cancel)/$', RejudgeJobControl.as_view(),
+      name='rejudge_job_control'),
 
   url(r'^site/$', SiteSettingsUpdate.as_view(), name='site'),
 
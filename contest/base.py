@@ -9,7 +9,7 @@ from ipware.ip import get_ip
 
 from blog.models import Blog
 from contest.models import Contest, ContestParticipant
-from problem.statistics import get_accept_problem_list, get_next_k_recommended_problems
+from problem.statistics import get_accept_problem_set, get_next_k_recommended_problems
 from utils.middleware.close_site_middleware import CloseSiteException
 from utils.permission import is_contest_manager, is_contest_volunteer
 from utils.site_settings import is_site_closed
@@ -105,7 +105,7 @@ class BaseContestMixin(ContextMixin, UserPassesTestMixin):
   def get_recommended_problem_list(self):
     if not self.user.is_authenticated:
       return []
-    accepted_problem_ids = set(get_accept_problem_list(self.user.id, self.contest.id))
+    accepted_problem_ids = get_accept_problem_set(self.user.id, self.contest.id)
     all_problem_ids = set([problem.problem_id for problem in self.contest.contest_problem_list])
     recommended_problems = get_next_k_recommended_problems(
       self.user.id, all_problem_ids - accepted_problem_ids, k=7)
@@ -2,7 +2,6 @@ from datetime import timedelta
 
 from django.db import transaction
 
-from problem.statistics import invalidate_problem
 from submission.util import SubmissionStatus
 from .models import Contest
 
@@ -373,5 +372,3 @@ def invalidate_contest_problem(contest: Contest, problems=None):
 def invalidate_contest(contest: Contest):
   invalidate_contest_participant(contest)
   invalidate_contest_problem(contest)
-  for problem in contest.contest_problem_list:
-    invalidate_problem(problem.problem)
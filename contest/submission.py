@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib import messages
 from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
@@ -12,8 +13,8 @@ from ipware.ip import get_ip
 
 from contest.base import BaseContestMixin
 from contest.statistics import invalidate_contest_participant
-from problem.models import Problem
-from problem.statistics import invalidate_problem
+from dispatcher.aio import enqueue_submission
+from problem.statistics import invalidate_problem_user, reset_user_status
 from problem.tasks import create_submission
 from problem.views import StatusList
 from submission.models import Submission
@@ -65,7 +66,10 @@ class ContestSubmit(BaseContestMixin, View):
           raise ValueError("你已退出比赛。")
       response = {"url": reverse('contest:submission_api',
                                  kwargs={'cid': self.contest.id, 'sid': submission.id})}
-      async_task(judge_submission_on_contest, submission, contest=self.contest)
+      if settings.JUDGE_ASYNC_DISPATCHER:
+        enqueue_submission(submission.pk)
+      else:
+        async_task(judge_submission_on_contest, submission, contest=self.contest)
       return JsonResponse(response)
     except Exception as e:
       return HttpResponseBadRequest(str(e).encode())
@@ -98,8 +102,9 @@ class ContestSubmissionClaim(BaseContestMixin, View):
         submission.contest = self.contest
       Submission.objects.bulk_create(self.submissions)
       invalidate_contest_participant(self.contest, self.user.pk)
-      for problem in Problem.objects.filter(pk__in=self.problem_id_list):
-        invalidate_problem(problem)
+      reset_user_status([self.user.pk])
+      for problem_id in set(s.problem_id for s in self.submissions):
+        invalidate_problem_user(problem_id, self.user.pk)
       messages.add_message(request, messages.SUCCESS, "%d 份提交已经成功迁移。" % len(self.submissions))
     return HttpResponse()
 
@@ -162,7 +167,7 @@ class ContestSubmissionView(BaseContestMixin, TemplateView):
                                                    show_percent=data['show_percent'],
                                                    hide_reward=self.contest.contest_type == 0)
       if permission == 2 or (self.request.user == submission.author and self.contest.case_public >= 2):
-        data['report_block'] = render_submission_report(submission.pk)
+        data['report_block'] = render_submission_report(submission.pk, self.request.GET.get('case'))
       else:
         data['report_block'] = ''
     else:
@@ -2,6 +2,8 @@ from threading import Thread
 
 from django.db import transaction
 
+from dispatcher.semaphore import CONTEST, PRACTICE
+from problem.statistics import record_user_verdict
 from problem.tasks import judge_submission_on_problem
 from submission.models import Submission
 from submission.util import SubmissionStatus
@@ -22,17 +24,21 @@ def judge_submission_on_contest(submission: Submission, callback=None, **kwargs)
     raise ValueError('Judge on "None" contest')
   cases = 'all' if contest.system_tested else contest.run_tests_during_contest
   run_until_complete = contest.scoring_method == 'oi' and not submission.problem.group_enabled
+  priority = kwargs.get('priority') or (CONTEST if contest.status == 0 else PRACTICE)
   if not submission.contest:
     cases = 'all'
     _callback = None
+    priority = kwargs.get('priority') or PRACTICE
 
   if cases != 'none':
     judge_submission_on_problem(submission, callback=_callback, case=cases,
                                 run_until_complete=run_until_complete,
-                                status_for_pretest=cases != 'all', sync=sync)
+                                status_for_pretest=cases != 'all', sync=sync, watch=kwargs.get('watch'),
+                                priority=priority, memoize=kwargs.get('memoize', False))
   else:
-    submission.status = SubmissionStatus.SUBMITTED
+    previous_status, submission.status = submission.status, SubmissionStatus.SUBMITTED
     submission.save(update_fields=['status'])
+    record_user_verdict(submission, previous_status)
     Thread(target=_callback).start()
 
 
@@ -17,7 +17,7 @@ from account.permissions import is_admin_or_root
 from contest.base import BaseContestMixin
 from contest.statistics import get_participant_score, calculate_problems
 from problem.models import Problem
-from problem.statistics import get_accept_problem_list, get_attempted_problem_list
+from problem.statistics import get_accept_problem_set, get_attempted_problem_set
 from utils.language import LANG_CHOICE
 from .models import Contest, ContestProblem, ContestInvitation, ContestUserRating
 from .tasks import add_participant_with_invitation
@@ -69,19 +69,19 @@ class DashboardView(BaseContestMixin, TemplateView):
       problem.personal_label = 0
     if data['has_permission'] and self.user.is_authenticated:
       # problem red and green status
-      attempt_list = set(get_attempted_problem_list(self.request.user.id, self.contest.id))
-      accept_list = set(get_accept_problem_list(self.request.user.id, self.contest.id))
+      attempt_set = get_attempted_problem_set(self.request.user.id, self.contest.id)
+      accept_set = get_accept_problem_set(self.request.user.id, self.contest.id)
       for problem in data['contest_problem_list']:
-        if problem.problem_id in accept_list:
+        if problem.problem_id in accept_set:
           problem.personal_label = 1
-        elif problem.problem_id in attempt_list:
+        elif problem.problem_id in attempt_set:
           problem.personal_label = -1
         else:
           problem.personal_label = 0
       if self.contest.contest_type == 1:
-        all_accept_list = set(get_accept_problem_list(self.request.user.id))
+        all_accept_set = get_accept_problem_set(self.request.user.id)
         for problem in data['contest_problem_list']:
-          if problem.problem_id in all_accept_list and problem.personal_label <= 0:
+          if problem.problem_id in all_accept_set and problem.personal_label <= 0:
             problem.personal_label = 2
 
       # show display rank
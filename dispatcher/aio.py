@@ -0,0 +1,291 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import aiohttp
+from django.conf import settings
+from django.db import close_old_connections
+from django_redis import get_redis_connection
+
+from dispatcher.channel import open_channel, close_channel, PUSH_PREFIX
+from dispatcher.judge import report_judge_failure, PUSH_WAIT_INTERVAL, JudgeStalled, JudgeWatch, hedge_window, \
+  complete_from_memo, judge_semaphore, token_server, record_stalled, record_failed
+from dispatcher.memo import memo_key
+from dispatcher.metrics import record_dispatch
+from dispatcher.semaphore import PRACTICE, WAKE_INTERVAL, namespaced_key, DEFAULT_NAMESPACE
+from .utils import DEFAULT_USERNAME
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'JUDGE:PENDING'
+
+
+def enqueue_submission(submission_id, **kwargs):
+  """
+  Hand a submission over to the asyncio dispatcher. kwargs must be json serializable.
+  """
+  get_redis_connection("judge").rpush(PENDING_KEY, json.dumps({"submission": submission_id, "kwargs": kwargs}))
+
+
+class PushPump(object):
+  """
+  A single thread blocking on the push channels of all in-flight judgings at once
+  """
+
+  def __init__(self, client, loop):
+    self.client = client
+    self.loop = loop
+    self.lock = threading.Lock()
+    self.queues = {}
+
+  def register(self, fingerprint):
+    queue = asyncio.Queue()
+    with self.lock:
+      self.queues[fingerprint] = queue
+    return queue
+
+  def unregister(self, fingerprint):
+    with self.lock:
+      self.queues.pop(fingerprint, None)
+
+  def run(self):
+    while True:
+      with self.lock:
+        keys = [PUSH_PREFIX + fingerprint for fingerprint in self.queues]
+      if not keys:
+        time.sleep(0.1)
+        continue
+      try:
+        pair = self.client.blpop(keys, 1)
+      except:
+        logger.warning(traceback.format_exc())
+        time.sleep(1)
+        continue
+      if pair is None:
+        continue
+      with self.lock:
+        queue = self.queues.get(pair[0].decode()[len(PUSH_PREFIX):])
+      if queue is not None:
+        self.loop.call_soon_threadsafe(queue.put_nowait, json.loads(pair[1].decode()))
+
+
+class WakeListener(object):
+  """
+  A single pub/sub connection telling all waiting acquirers when their tickets have been served
+  """
+
+  def __init__(self, client, loop):
+    self.client = client
+    self.loop = loop
+    self.prefix = namespaced_key(DEFAULT_NAMESPACE, 'WAKE:')
+    self.lock = threading.Lock()
+    self.events = {}
+
+  def register(self, ticket):
+    event = asyncio.Event()
+    with self.lock:
+      self.events[ticket] = event
+    return event
+
+  def unregister(self, ticket):
+    with self.lock:
+      self.events.pop(ticket, None)
+
+  def run(self):
+    pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+    pubsub.psubscribe(self.prefix + '*')
+    while True:
+      try:
+        for message in pubsub.listen():
+          with self.lock:
+            event = self.events.get(message["channel"].decode()[len(self.prefix):])
+          if event is not None:
+            self.loop.call_soon_threadsafe(event.set)
+      except:
+        logger.warning(traceback.format_exc())
+        time.sleep(1)
+
+
+class AsyncDispatcher(object):
+  """
+  Keeps many judgings in flight in one process. HTTP talks to judge servers are done with aiohttp on the
+  event loop, while everything touching the database (including the judge callback) runs in a small thread pool.
+
+  :param handler: function(submission_id, watch, **kwargs), run in the thread pool; it is expected to call
+                  `watch` with the same arguments as `send_judge_through_watch`, which returns immediately
+  """
+
+  def __init__(self, handler, max_inflight=None, db_threads=None):
+    self.handler = handler
+    self.max_inflight = max_inflight or settings.JUDGE_ASYNC_MAX_INFLIGHT
+    self.db_pool = ThreadPoolExecutor(db_threads or settings.JUDGE_ASYNC_DB_THREADS)
+    self.client = get_redis_connection("judge")
+    self.loop = None
+    self.inflight = None
+    self.pump = None
+    self.wake = None
+    self.session = None
+
+  def run_forever(self):
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    self.loop.run_until_complete(self.main())
+
+  async def main(self):
+    self.inflight = asyncio.Semaphore(self.max_inflight)
+    self.pump = PushPump(self.client, self.loop)
+    threading.Thread(target=self.pump.run, daemon=True).start()
+    self.wake = WakeListener(self.client, self.loop)
+    threading.Thread(target=self.wake.run, daemon=True).start()
+    async with aiohttp.ClientSession() as session:
+      self.session = session
+      while True:
+        await self.inflight.acquire()
+        _, item = await self.loop.run_in_executor(None, self.client.blpop, PENDING_KEY, 0)
+        self.loop.run_in_executor(self.db_pool, self._start_job, json.loads(item.decode()))
+
+  def _start_job(self, job):
+    watched = []
+
+    def watch(*args, **kwargs):
+      watched.append(True)
+      asyncio.run_coroutine_threadsafe(self.judge(*args, **kwargs), self.loop)
+
+    close_old_connections()
+    try:
+      self.handler(job["submission"], watch, **job["kwargs"])
+    except:
+      logger.error(traceback.format_exc())
+    if not watched:
+      self.loop.call_soon_threadsafe(self.inflight.release)
+
+  async def run_db(self, func, *args, **kwargs):
+    return await self.loop.run_in_executor(self.db_pool, partial(func, *args, **kwargs))
+
+  async def acquire(self, sem):
+    """
+    Wait in line like a blocking acquire would, woken by the wake listener instead of a connection of its own
+    """
+    token = await self.run_db(sem.enqueue)
+    if token is None:
+      ticket = sem.ticket
+      woken = self.wake.register(ticket)
+      try:
+        token = await self.run_db(sem.check)  # served before the listener knew about the ticket
+        while token is None:
+          try:
+            await asyncio.wait_for(woken.wait(), WAKE_INTERVAL)
+          except asyncio.TimeoutError:
+            token = await self.run_db(sem.renew)
+          else:
+            woken.clear()
+            token = await self.run_db(sem.check)
+      finally:
+        self.wake.unregister(ticket)
+    sem.hold(token)
+    return token
+
+  async def judge(self, code, lang, max_time, max_memory, run_until_complete, cases, checker,
+                  interactor, group_config, callback, timeout=900, report_instance=None, priority=PRACTICE,
+                  memoize=False, avoid_servers=None, queued_at=None):
+    """
+    Same as `send_judge_through_watch`, including hedged re-dispatch and memoization
+    """
+    queued_at = queued_at or time.time()
+    try:
+      key = memo_key(code, lang, max_time, max_memory, run_until_complete, cases, checker, interactor, group_config)
+      if memoize and await self.run_db(complete_from_memo, self.client, key, callback, report_instance):
+        return
+      sem = await self.run_db(judge_semaphore, self.client, lang, checker, interactor, priority, avoid_servers)
+      window = hedge_window(max_time, cases)
+      deadline = time.time() + timeout
+      for attempt in range(settings.JUDGE_HEDGE_MAX_ATTEMPTS + 1):
+        try:
+          token = await self.acquire(sem)
+        except:
+          await self.run_db(report_judge_failure, callback, traceback.format_exc())
+          return
+        server = None
+        try:
+          server = await self.run_db(token_server, token)
+          if attempt == 0:
+            await self.run_db(record_dispatch, server, lang, queued_at)
+          await self._judge(server, code, lang, max_time, max_memory, run_until_complete, cases, checker,
+                            interactor, group_config, callback, deadline, report_instance,
+                            window if attempt < settings.JUDGE_HEDGE_MAX_ATTEMPTS else None, key, sem)
+          return
+        except JudgeStalled:
+          await self.run_db(record_stalled, sem, server, lang, window)
+        except:
+          exc_text = traceback.format_exc()
+          await self.run_db(record_failed, server, lang)
+          await self.run_db(report_judge_failure, callback, exc_text)
+          return
+        finally:
+          await self.run_db(sem.release)
+    finally:
+      self.inflight.release()
+
+  async def _request(self, method, url, server, timeout, **kwargs):
+    async with self.session.request(method, url, auth=aiohttp.BasicAuth(DEFAULT_USERNAME, server.token),
+                                    timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as response:
+      return await response.text()
+
+  async def _judge(self, server, code, lang, max_time, max_memory, run_until_complete, cases, checker,
+                   interactor, group_config, callback, deadline, report_instance, window, key, sem):
+    """
+    The asyncio transport of `JudgeWatch`
+    """
+    watch = await self.run_db(JudgeWatch, server, code, lang, max_time, max_memory, run_until_complete, cases,
+                              checker, interactor, group_config, deadline, window, key)
+    queue = None
+    if watch.use_push:
+      await self.run_db(open_channel, self.client, watch.fingerprint, watch.timeout, server.pk)
+      queue = self.pump.register(watch.fingerprint)
+
+    try:
+      await self.run_db(sem.heartbeat)
+      watch.beat()
+      reply = watch.first_reply(
+        json.loads(await self._request('POST', watch.url('/judge'), server, watch.request_timeout, json=watch.data)))
+      if reply is not None:
+        await self.run_db(callback, reply)
+      while watch.running():
+        if watch.heartbeat_due():
+          await self.run_db(sem.heartbeat)
+        response = None
+        if watch.use_push:
+          try:
+            response = await asyncio.wait_for(queue.get(), PUSH_WAIT_INTERVAL)
+          except asyncio.TimeoutError:
+            pass
+        else:
+          await asyncio.sleep(0.5)
+        if response is None:
+          try:
+            response = json.loads(await self._request('GET', watch.url('/query'), server, watch.query_timeout,
+                                                      json=watch.query))
+            watch.polled()
+          except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            watch.polled(e)
+        if response is not None:
+          response = watch.receive(response)
+          if await self.run_db(callback, response):
+            await self.run_db(sem.heartbeat)
+            watch.beat()
+            report = await self._request('GET', watch.url('/query/report'), server, watch.request_timeout,
+                                         json=watch.query)
+            await self.run_db(watch.complete, self.client, response, report, report_instance)
+            break
+        watch.check_stalled()
+      else:
+        raise RuntimeError("Send judge through asyncio timed out.")
+    finally:
+      if watch.use_push:
+        self.pump.unregister(watch.fingerprint)
+        await self.run_db(close_channel, self.client, watch.fingerprint)
@@ -0,0 +1,252 @@
+import json
+import logging
+import math
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+from django.conf import settings
+from django.db import connection
+from django_redis import get_redis_connection
+
+from problem.models.problem import get_input_path, get_output_path
+from submission.util import SubmissionStatus
+from utils.hash import case_hash
+from .judge import _prepare_judge_json_data
+from .manage import upload_case
+from .models import Server, ServerCalibration
+from .semaphore import Semaphore, REJUDGE, HEARTBEAT_INTERVAL
+from .session import get_session
+
+logger = logging.getLogger(__name__)
+
+REPETITIONS = 5
+MAX_TIME = 10000  # ms, as the time limit of a problem
+MAX_MEMORY = 512
+# a request to the judge server never waits for longer, so that the slot is heartbeaten in time
+REQUEST_TIMEOUT = 30
+
+CPU_PROGRAM = r"""
+#include <cstdio>
+int main() {
+  unsigned long long x = 88172645463325252ULL, s = 0;
+  for (int i = 0; i < 300000000; i++) {
+    x ^= x << 13; x ^= x >> 7; x ^= x << 17;
+    s += x % 1000003;
+  }
+  puts(s != 1 ? "ok" : "");
+}
+"""
+
+# pointer chasing through a single random cycle (Sattolo's shuffle) over 64 MB
+MEMORY_PROGRAM = r"""
+#include <cstdio>
+#include <vector>
+int main() {
+  const int n = 1 << 24;
+  std::vector<int> next(n);
+  for (int i = 0; i < n; i++) next[i] = i;
+  unsigned x = 2463534242u;
+  for (int i = n - 1; i > 0; i--) {
+    x ^= x << 13; x ^= x >> 17; x ^= x << 5;
+    int j = x % i, t = next[i];
+    next[i] = next[j]; next[j] = t;
+  }
+  long long s = 0;
+  for (int i = 0, p = 0; i < 30000000; i++) {
+    p = next[p];
+    s += p;
+  }
+  puts(s != 1 ? "ok" : "");
+}
+"""
+
+IO_PROGRAM = r"""
+#include <cstdio>
+int main() {
+  long long s = 0;
+  int x;
+  while (scanf("%d", &x) == 1) s += x;
+  puts(s != 1 ? "ok" : "");
+}
+"""
+
+OUTPUT = b"ok\n"
+
+
+def small_input():
+  return b"0\n"
+
+
+def io_input():
+  return " ".join(str(i * 7919 % 1000003) for i in range(1000000)).encode() + b"\n"
+
+
+# name -> (code, function making the input)
+PROGRAMS = {
+  "cpu": (CPU_PROGRAM, small_input),
+  "memory": (MEMORY_PROGRAM, small_input),
+  "io": (IO_PROGRAM, io_input),
+}
+
+
+def calibration_case(case_input):
+  """
+  Write the case to the test data directory if it is not there yet
+
+  :return: fingerprint of the case
+  """
+  fingerprint = case_hash("calibration", case_input, OUTPUT)
+  for file_path, content in ((get_input_path(fingerprint), case_input), (get_output_path(fingerprint), OUTPUT)):
+    if not path.exists(file_path):
+      with open(file_path, "wb") as f:
+        f.write(content)
+  return fingerprint
+
+
+def wait_for_verdict(session, server, data, timeout=300, heartbeat=None):
+  """
+  Send a judge request and query the server until it is done
+
+  :param heartbeat: function extending the lease of the judge slot, called every HEARTBEAT_INTERVAL seconds
+  :return: the last reply: the final one, or the first one not received
+  """
+  deadline = time.time() + timeout
+  response = session.post(server.http_address + "/judge", json=data, timeout=REQUEST_TIMEOUT).json()
+  beat_time = time.time()
+  # the first reply only says that the request has been received, without a verdict
+  while response.get("status") == "received" and \
+      (response.get("verdict") is None or not SubmissionStatus.is_judged(response["verdict"])):
+    if time.time() > deadline:
+      raise RuntimeError("calibration on %s timed out" % server)
+    if heartbeat is not None and time.time() - beat_time > HEARTBEAT_INTERVAL:
+      heartbeat()
+      beat_time = time.time()
+    time.sleep(0.5)
+    response = session.get(server.http_address + "/query", json={"fingerprint": data["fingerprint"]},
+                           timeout=REQUEST_TIMEOUT).json()
+  return response
+
+
+def run_on_server(server, code, case):
+  """
+  Judge a program on one case through the judge API, holding a slot of the server
+
+  :return: running time reported by the server, in seconds, not adjusted by runtime_multiplier
+  """
+  sem = Semaphore(get_redis_connection("judge"), priority=REJUDGE, allow=[server.pk])
+  sem.acquire()
+  try:
+    session = get_session(server)
+    data = _prepare_judge_json_data(server, code, "cpp", MAX_TIME, MAX_MEMORY, False, [case], "", "", {"on": False})
+    data.update(hold=False)
+    response = wait_for_verdict(session, server, data, heartbeat=sem.heartbeat)
+    if response.get("verdict") != SubmissionStatus.ACCEPTED:
+      raise ValueError("calibration program not accepted on %s: %s" % (server, response))
+    return response["detail"][0]["time"]
+  finally:
+    sem.release()
+
+
+def measure(server, repetitions=REPETITIONS):
+  """
+  :return: dict program name -> list of seconds
+  """
+  samples = {}
+  for name, (code, make_input) in PROGRAMS.items():
+    case = calibration_case(make_input())
+    upload_case(server, case)
+    samples[name] = [run_on_server(server, code, case) for _ in range(repetitions)]
+  return samples
+
+
+def median(values):
+  values = sorted(values)
+  middle = len(values) // 2
+  return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def median_interval(values, z=1.96):
+  """
+  Distribution-free confidence interval of the median, from the order statistics around it
+  (about 95% for the default z)
+  """
+  values = sorted(values)
+  n = len(values)
+  lower = max(int(math.floor(n / 2 - z * math.sqrt(n) / 2)), 1)
+  upper = min(int(math.ceil(1 + n / 2 + z * math.sqrt(n) / 2)), n)
+  return values[lower - 1], values[upper - 1]
+
+
+def estimate(samples, baseline):
+  """
+  The multiplier is the median of (measured / baseline) over every run of every program,
+  which a few runs disturbed by other load on the server do not move
+
+  :return: (multiplier, lower, upper)
+  """
+  ratios = [seconds / baseline[name] for name, runs in samples.items() if baseline.get(name) for seconds in runs]
+  if not ratios:
+    raise ValueError("no baseline for the calibration programs, see JUDGE_CALIBRATION_BASELINE")
+  lower, upper = median_interval(ratios)
+  return median(ratios), lower, upper
+
+
+def baseline_from(server, repetitions=REPETITIONS):
+  """
+  Measure a server taken as the reference, its current runtime_multiplier being right
+
+  :return: value for JUDGE_CALIBRATION_BASELINE
+  """
+  samples = measure(server, repetitions)
+  return {name: round(median(runs) / server.runtime_multiplier, 4) for name, runs in samples.items()}
+
+
+def calibrate(server, repetitions=REPETITIONS):
+  """
+  Measure a server and record the result. It is flagged as drifted when its current multiplier is outside
+  the confidence interval and off by more than JUDGE_CALIBRATION_DRIFT; nothing is changed until applied.
+
+  :rtype: ServerCalibration
+  """
+  samples = measure(server, repetitions)
+  multiplier, lower, upper = estimate(samples, settings.JUDGE_CALIBRATION_BASELINE)
+  current = server.runtime_multiplier
+  drifted = not lower <= current <= upper and abs(multiplier / current - 1) > settings.JUDGE_CALIBRATION_DRIFT
+  if drifted:
+    logger.warning("judge server %s measures %.3f [%.3f, %.3f] against runtime multiplier %.3f",
+                   server, multiplier, lower, upper, current)
+  return ServerCalibration.objects.create(server=server, multiplier=multiplier, lower=lower, upper=upper,
+                                          previous_multiplier=current, samples=json.dumps(samples), drifted=drifted)
+
+
+def _calibrate_quietly(server):
+  try:
+    return calibrate(server)
+  except:
+    logger.error(traceback.format_exc())
+  finally:
+    connection.close()
+
+
+def calibrate_servers(server_ids=None):
+  """
+  Calibrate servers (all enabled ones by default) in parallel
+  """
+  servers = Server.objects.filter(enabled=True)
+  if server_ids is not None:
+    servers = servers.filter(pk__in=server_ids)
+  servers = list(servers)
+  if not servers:
+    return []
+  with ThreadPoolExecutor(len(servers)) as executor:
+    return list(executor.map(_calibrate_quietly, servers))
+
+
+def apply_calibration(calibration):
+  server = calibration.server
+  server.runtime_multiplier = round(calibration.multiplier, 3)
+  server.save(update_fields=["runtime_multiplier"])
+  calibration.applied = True
+  calibration.save(update_fields=["applied"])
@@ -0,0 +1,142 @@
+import json
+import logging
+import time
+import traceback
+
+from django_redis import get_redis_connection
+
+from .manage import list_spj
+from .models import Server
+
+logger = logging.getLogger(__name__)
+
+# special programs (checkers, interactors) each server has, as reported by /list/spj (version 3),
+# plus those uploaded by dispatcher.sync since
+SPJ_PREFIX = 'JUDGE:CAPABILITY:SPJ:'
+# server id -> time its programs were last listed in full; servers older than version 3 cannot list them,
+# are never indexed and are assumed to have every program
+INDEXED_KEY = 'JUDGE:CAPABILITY:INDEXED'
+REFRESH_INTERVAL = 60
+# what `capable_servers` needs to know of the enabled servers, as json, rebuilt by the health monitor
+# every check and by whoever finds it expired
+SERVERS_KEY = 'JUDGE:CAPABILITY:SERVERS'
+SERVERS_TTL = 30
+# "no capable server" is logged once in this many seconds for the same language, checker and interactor
+NO_SERVER_PREFIX = 'JUDGE:CAPABILITY:NO_SERVER:'
+NO_SERVER_LOG_INTERVAL = 600
+
+
+def _spj_key(server_id):
+  return SPJ_PREFIX + str(server_id)
+
+
+def record_programs(server, fingerprints):
+  """
+  Add special programs just uploaded to a server to its index. A sync uploads the programs of some problems only,
+  so this does not count as indexing the server: what it has is known from `refresh_server` alone.
+  """
+  fingerprints = [f for f in fingerprints if f]
+  if not fingerprints:
+    return
+  try:
+    get_redis_connection("judge").sadd(_spj_key(server.pk), *fingerprints)
+  except:
+    logger.warning(traceback.format_exc())
+
+
+def refresh_server(server):
+  """
+  Replace the index of a server with what it reports; servers that cannot list their programs are left alone
+  """
+  if server.version < 3:
+    return
+  fingerprints = list_spj(server)
+  with get_redis_connection("judge").pipeline() as pipe:
+    pipe.delete(_spj_key(server.pk))
+    if fingerprints:
+      pipe.sadd(_spj_key(server.pk), *fingerprints)
+    pipe.hset(INDEXED_KEY, str(server.pk), time.time())
+    pipe.execute()
+
+
+def index_servers(servers=None):
+  """
+  Cache the enabled servers (unless given) for `capable_servers`, which would otherwise query them every time
+
+  :return: list of {"id": server id, "languages": list or None for all, "interactor": bool}
+  """
+  if servers is None:
+    servers = list(Server.objects.filter(enabled=True))
+  records = [{"id": server.pk, "languages": server.language_list, "interactor": server.interactor}
+             for server in servers]
+  get_redis_connection("judge").set(SERVERS_KEY, json.dumps(records), ex=SERVERS_TTL)
+  return records
+
+
+def refresh_capabilities(servers=None, max_age=REFRESH_INTERVAL):
+  """
+  Refresh the index of servers (every enabled one by default) not indexed in the last `max_age` seconds,
+  and the cached list of enabled servers
+  """
+  if servers is None:
+    servers = list(Server.objects.filter(enabled=True))
+    index_servers(servers)
+  indexed = get_redis_connection("judge").hgetall(INDEXED_KEY)
+  for server in servers:
+    if time.time() - float(indexed.get(str(server.pk).encode(), 0)) < max_age:
+      continue
+    try:
+      refresh_server(server)
+    except:
+      logger.warning(traceback.format_exc())
+
+
+def can_run(server, lang, programs, interactor, present):
+  """
+  :param server: record of the server, see `index_servers`
+  :param programs: fingerprints of the checker and interactor
+  :param present: fingerprints of `programs` the server has, None if it has never been indexed
+  """
+  if server["languages"] is not None and lang not in server["languages"]:
+    return False
+  if interactor and not server["interactor"]:
+    return False
+  return present is None or set(programs) <= present
+
+
+def capable_servers(lang, checker, interactor):
+  """
+  Servers able to judge a submission right away: they run its language, support interactors if it needs one,
+  and have its checker and interactor. Servers never indexed are assumed to have every program.
+
+  :return: list of server ids to pass as `allow` to a Semaphore, empty (any server) if none of them qualifies
+  """
+  programs = [p for p in (checker, interactor) if p]
+  try:
+    client = get_redis_connection("judge")
+    with client.pipeline() as pipe:
+      pipe.get(SERVERS_KEY)
+      pipe.hgetall(INDEXED_KEY)
+      cached, indexed = pipe.execute()
+    servers = json.loads(cached.decode()) if cached else index_servers()
+    servers = [server for server in servers if can_run(server, lang, programs, interactor, None)]
+    with client.pipeline() as pipe:
+      for server in servers:
+        for program in programs:
+          pipe.sismember(_spj_key(server["id"]), program)
+      flags = iter(pipe.execute())
+  except:
+    logger.warning(traceback.format_exc())
+    return []
+  allow = []
+  for server in servers:
+    present = set(program for program in programs if next(flags))
+    if str(server["id"]).encode() not in indexed:
+      present = None
+    if can_run(server, lang, programs, interactor, present):
+      allow.append(server["id"])
+  if not allow and client.set(NO_SERVER_PREFIX + ":".join((lang, checker or '-', interactor or '-')), 1,
+                              nx=True, ex=NO_SERVER_LOG_INTERVAL):
+    logger.warning("no judge server can run %s with checker %s and interactor %s right away",
+                   lang, checker or '-', interactor or '-')
+  return allow
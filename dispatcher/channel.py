@@ -0,0 +1,59 @@
+import json
+
+from django.conf import settings
+from django.urls import reverse
+
+WATCH_PREFIX = 'JUDGE:WATCH:'
+PUSH_PREFIX = 'JUDGE:PUSH:'
+
+
+def push_enabled():
+  return bool(settings.JUDGE_CALLBACK_HOST)
+
+
+def callback_url(fingerprint):
+  return settings.JUDGE_CALLBACK_HOST.rstrip('/') + reverse('judge_callback', args=(fingerprint,))
+
+
+def open_channel(client, fingerprint, timeout, server_id):
+  """
+  Register a fingerprint as being watched, so that pushes for it from the server judging it are accepted
+  """
+  client.set(WATCH_PREFIX + fingerprint, server_id, ex=int(timeout) + 60)
+
+
+def watching_server(client, fingerprint):
+  """
+  :return: id of the server a watched fingerprint has been sent to, None if nobody is watching it
+  """
+  server_id = client.get(WATCH_PREFIX + fingerprint)
+  return int(server_id) if server_id is not None else None
+
+
+def close_channel(client, fingerprint):
+  client.delete(WATCH_PREFIX + fingerprint, PUSH_PREFIX + fingerprint)
+
+
+def push_result(client, fingerprint, data):
+  """
+  :return: False if nobody is watching this fingerprint
+  """
+  if not client.exists(WATCH_PREFIX + fingerprint):
+    return False
+  with client.pipeline() as pipe:
+    pipe.rpush(PUSH_PREFIX + fingerprint, json.dumps(data))
+    pipe.expire(PUSH_PREFIX + fingerprint, 3600)
+    pipe.execute()
+  return True
+
+
+def wait_result(client, fingerprint, wait):
+  """
+  Block for at most `wait` seconds until the judge server pushes something
+
+  :return: the pushed data as a dict, or None if nothing arrived in time
+  """
+  pair = client.blpop(PUSH_PREFIX + fingerprint, max(int(wait), 1))
+  if pair is None:
+    return None
+  return json.loads(pair[1].decode())
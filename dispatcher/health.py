@@ -0,0 +1,97 @@
+import json
+import logging
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django_redis import get_redis_connection
+
+from dispatcher.manage import ping
+from dispatcher.models import Server
+from dispatcher.capability import refresh_capabilities
+from dispatcher.semaphore import Semaphore
+
+logger = logging.getLogger(__name__)
+
+HEALTH_KEY = 'JUDGE:HEALTH'
+CHECK_INTERVAL = 10
+# records not refreshed for this many seconds are left by a monitor that has stopped, and tell nothing
+STALE_AFTER = 3 * CHECK_INTERVAL
+# circuit breaker: evict a server after this many failed pings in a row, restore it after this many successes
+EVICT_AFTER = 3
+RESTORE_AFTER = 2
+
+
+def _timed_ping(server):
+  start = time.time()
+  ok = ping(server)
+  return ok, time.time() - start
+
+
+def check_servers(servers=None):
+  """
+  Ping every enabled server concurrently, record the result in Redis, and evict or restore
+  the slots of servers whose health has changed.
+
+  :return: dict server id -> health record
+  """
+  if servers is None:
+    servers = list(Server.objects.filter(enabled=True))
+  if not servers:
+    return {}
+  client = get_redis_connection("judge")
+  with ThreadPoolExecutor(len(servers)) as executor:
+    results = list(executor.map(_timed_ping, servers))
+  previous = get_health(servers, client, include_stale=True)
+  sem = Semaphore(client)
+  health = {}
+  for server, (ok, latency) in zip(servers, results):
+    record = previous.get(server.pk) or {"evicted": False, "successes": 0, "failures": 0}
+    record.update(ok=ok, latency=latency, checked=time.time())
+    if ok:
+      record["successes"], record["failures"] = record["successes"] + 1, 0
+    else:
+      record["successes"], record["failures"] = 0, record["failures"] + 1
+    try:
+      if not record["evicted"] and record["failures"] >= EVICT_AFTER:
+        sem.evict_server(server)
+        record["evicted"] = True
+        logger.warning("judge server %s is down, evicted from the semaphore", server)
+      elif record["evicted"] and record["successes"] >= RESTORE_AFTER:
+        sem.restore_server(server)
+        record["evicted"] = False
+        logger.warning("judge server %s is back, restored to the semaphore", server)
+    except:
+      logger.error(traceback.format_exc())
+    health[server.pk] = record
+  client.hmset(HEALTH_KEY, {str(k): json.dumps(v) for k, v in health.items()})
+  return health
+
+
+def get_health(servers, client=None, include_stale=False):
+  """
+  :param include_stale: also return records older than STALE_AFTER
+  :return: dict server id -> last health record, missing if the server has never been checked
+           or (unless include_stale) has not been checked lately
+  """
+  if not servers:
+    return {}
+  client = client or get_redis_connection("judge")
+  records = client.hmget(HEALTH_KEY, [str(server.pk) for server in servers])
+  health = {server.pk: json.loads(record.decode()) for server, record in zip(servers, records) if record}
+  if not include_stale:
+    now = time.time()
+    health = {k: v for k, v in health.items() if now - v.get("checked", 0) <= STALE_AFTER}
+  return health
+
+
+def run_monitor():
+  while True:
+    try:
+      check_servers()
+      # in case no one has acquired or released a slot lately
+      Semaphore(get_redis_connection("judge")).sweep()
+      refresh_capabilities()
+    except:
+      logger.error(traceback.format_exc())
+    time.sleep(CHECK_INTERVAL)
@@ -3,20 +3,27 @@ import time
 import traceback
 from datetime import datetime
 
-import requests
 from django.conf import settings
 from django.core.mail import send_mail
 from django_redis import get_redis_connection
+from requests import RequestException
 
+from dispatcher.capability import capable_servers
+from dispatcher.memo import memo_key, memoizable, get_memo, set_memo
+from dispatcher.metrics import record_dispatch, record_verdict, record_error
 from dispatcher.models import Server
-from dispatcher.semaphore import Semaphore
+from dispatcher.scheduler import record_judge_result, record_hedge
+from dispatcher.semaphore import Semaphore, PRACTICE, HEARTBEAT_INTERVAL, LEASE_TTL
+from dispatcher.session import get_session
+from dispatcher.channel import push_enabled, callback_url, open_channel, close_channel, wait_result
 from utils import random_string
 from utils.detail_formatter import add_timestamp_to_reply
 from utils.site_settings import nonstop_judge
-from .manage import DEFAULT_USERNAME
 
 logger = logging.getLogger(__name__)
 
+PUSH_WAIT_INTERVAL = 5
+
 
 def process_runtime(server, data):
   try:
@@ -28,58 +35,321 @@ def process_runtime(server, data):
     pass
 
 
+class JudgeStalled(Exception):
+  """ Raised when a judge server has made no progress within the hedging window
+  """
+
+
+def hedge_window(max_time, cases):
+  """
+  Seconds a judge server may go without progress before the submission is sent elsewhere:
+  time limit (in ms) * case count * JUDGE_HEDGE_FACTOR, but at least JUDGE_HEDGE_MIN_SECONDS
+  """
+  return max(settings.JUDGE_HEDGE_MIN_SECONDS, max_time / 1000 * max(len(cases), 1) * settings.JUDGE_HEDGE_FACTOR)
+
+
+def judge_progress(response):
+  """
+  What has to change between two replies of a judge server for it to count as progress
+  """
+  return response.get('status'), response.get('verdict'), len(response.get('detail') or [])
+
+
+def exclusion(deny, allow=None):
+  """
+  Servers in `deny` as a list to keep a Semaphore away from, or nothing if that would leave no server at all
+  (among those in `allow`, if given)
+  """
+  deny = list(deny or [])
+  servers = Server.objects.filter(enabled=True)
+  if allow:
+    servers = servers.filter(pk__in=allow)
+  if deny and not servers.exclude(pk__in=deny).exists():
+    return []
+  return deny
+
+
+def hedge_exclusion(sem, server):
+  """
+  Keep the next acquire of `sem` away from `server` as well
+  """
+  sem.deny = exclusion(sem.deny + [server.pk], sem.allow)
+
+
+def judge_semaphore(client, lang, checker, interactor, priority, avoid_servers):
+  """
+  The Semaphore a judgement acquires its slots with: servers able to run it right away, `avoid_servers` last
+  """
+  allow = capable_servers(lang, checker, interactor)
+  return Semaphore(client, priority=priority, allow=allow, deny=exclusion(avoid_servers, allow))
+
+
+def token_server(token):
+  """
+  :return: the server a judge slot belongs to
+  """
+  return Server.objects.get(pk=int(token.decode().split(":")[0]))
+
+
+def record_stalled(sem, server, lang, window):
+  """
+  Bookkeeping of an attempt given up for lack of progress, before the submission is sent elsewhere
+  """
+  logger.warning("judge server %s made no progress in %.0f seconds, re-dispatching", server, window)
+  record_hedge(server)
+  record_error(server, lang, "hedge")
+  hedge_exclusion(sem, server)
+
+
+def record_failed(server, lang):
+  """
+  :param server: None if the attempt failed before a server was known
+  """
+  if server is not None:
+    record_judge_result(server, failed=True)
+  record_error(server, lang, "failure")
+
+
+class JudgeWatch(object):
+  """
+  The protocol of judging on one server, apart from the transport: the request to send, what to make of the
+  replies, when to heartbeat, when to give up and what to record at the end. `_watch_on_server` drives it with
+  blocking calls, `dispatcher.aio.AsyncDispatcher` with coroutines; neither decides anything on its own.
+
+  :param window: JudgeStalled is raised if there is no progress in this many seconds, None to wait until the deadline
+  """
+
+  def __init__(self, server, code, lang, max_time, max_memory, run_until_complete, cases, checker, interactor,
+               group_config, deadline, window, key):
+    self.server = server
+    self.lang = lang
+    self.deadline = deadline
+    self.window = window
+    self.key = key
+    self.data = _prepare_judge_json_data(server, code, lang, max_time, max_memory, run_until_complete, cases,
+                                         checker, interactor, group_config)
+    self.data.update(hold=False)
+    self.fingerprint = self.data['fingerprint']
+    self.timeout = max(deadline - time.time(), 1)
+    self.use_push = push_enabled()
+    if self.use_push:
+      self.data.update(callback_url=callback_url(self.fingerprint))
+    self.start_time = time.time()
+    self.last_progress, self.progress_time = None, self.start_time
+    self.beat_time = self.start_time
+    self.polls = 0
+
+  def url(self, path):
+    return self.server.http_address + path
+
+  @property
+  def query(self):
+    return {'fingerprint': self.fingerprint}
+
+  @property
+  def request_timeout(self):
+    """
+    Requests are made right after a heartbeat, and must not outlast the lease it extends
+    """
+    return max(min(self.deadline - time.time(), LEASE_TTL - HEARTBEAT_INTERVAL), 1)
+
+  @property
+  def query_timeout(self):
+    return self.request_timeout if self.window is None else min(self.request_timeout, self.window)
+
+  def first_reply(self, response):
+    """
+    :return: the reply to /judge for the callback if the request has not been taken, None otherwise
+    """
+    response = add_timestamp_to_reply(response)
+    process_runtime(self.server, response)
+    return response if response.get('status') != 'received' else None
+
+  def running(self):
+    return time.time() < self.deadline
+
+  def heartbeat_due(self):
+    if time.time() - self.beat_time > HEARTBEAT_INTERVAL:
+      self.beat()
+      return True
+    return False
+
+  def beat(self):
+    """
+    Note a heartbeat; one is taken before every request of `request_timeout` that is not part of polling
+    """
+    self.beat_time = time.time()
+
+  def polled(self, error=None):
+    """
+    Count a query; a failed one is tolerated while hedging, where the lack of progress will tell
+    """
+    self.polls += 1
+    if error is not None and self.window is None:
+      raise error
+
+  def receive(self, response):
+    """
+    :return: the reply for the callback
+    """
+    response = add_timestamp_to_reply(response)
+    process_runtime(self.server, response)
+    if judge_progress(response) != self.last_progress:
+      self.last_progress, self.progress_time = judge_progress(response), time.time()
+    return response
+
+  def check_stalled(self):
+    if self.window is not None and time.time() - self.progress_time > self.window:
+      raise JudgeStalled
+
+  def complete(self, client, response, report, report_instance):
+    """
+    Store the report of the final reply, record metrics and memoize it
+    """
+    report_instance.set_content(report)
+    report_instance.save()
+    record_judge_result(self.server, seconds=time.time() - self.start_time)
+    record_verdict(self.server, self.lang, response.get('verdict'), time.time() - self.start_time, self.polls)
+    if memoizable(response):
+      set_memo(client, self.key, response, report)
+
+
 def send_judge_through_watch(code, lang, max_time, max_memory, run_until_complete, cases, checker,
-                             interactor, group_config, callback, timeout=900, report_instance=None):
+                             interactor, group_config, callback, timeout=900, report_instance=None, priority=PRACTICE,
+                             memoize=False, avoid_servers=None, queued_at=None):
   """
   :param interactor: None or '' if there is no interactor
   :param callback: function, to call when something is returned (possibly preliminary results)
                    callback should return True when it thinks the result is final result, return False otherwise
                    callback will receive exactly one param, which is the data returned by judge server as a dict
   :param timeout: will fail if it has not heard from judge server for `timeout` seconds
+  :param priority: one of dispatcher.semaphore.PRIORITY_CLASSES
+  :param memoize: complete right away with the result of an earlier identical judgement, if there is one
+                  (see dispatcher.memo); every completed judgement is remembered regardless
+  :param avoid_servers: ids of servers not to judge on unless there are no others, e.g. ones still receiving data
+  :param queued_at: timestamp since which the submission has been waiting, for metrics; now by default
+
+  Only servers that can run the submission right away (language, interactor support, checker and interactor
+  present) are used, see `dispatcher.capability`.
+
+  When JUDGE_CALLBACK_HOST is configured, the judge server is asked to push results to
+  `dispatcher.views.judge_callback`, and this worker sleeps on the push channel instead of polling.
+
+  If a server makes no progress within `hedge_window`, its slot is released and the submission is sent to
+  another server, at most JUDGE_HEDGE_MAX_ATTEMPTS times. The stalled fingerprint is no longer watched,
+  so whatever the stalled server reports later never reaches the callback; replies that still race in are
+  older than the final verdict and dropped by the `judge_end_time` guard of the callback.
   """
 
+  queued_at = queued_at or time.time()
   redis_server = get_redis_connection("judge")
+  key = memo_key(code, lang, max_time, max_memory, run_until_complete, cases, checker, interactor, group_config)
+  if memoize and complete_from_memo(redis_server, key, callback, report_instance):
+    return
+  sem = judge_semaphore(redis_server, lang, checker, interactor, priority, avoid_servers)
+  window = hedge_window(max_time, cases)
+  deadline = time.time() + timeout
 
-  with Semaphore(redis_server, stale_client_timeout=60) as (sem, token):
+  for attempt in range(settings.JUDGE_HEDGE_MAX_ATTEMPTS + 1):
+    token = sem.acquire()
+    server = None
     try:
-      server = Server.objects.get(pk=int(token.decode().split(":")[0]))
-
-      data = _prepare_judge_json_data(server, code, lang, max_time, max_memory, run_until_complete, cases,
-                                      checker, interactor, group_config)
-      data.update(hold=False)
-      judge_url = server.http_address + '/judge'
-      watch_url = server.http_address + '/query'
-      watch_report = server.http_address + '/query/report'
-      timeout_count = 0
-
-      response = add_timestamp_to_reply(requests.post(judge_url, json=data, auth=(DEFAULT_USERNAME, server.token),
-                                                      timeout=timeout).json())
-      process_runtime(server, response)
-      if response.get('status') != 'received':
-        callback(response)
-      while timeout_count < timeout:
-        interval = 0.5
-        time.sleep(interval)
-        response = add_timestamp_to_reply(requests.get(watch_url, json={'fingerprint': data['fingerprint']},
-                                                       auth=(DEFAULT_USERNAME, server.token),
-                                                       timeout=timeout).json())
-        process_runtime(server, response)
+      server = token_server(token)
+      if attempt == 0:
+        record_dispatch(server, lang, queued_at)
+      _watch_on_server(server, redis_server, code, lang, max_time, max_memory, run_until_complete, cases,
+                       checker, interactor, group_config, callback, deadline, report_instance,
+                       window if attempt < settings.JUDGE_HEDGE_MAX_ATTEMPTS else None, key, sem.heartbeat)
+      return
+    except JudgeStalled:
+      record_stalled(sem, server, lang, window)
+    except:
+      record_failed(server, lang)
+      report_judge_failure(callback)
+      return
+    finally:
+      sem.release()
+
+
+def _watch_on_server(server, redis_server, code, lang, max_time, max_memory, run_until_complete, cases, checker,
+                     interactor, group_config, callback, deadline, report_instance, window, key, heartbeat):
+  """
+  Judge on `server` until the callback sees the final result, which is then memoized under `key`;
+  the blocking transport of `JudgeWatch`
+
+  :param heartbeat: function extending the lease of the judge slot, called every HEARTBEAT_INTERVAL seconds
+  """
+  watch = JudgeWatch(server, code, lang, max_time, max_memory, run_until_complete, cases, checker, interactor,
+                     group_config, deadline, window, key)
+  session = get_session(server)
+  if watch.use_push:
+    open_channel(redis_server, watch.fingerprint, watch.timeout, server.pk)
+
+  try:
+    heartbeat()
+    watch.beat()
+    reply = watch.first_reply(session.post(watch.url('/judge'), json=watch.data,
+                                           timeout=watch.request_timeout).json())
+    if reply is not None:
+      callback(reply)
+    while watch.running():
+      if watch.heartbeat_due():
+        heartbeat()
+      if watch.use_push:
+        # wake up only when the judge server pushes something; query once in a while
+        # in case the push got lost or the server does not support it
+        response = wait_result(redis_server, watch.fingerprint, PUSH_WAIT_INTERVAL)
+      else:
+        time.sleep(0.5)
+        response = None
+      if response is None:
+        try:
+          response = session.get(watch.url('/query'), json=watch.query, timeout=watch.query_timeout).json()
+          watch.polled()
+        except (RequestException, ValueError) as e:
+          watch.polled(e)
+      if response is not None:
+        response = watch.receive(response)
         if callback(response):
-          report_instance.content = requests.get(watch_report, json={'fingerprint': data['fingerprint']},
-                                                 auth=(DEFAULT_USERNAME, server.token), timeout=timeout).text
-          report_instance.save()
+          heartbeat()
+          watch.beat()
+          report = session.get(watch.url('/query/report'), json=watch.query, timeout=watch.request_timeout).text
+          watch.complete(redis_server, response, report, report_instance)
           break
-        timeout_count += interval
-        interval += 0.1
-      if timeout_count >= timeout:
-        raise RuntimeError("Send judge through socketio timed out.")
-    except:
-      msg = "Time: %s\n%s" % (datetime.now(), traceback.format_exc())
-      logger.error(msg)
-      send_mail(subject="Submit fail notice", message=msg, from_email=None,
-                recipient_list=settings.ADMIN_EMAIL_LIST,
-                fail_silently=True)
-      callback(add_timestamp_to_reply({"status": "reject", "message": msg}))
+      watch.check_stalled()
+    else:
+      raise RuntimeError("Send judge through socketio timed out.")
+  finally:
+    if watch.use_push:
+      close_channel(redis_server, watch.fingerprint)
+
+
+def complete_from_memo(client, key, callback, report_instance):
+  """
+  :return: True if a memoized result has been handed to the callback
+  """
+  memo = get_memo(client, key)
+  if memo is None or not memoizable(memo[0]):  # errors memoized before they were kept out
+    return False
+  response, report = memo
+  response.update(memoized=True)
+  if not callback(add_timestamp_to_reply(response)):
+    return False
+  report_instance.set_content(report)
+  report_instance.save()
+  return True
+
+
+def report_judge_failure(callback, exc_text=None):
+  """
+  Notify admins of the exception being handled (or `exc_text`), and tell the callback that judging has failed
+  """
+  msg = "Time: %s\n%s" % (datetime.now(), exc_text or traceback.format_exc())
+  logger.error(msg)
+  send_mail(subject="Submit fail notice", message=msg, from_email=None,
+            recipient_list=settings.ADMIN_EMAIL_LIST,
+            fail_silently=True)
+  callback(add_timestamp_to_reply({"status": "reject", "message": msg}))
 
 
 def _prepare_judge_json_data(server, code, lang, max_time, max_memory, run_until_complete, cases, checker, interactor,
@@ -1,17 +1,14 @@
 from os import path
 
-import requests
-from django.conf import settings
-
+from problem.models.problem import get_input_path, get_output_path
+from .session import get_session
 from .utils import is_success_response
 
-DEFAULT_USERNAME = 'ejudge'
-
 
 def ping(server):
   url = server.http_address + '/ping'
   try:
-    if requests.get(url).text == "pong":
+    if get_session(server).get(url, timeout=5).text == "pong":
       return True
     return False
   except:
@@ -26,7 +23,7 @@ def update_token(server, new_password):
   if server.version >= 3:
     return
   url = server.http_address + '/config/token'
-  res = requests.post(url, json={'token': new_password}, auth=(DEFAULT_USERNAME, server.token)).json()
+  res = get_session(server).post(url, json={'token': new_password}).json()
   if is_success_response(res):
     server.token = new_password
     server.save(update_fields=['token'])
@@ -34,40 +31,52 @@ def update_token(server, new_password):
   return False
 
 
+def case_exists(server, case):
+  return bool(get_session(server).get(server.http_address + '/exist/case/%s' % case).json().get('exist'))
+
+
+def stream_case(server, case):
+  """
+  Upload the input and output of a case, streamed from disk block by block rather than read into memory
+
+  :return: bytes sent
+  """
+  session = get_session(server)
+  sent = 0
+  for kind, file_path in (('input', get_input_path(case)), ('output', get_output_path(case))):
+    with open(file_path, 'rb') as f:
+      res = session.post(server.http_address + '/upload/case/%s/%s' % (case, kind), data=f).json()
+    if not is_success_response(res):
+      raise ValueError("%s %s: %s" % (case, kind, res))
+    sent += path.getsize(file_path)
+  return sent
+
+
 def upload_case(server, case):
   if server.version >= 3:
     return
-  url_check_exist = server.http_address + '/exist/case/%s' % case
-  url_input = server.http_address + '/upload/case/%s/input' % case
-  url_output = server.http_address + '/upload/case/%s/output' % case
-  if requests.get(url_check_exist).json().get('exist'):
+  if case_exists(server, case):
     return True
-  with open(path.join(settings.TESTDATA_DIR, 'in', case[:2], case[2:4], case), 'rb') as inf, \
-      open(path.join(settings.TESTDATA_DIR, 'out', case[:2], case[2:4], case), 'rb') as ouf:
-    # NOTE: path slice and concat is unsafe, needs refactor
-    res1 = requests.post(url_input, data=inf.read(), auth=(DEFAULT_USERNAME, server.token)).json()
-    res2 = requests.post(url_output, data=ouf.read(), auth=(DEFAULT_USERNAME, server.token)).json()
-  if not is_success_response(res1) and is_success_response(res2):
-    raise ValueError("%s; %s" % (res1, res2))
+  stream_case(server, case)
 
 
 def upload_spj(server, sp):
   if not server.master:
     return {"status": "received"}
   url = server.http_address + "/upload/spj"
-  return requests.post(url, json={
+  return get_session(server).post(url, json={
     'fingerprint': sp.fingerprint,
     'lang': sp.lang,
     'code': sp.code
-  }, auth=(DEFAULT_USERNAME, server.token)).json()
+  }).json()
 
 
 def _upload_special_program(server, url, sp):
-  return requests.post(url, json={
+  return get_session(server).post(url, json={
     'fingerprint': sp.fingerprint,
     'lang': sp.lang,
     'code': sp.code
-  }, auth=(DEFAULT_USERNAME, server.token)).json()
+  }).json()
 
 
 def upload_checker(server, checker):
@@ -103,7 +112,7 @@ def list_spj(server):
   if server.version <= 2:
     return []
   else:
-    res = requests.get(server.http_address + "/list/spj", auth=(DEFAULT_USERNAME, server.token)).json()
+    res = get_session(server).get(server.http_address + "/list/spj").json()
     if not is_success_response(res):
       raise ValueError(str(res))
     return set(pr[:pr.rfind(".")] for pr in res["spj"])
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import logging
+import traceback
+
+from django.conf import settings
+
+from submission.util import SubmissionStatus
+
+MEMO_PREFIX = 'JUDGE:MEMO:'
+MEMO_STATS_KEY = 'JUDGE:MEMO_STATS'
+# verdicts telling about the judge rather than the program; judging again may well end otherwise
+UNSTABLE_VERDICTS = (SubmissionStatus.SYSTEM_ERROR, SubmissionStatus.JUDGE_ERROR)
+
+logger = logging.getLogger(__name__)
+
+
+def memo_key(code, lang, max_time, max_memory, run_until_complete, cases, checker, interactor, group_config):
+  """
+  Content address of a judgement. Cases, checkers and interactors are already named by the hash of their
+  content, so two judgements with the same key run the same program on the same data.
+  """
+  payload = json.dumps([code, lang, max_time, max_memory, bool(run_until_complete), list(cases),
+                        checker or '', interactor or '', group_config], sort_keys=True)
+  return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_memo(client, key):
+  """
+  :return: (final reply of the judge server, report) or None
+  """
+  try:
+    raw = client.get(MEMO_PREFIX + key)
+    client.hincrby(MEMO_STATS_KEY, 'hits' if raw else 'misses', 1)
+    if raw is None:
+      return None
+    memo = json.loads(raw.decode())
+    return memo["response"], memo["report"]
+  except:
+    logger.warning(traceback.format_exc())
+    return None
+
+
+def memoizable(response):
+  """
+  :return: whether a final reply is worth replaying for the same judgement
+  """
+  return response.get('status') == 'received' and response.get('verdict') not in UNSTABLE_VERDICTS
+
+
+def set_memo(client, key, response, report):
+  try:
+    response = {k: v for k, v in response.items() if k != 'timestamp'}
+    client.set(MEMO_PREFIX + key, json.dumps({"response": response, "report": report}), ex=settings.JUDGE_MEMO_TTL)
+    client.hincrby(MEMO_STATS_KEY, 'stores', 1)
+  except:
+    logger.warning(traceback.format_exc())
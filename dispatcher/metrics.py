@@ -0,0 +1,197 @@
+import logging
+import time
+import traceback
+from collections import Counter, defaultdict
+
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = 'JUDGE:METRICS:'
+
+SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name -> (type, help, buckets)
+METRICS = {
+  "judge_queue_wait_seconds": ("histogram", "Submission created (or handed to the dispatcher) to judge slot acquired",
+                               SECONDS_BUCKETS),
+  "judge_turnaround_seconds": ("histogram", "Judge slot acquired to final verdict", SECONDS_BUCKETS),
+  "judge_polls": ("histogram", "Queries sent to the judge server per judgement", COUNT_BUCKETS),
+  "judge_verdicts_total": ("counter", "Final verdicts", None),
+  "judge_errors_total": ("counter", "Judgements failed or taken away from a server", None),
+}
+
+
+def _label_key(labels):
+  return ','.join('%s=%s' % (k, labels[k]) for k in sorted(labels))
+
+
+def _parse_label_key(key):
+  return dict(item.split('=', 1) for item in key.split(',') if item)
+
+
+def observe(name, value, **labels):
+  """
+  Add a sample to a histogram. Buckets are stored non-cumulatively in one Redis hash per metric,
+  under "<labels>|<upper bound>", next to "<labels>|sum" and "<labels>|count".
+  """
+  _, _, buckets = METRICS[name]
+  key = _label_key(labels)
+  bound = next((b for b in buckets if value <= b), '+Inf')
+  try:
+    with get_redis_connection("judge").pipeline() as pipe:
+      pipe.hincrby(METRICS_PREFIX + name, '%s|%s' % (key, bound), 1)
+      pipe.hincrbyfloat(METRICS_PREFIX + name, '%s|sum' % key, value)
+      pipe.hincrby(METRICS_PREFIX + name, '%s|count' % key, 1)
+      pipe.execute()
+  except:
+    logger.warning(traceback.format_exc())
+
+
+def inc(name, amount=1, **labels):
+  try:
+    get_redis_connection("judge").hincrby(METRICS_PREFIX + name, _label_key(labels), amount)
+  except:
+    logger.warning(traceback.format_exc())
+
+
+def record_dispatch(server, lang, queued_at):
+  observe("judge_queue_wait_seconds", max(time.time() - queued_at, 0), server=server.pk, lang=lang)
+
+
+def record_verdict(server, lang, verdict, seconds, polls):
+  observe("judge_turnaround_seconds", seconds, server=server.pk, lang=lang)
+  observe("judge_polls", polls, server=server.pk)
+  inc("judge_verdicts_total", server=server.pk, lang=lang, verdict=verdict)
+
+
+def record_error(server, lang, kind):
+  """
+  :param kind: "failure" or "hedge"
+  """
+  inc("judge_errors_total", server=server.pk if server is not None else 0, lang=lang, kind=kind)
+
+
+def read_metrics(client=None):
+  """
+  :return: dict name -> list of (labels, value); value is an int for counters,
+           and {"buckets": [(bound, cumulative count)...], "sum": float, "count": int} for histograms
+  """
+  client = client or get_redis_connection("judge")
+  with client.pipeline() as pipe:
+    for name in METRICS:
+      pipe.hgetall(METRICS_PREFIX + name)
+    raw = dict(zip(METRICS, pipe.execute()))
+  result = {}
+  for name, (kind, _, buckets) in METRICS.items():
+    fields = {k.decode(): v.decode() for k, v in raw[name].items()}
+    if kind == "counter":
+      result[name] = [(_parse_label_key(k), int(v)) for k, v in sorted(fields.items())]
+      continue
+    series = defaultdict(dict)
+    for field, value in fields.items():
+      key, _, part = field.rpartition('|')
+      series[key][part] = value
+    result[name] = []
+    for key, parts in sorted(series.items()):
+      cumulative, counts = 0, []
+      for bound in list(buckets) + ['+Inf']:
+        cumulative += int(parts.get(str(bound), 0))
+        counts.append((bound, cumulative))
+      result[name].append((_parse_label_key(key), {"buckets": counts, "sum": float(parts.get('sum', 0)),
+                                                   "count": int(parts.get('count', 0))}))
+  return result
+
+
+def quantile(histogram, q):
+  """
+  Estimate a quantile from histogram buckets by linear interpolation, like Prometheus' histogram_quantile
+  """
+  total = histogram["count"]
+  if not total:
+    return None
+  rank, lower, previous = q * total, 0., 0
+  for bound, cumulative in histogram["buckets"]:
+    if cumulative >= rank:
+      if bound == '+Inf':
+        return lower
+      if cumulative == previous:
+        return float(bound)
+      return lower + (float(bound) - lower) * (rank - previous) / (cumulative - previous)
+    lower, previous = float(bound), cumulative
+  return lower
+
+
+def _merge(histograms):
+  merged = None
+  for histogram in histograms:
+    if merged is None:
+      merged = {"buckets": list(histogram["buckets"]), "sum": histogram["sum"], "count": histogram["count"]}
+      continue
+    merged["buckets"] = [(bound, a + b) for (bound, a), (_, b) in zip(merged["buckets"], histogram["buckets"])]
+    merged["sum"] += histogram["sum"]
+    merged["count"] += histogram["count"]
+  return merged
+
+
+def summarize(metrics, by):
+  """
+  Aggregate the metrics over every label but `by` ("server" or "lang")
+
+  :return: dict label value -> {"queue_wait": (p50, p95), "turnaround": (p50, p95), "polls": average or None,
+           "verdicts": {verdict: count}, "judged": int, "errors": {kind: count}, "error_rate": float or None}
+  """
+  groups = defaultdict(lambda: defaultdict(list))
+  for name, series in metrics.items():
+    for labels, value in series:
+      if by in labels:
+        groups[labels[by]][name].append((labels, value))
+  result = {}
+  for group, series in groups.items():
+    row = {}
+    for field, name in (("queue_wait", "judge_queue_wait_seconds"), ("turnaround", "judge_turnaround_seconds")):
+      histogram = _merge(value for _, value in series[name])
+      row[field] = (quantile(histogram, .5), quantile(histogram, .95)) if histogram else (None, None)
+    polls = _merge(value for _, value in series["judge_polls"])
+    row["polls"] = polls["sum"] / polls["count"] if polls and polls["count"] else None
+    row["verdicts"], row["errors"] = Counter(), Counter()
+    for labels, value in series["judge_verdicts_total"]:
+      row["verdicts"][labels.get("verdict")] += value
+    for labels, value in series["judge_errors_total"]:
+      row["errors"][labels.get("kind")] += value
+    row["judged"] = sum(row["verdicts"].values())
+    attempts = row["judged"] + sum(row["errors"].values())
+    row["error_rate"] = sum(row["errors"].values()) / attempts if attempts else None
+    result[group] = row
+  return result
+
+
+def render_prometheus(metrics=None):
+  """
+  Metrics in the Prometheus text exposition format
+  """
+  metrics = metrics or read_metrics()
+  lines = []
+  for name, (kind, help_text, _) in METRICS.items():
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s %s' % (name, kind))
+    for labels, value in metrics[name]:
+      if kind == "counter":
+        lines.append('%s%s %d' % (name, _format_labels(labels), value))
+        continue
+      for bound, cumulative in value["buckets"]:
+        lines.append('%s_bucket%s %d' % (name, _format_labels(dict(labels, le=bound)), cumulative))
+      lines.append('%s_sum%s %f' % (name, _format_labels(labels), value["sum"]))
+      lines.append('%s_count%s %d' % (name, _format_labels(labels), value["count"]))
+  return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+  if not labels:
+    return ''
+  return '{%s}' % ','.join('%s="%s"' % (k, str(labels[k]).replace('"', '\\"')) for k in sorted(labels))
+
+
+def reset_metrics():
+  get_redis_connection("judge").delete(*[METRICS_PREFIX + name for name in METRICS])
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.17 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatcher', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serverproblemstatus',
+            name='last_bytes',
+            field=models.BigIntegerField(default=0, verbose_name='上次同步字节数'),
+        ),
+        migrations.AddField(
+            model_name='serverproblemstatus',
+            name='last_seconds',
+            field=models.FloatField(default=0, verbose_name='上次同步耗时'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.17 on 2026-10-18 15:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatcher', '0002_serverproblemstatus_sync_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServerCalibration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('multiplier', models.FloatField(verbose_name='测得系数')),
+                ('lower', models.FloatField(verbose_name='置信下界')),
+                ('upper', models.FloatField(verbose_name='置信上界')),
+                ('previous_multiplier', models.FloatField(verbose_name='原系数')),
+                ('samples', models.TextField(blank=True)),
+                ('drifted', models.BooleanField(default=False)),
+                ('applied', models.BooleanField(default=False)),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calibrations', to='dispatcher.Server')),
+            ],
+            options={
+                'ordering': ['-create_time'],
+            },
+        ),
+    ]
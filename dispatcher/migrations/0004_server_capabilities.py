@@ -0,0 +1,23 @@
+# Generated by Django 2.2.17 on 2026-10-18 16:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatcher', '0003_servercalibration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='server',
+            name='interactor',
+            field=models.BooleanField(default=True, verbose_name='支持交互题'),
+        ),
+        migrations.AddField(
+            model_name='server',
+            name='languages',
+            field=models.CharField(blank=True, help_text='逗号分隔, 如 cpp,python; 留空表示全部', max_length=128, verbose_name='支持语言'),
+        ),
+    ]
@@ -16,6 +16,9 @@ class Server(models.Model):
   runtime_multiplier = models.FloatField("运行时间调整系数", default=1)
   version = models.PositiveIntegerField("判题机版本")
   master = models.BooleanField("主节点", default=True)
+  languages = models.CharField("支持语言", max_length=128, blank=True,
+                               help_text="逗号分隔, 如 cpp,python; 留空表示全部")
+  interactor = models.BooleanField("支持交互题", default=True)
 
   def __str__(self):
     return self.name + ' - ' + self.ip
@@ -27,12 +30,39 @@ class Server(models.Model):
   def http_address(self):
     return 'http://' + self.ip + ':' + str(self.port)
 
+  @property
+  def language_list(self):
+    """
+    :return: languages the server runs, None for all
+    """
+    return [lang.strip() for lang in self.languages.split(",") if lang.strip()] or None
+
 
 class ServerProblemStatus(models.Model):
   server = models.ForeignKey(Server, on_delete=models.CASCADE)
   problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
   last_status = models.TextField(blank=True)
   last_synchronize = models.DateTimeField(auto_now=True)
+  last_bytes = models.BigIntegerField("上次同步字节数", default=0)
+  last_seconds = models.FloatField("上次同步耗时", default=0)
 
   class Meta:
     unique_together = ('server', 'problem')
+
+
+class ServerCalibration(models.Model):
+  """
+  A measurement of the speed of a server relative to the calibration baseline, see dispatcher.calibration
+  """
+  server = models.ForeignKey(Server, on_delete=models.CASCADE, related_name="calibrations")
+  create_time = models.DateTimeField(auto_now_add=True)
+  multiplier = models.FloatField("测得系数")
+  lower = models.FloatField("置信下界")
+  upper = models.FloatField("置信上界")
+  previous_multiplier = models.FloatField("原系数")
+  samples = models.TextField(blank=True)  # json: program -> list of seconds
+  drifted = models.BooleanField(default=False)
+  applied = models.BooleanField(default=False)
+
+  class Meta:
+    ordering = ["-create_time"]
@@ -0,0 +1,113 @@
+import logging
+import time
+import traceback
+from statistics import median
+
+from django_redis import get_redis_connection
+
+from dispatcher.models import Server
+from dispatcher.semaphore import namespaced_key, DEFAULT_NAMESPACE
+
+WEIGHT_KEY = namespaced_key(DEFAULT_NAMESPACE, 'WEIGHT')
+TURNAROUND_PREFIX = 'JUDGE:TURNAROUND:'
+FAILURE_PREFIX = 'JUDGE:FAILURE:'
+HEDGE_KEY = 'JUDGE:HEDGE'
+WEIGHT_GUARD_KEY = 'JUDGE:WEIGHT_GUARD'
+
+TURNAROUND_SAMPLES = 50
+FAILURE_WINDOW = 600
+FAILURE_PENALTY = 2
+# Weights are recomputed at most once in this many seconds, by whichever judging records a result first
+WEIGHT_INTERVAL = 10
+
+logger = logging.getLogger(__name__)
+
+
+def record_judge_result(server, seconds=None, failed=False):
+  """
+  Record how one judging went on `server`. The weights the semaphore uses to pick servers are refreshed
+  from these records at most every WEIGHT_INTERVAL seconds, not after each of them.
+
+  :param seconds: turnaround from sending to the final verdict, None if unknown
+  """
+  try:
+    client = get_redis_connection("judge")
+    now = time.time()
+    with client.pipeline() as pipe:
+      if seconds is not None:
+        pipe.lpush(TURNAROUND_PREFIX + str(server.pk), seconds)
+        pipe.ltrim(TURNAROUND_PREFIX + str(server.pk), 0, TURNAROUND_SAMPLES - 1)
+      if failed:
+        pipe.zadd(FAILURE_PREFIX + str(server.pk), {str(now): now})
+      pipe.zremrangebyscore(FAILURE_PREFIX + str(server.pk), 0, now - FAILURE_WINDOW)
+      pipe.set(WEIGHT_GUARD_KEY, 1, nx=True, ex=WEIGHT_INTERVAL)
+      due = pipe.execute()[-1]
+    if due:
+      update_weights(client)
+  except:
+    logger.warning(traceback.format_exc())
+
+
+def record_hedge(server):
+  """
+  Count a submission taken away from `server` for making no progress; it also counts as a failure
+  """
+  try:
+    get_redis_connection("judge").hincrby(HEDGE_KEY, str(server.pk), 1)
+  except:
+    logger.warning(traceback.format_exc())
+  record_judge_result(server, failed=True)
+
+
+def get_server_stats(client, servers):
+  """
+  :return: dict server id -> {"median_turnaround": float or None, "failures": int, "hedges": int,
+                              "runtime_multiplier": float}
+  """
+  now = time.time()
+  with client.pipeline() as pipe:
+    for server in servers:
+      pipe.lrange(TURNAROUND_PREFIX + str(server.pk), 0, -1)
+      pipe.zcount(FAILURE_PREFIX + str(server.pk), now - FAILURE_WINDOW, now)
+    pipe.hgetall(HEDGE_KEY)
+    results = pipe.execute()
+  hedges = {int(k): int(v) for k, v in results[-1].items()}
+  stats = {}
+  for idx, server in enumerate(servers):
+    samples = list(map(float, results[idx * 2]))
+    stats[server.pk] = {
+      "median_turnaround": median(samples) if samples else None,
+      "failures": results[idx * 2 + 1],
+      "hedges": hedges.get(server.pk, 0),
+      "runtime_multiplier": server.runtime_multiplier,
+    }
+  return stats
+
+
+def compute_weights(stats):
+  """
+  Weight of a server is its speed relative to the fleet, penalized by recent failures:
+  1 / (median turnaround / fleet median turnaround) / (1 + penalty * failures)
+
+  Turnaround already reflects how fast the server runs, so runtime_multiplier only stands in for it
+  while the server has no turnaround samples yet.
+  """
+  medians = [s["median_turnaround"] for s in stats.values() if s["median_turnaround"]]
+  fleet_median = median(medians) if medians else None
+  weights = {}
+  for server_id, s in stats.items():
+    if fleet_median and s["median_turnaround"]:
+      relative = s["median_turnaround"] / fleet_median
+    else:
+      relative = s["runtime_multiplier"]
+    weights[server_id] = 1. / max(relative, 1E-3) / (1 + FAILURE_PENALTY * s["failures"])
+  return weights
+
+
+def update_weights(client):
+  servers = list(Server.objects.filter(enabled=True))
+  if not servers:
+    return {}
+  weights = compute_weights(get_server_stats(client, servers))
+  client.hmset(WEIGHT_KEY, {str(k): "%.6f" % v for k, v in weights.items()})
+  return weights
@@ -1,8 +1,14 @@
+import json
+import logging
 import time
+from collections import Counter
 
 from redis import StrictRedis
 
 from dispatcher.models import Server
+from utils import random_string
+
+logger = logging.getLogger(__name__)
 
 
 class NotAvailable(Exception):
@@ -10,20 +16,443 @@ class NotAvailable(Exception):
   """
 
 
+# Priority classes, from the most urgent to the least
+CONTEST, PRACTICE, REJUDGE = 'contest', 'practice', 'rejudge'
+PRIORITY_CLASSES = (CONTEST, PRACTICE, REJUDGE)
+# A class holding fewer slots than this share of all slots (at least one) is served before the others.
+# This only orders the waiters: no slot is held back for a class that has nobody waiting
+PRIORITY_SHARE = {CONTEST: 0.3, PRACTICE: 0.2, REJUDGE: 0.1}
+# Waiting this many seconds is worth one priority class
+AGING_SECONDS = 60
+
+# Waiters renew their ticket every WAKE_INTERVAL seconds; tickets not renewed within TICKET_TTL are dropped
+WAKE_INTERVAL = 10
+TICKET_TTL = 3 * WAKE_INTERVAL
+# Dispatch looks this deep into each wait list for a ticket that accepts one of the free servers
+SCAN_DEPTH = 8
+
+# A token is leased for LEASE_TTL seconds, and the holder renews the lease every HEARTBEAT_INTERVAL seconds;
+# leases not renewed in time are swept and their tokens go back to the pool
+LEASE_TTL = 120
+HEARTBEAT_INTERVAL = 20
+# At most this many expired leases are swept by one script call
+SWEEP_LIMIT = 100
+# Lease events (a holder finding its lease gone) kept for display
+LEASE_EVENTS_KEPT = 100
+
+DEFAULT_NAMESPACE = 'SEMAPHORE'
+# Keys every script is called with, in this order; the wait lists of the priority classes come last
+SCRIPT_KEYS = ('EXISTS', 'GRABBED', 'AVAILABLE', 'LEASE', 'HOLDER', 'LEASE_STATS', 'LEASE_EVENTS', 'WEIGHT',
+               'TICKET', 'INFLIGHT', 'OWNER', 'EVICTED', 'SERVED', 'FREE') + \
+              tuple('WAIT:' + c for c in PRIORITY_CLASSES)
+# Keys of the semaphore before it was scripted, named "namespace:suffix" without the hash tag; dropped on init
+LEGACY_KEYS = ('EXISTS', 'AVAILABLE', 'GRABBED', 'RELEASE_LOCKS')
+
+
+def namespaced_key(namespace, suffix):
+  """
+  The namespace is a hash tag, so that all keys of a semaphore are in the same Redis Cluster slot
+  """
+  return '{%s}:%s' % (namespace, suffix)
+
+
+# KEYS: see SCRIPT_KEYS
+# ARGV: prefix of the wake channels, lease ttl, sweep limit, ticket, priority class, ticket ttl, token,
+#       server constraints of the ticket as json {"allow": [server id...], "deny": [server id...]}
+# Scripts touch no key but the ones passed in. A served ticket finds its token in K_SERVED and is told so
+# on its own channel; channels are not keys, so they need not be declared.
+# All scripts read the clock with TIME, which makes them non-deterministic; replicate effects instead of scripts.
+_LUA_PRELUDE = """
+redis.replicate_commands()
+local now = redis.call('time')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local K_EXISTS, K_GRABBED, K_AVAILABLE, K_LEASE, K_HOLDER = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+local K_LEASE_STATS, K_LEASE_EVENTS, K_WEIGHT, K_TICKET = KEYS[6], KEYS[7], KEYS[8], KEYS[9]
+local K_INFLIGHT, K_OWNER, K_EVICTED, K_SERVED, K_FREE = KEYS[10], KEYS[11], KEYS[12], KEYS[13], KEYS[14]
+local CLASSES = {%(classes)s}
+local PRIORITY_SHARE = {%(share)s}
+local AGING = %(aging)d
+local SCAN_DEPTH = %(scan_depth)d
+
+local K_WAIT = {}
+for i, class in ipairs(CLASSES) do
+  K_WAIT[class] = KEYS[14 + i]
+end
+
+-- a served ticket picks its token up exactly once
+local function claim(ticket)
+  local token = redis.call('hget', K_SERVED, ticket)
+  if token then
+    redis.call('hdel', K_SERVED, ticket)
+  end
+  return token
+end
+
+local function token_server(token)
+  return string.match(token, '^(%%d+):')
+end
+
+-- free tokens are a sorted set scored by server id, and K_FREE counts them by server
+local function add_free(token)
+  local server = token_server(token)
+  if redis.call('zadd', K_AVAILABLE, server, token) == 1 then
+    redis.call('hincrby', K_FREE, server, 1)
+  end
+end
+
+local function take_free(token)
+  local server = token_server(token)
+  if redis.call('zrem', K_AVAILABLE, token) == 1 and redis.call('hincrby', K_FREE, server, -1) <= 0 then
+    redis.call('hdel', K_FREE, server)
+  end
+end
+
+-- tokens of evicted servers are kept out of the pool until the server is restored
+local function return_token(token)
+  local class = redis.call('hget', K_OWNER, token)
+  if class then
+    redis.call('hdel', K_OWNER, token)
+    redis.call('hincrby', K_INFLIGHT, class, -1)
+  end
+  if redis.call('sismember', K_EVICTED, token_server(token)) == 0 then
+    add_free(token)
+  end
+end
+
+local function drop_lease(token)
+  redis.call('hdel', K_GRABBED, token)
+  redis.call('hdel', K_HOLDER, token)
+  redis.call('zrem', K_LEASE, token)
+end
+
+-- leases are kept in a sorted set by expiry time, so only the expired ones are looked at
+local function sweep()
+  local expired = redis.call('zrangebyscore', K_LEASE, '-inf', now, 'LIMIT', 0, tonumber(ARGV[3]))
+  for _, token in ipairs(expired) do
+    local ticket = redis.call('hget', K_HOLDER, token)
+    if ticket then
+      redis.call('hdel', K_SERVED, ticket)  -- served, but the waiter never came for the token
+    end
+    drop_lease(token)
+    return_token(token)
+  end
+  if #expired > 0 then
+    redis.call('hincrby', K_LEASE_STATS, 'expired', #expired)
+  end
+end
+
+-- whether the token is leased to the ticket; if not, the caller has been judging without a slot
+local function holds(token, ticket)
+  if redis.call('hget', K_HOLDER, token) == ticket then
+    return true
+  end
+  local other = redis.call('hget', K_HOLDER, token)
+  redis.call('hincrby', K_LEASE_STATS, other and 'oversubscribed' or 'lost', 1)
+  redis.call('lpush', K_LEASE_EVENTS, cjson.encode({token = token, ticket = ticket, time = now,
+                                                   oversubscribed = other and true or false}))
+  redis.call('ltrim', K_LEASE_EVENTS, 0, %(events_kept)d - 1)
+  return false
+end
+
+-- a ticket may restrict the servers it accepts with an `allow` list (empty for any) and a `deny` list
+local function servable(info, server)
+  if info.allow and #info.allow > 0 then
+    local allowed = false
+    for _, s in ipairs(info.allow) do
+      if tostring(s) == server then
+        allowed = true
+        break
+      end
+    end
+    if not allowed then
+      return false
+    end
+  end
+  for _, s in ipairs(info.deny or {}) do
+    if tostring(s) == server then
+      return false
+    end
+  end
+  return true
+end
+
+-- servers with free slots and their (free slots * weight), where weights are maintained by dispatcher.scheduler;
+-- one entry per server, however many tokens are free
+local function free_servers()
+  local counts = redis.call('hgetall', K_FREE)
+  local free, servers, scores = {}, {}, {}
+  for i = 1, #counts, 2 do
+    if tonumber(counts[i + 1]) > 0 then
+      free[counts[i]] = tonumber(counts[i + 1])
+      table.insert(servers, counts[i])
+    end
+  end
+  if #servers > 0 then
+    local weights = redis.call('hmget', K_WEIGHT, unpack(servers))
+    for i, server in ipairs(servers) do
+      scores[server] = free[server] * (tonumber(weights[i]) or 1)
+    end
+  end
+  return servers, scores
+end
+
+local function best_server(info, servers, scores)
+  local chosen, best = nil, -1
+  for _, server in ipairs(servers) do
+    if scores[server] > best and servable(info, server) then
+      chosen, best = server, scores[server]
+    end
+  end
+  return chosen
+end
+
+-- among the first SCAN_DEPTH live tickets of a class, the first one some free server accepts;
+-- tickets of vanished waiters are dropped
+local function head_ticket(class, servers, scores)
+  local tickets = redis.call('lrange', K_WAIT[class], 0, SCAN_DEPTH - 1)
+  for _, ticket in ipairs(tickets) do
+    local raw = redis.call('hget', K_TICKET, ticket)
+    local info = raw and cjson.decode(raw)
+    if not info or info.d < now then
+      redis.call('hdel', K_TICKET, ticket)
+      redis.call('lrem', K_WAIT[class], 1, ticket)
+    else
+      local server = best_server(info, servers, scores)
+      if server then
+        return ticket, info, server
+      end
+    end
+  end
+  return nil
+end
+
+local function choose()
+  local servers, scores = free_servers()
+  if #servers == 0 then
+    return nil
+  end
+  local total = redis.call('zcard', K_AVAILABLE) + redis.call('hlen', K_GRABBED)
+  local best = nil
+  for rank, class in ipairs(CLASSES) do
+    local ticket, info, server = head_ticket(class, servers, scores)
+    if ticket then
+      local inflight = tonumber(redis.call('hget', K_INFLIGHT, class)) or 0
+      local effective = rank - (now - info.e) / AGING
+      if inflight < math.max(1, math.floor(PRIORITY_SHARE[class] * total)) then
+        effective = effective - 1000
+      end
+      if best == nil or effective < best.rank then
+        best = {rank = effective, class = class, ticket = ticket, server = server}
+      end
+    end
+  end
+  return best
+end
+
+-- hand free tokens to waiters, as long as there are both
+local function dispatch()
+  while true do
+    local best = choose()
+    if best == nil then
+      return
+    end
+    best.token = redis.call('zrangebyscore', K_AVAILABLE, best.server, best.server, 'LIMIT', 0, 1)[1]
+    if best.token == nil then
+      -- the count is off; forget it rather than choosing the server again
+      redis.call('hdel', K_FREE, best.server)
+      return dispatch()
+    end
+    take_free(best.token)
+    redis.call('lrem', K_WAIT[best.class], 1, best.ticket)
+    redis.call('hdel', K_TICKET, best.ticket)
+    redis.call('hset', K_GRABBED, best.token, string.format('%%.6f', now))
+    redis.call('hset', K_HOLDER, best.token, best.ticket)
+    redis.call('zadd', K_LEASE, now + tonumber(ARGV[2]), best.token)
+    redis.call('hset', K_OWNER, best.token, best.class)
+    redis.call('hincrby', K_INFLIGHT, best.class, 1)
+    redis.call('hset', K_SERVED, best.ticket, best.token)
+    redis.call('publish', ARGV[1] .. best.ticket, best.token)
+  end
+end
+""" % {
+  "classes": ", ".join("'%s'" % c for c in PRIORITY_CLASSES),
+  "share": ", ".join("%s=%f" % (c, PRIORITY_SHARE[c]) for c in PRIORITY_CLASSES),
+  "aging": AGING_SECONDS,
+  "scan_depth": SCAN_DEPTH,
+  "events_kept": LEASE_EVENTS_KEPT,
+}
+
+# Queue up a ticket and dispatch. Returns -1 if the semaphore has to be initialized first,
+# the token if it is handed out right away, nil otherwise
+ACQUIRE_SCRIPT = _LUA_PRELUDE + """
+if redis.call('exists', K_EXISTS) == 0 then
+  return -1
+end
+sweep()
+local info = cjson.decode(ARGV[8])
+info.e, info.d = now, now + tonumber(ARGV[6])
+redis.call('hset', K_TICKET, ARGV[4], cjson.encode(info))
+redis.call('rpush', K_WAIT[ARGV[5]], ARGV[4])
+dispatch()
+return claim(ARGV[4])
+"""
+
+# Keep a ticket alive (putting it back in line if it has been dropped) and dispatch.
+# Returns the token if the ticket has been served
+RENEW_SCRIPT = _LUA_PRELUDE + """
+local token = claim(ARGV[4])
+if token then
+  return token
+end
+local raw = redis.call('hget', K_TICKET, ARGV[4])
+local info
+if raw then
+  info = cjson.decode(raw)
+else
+  info = cjson.decode(ARGV[8])
+  info.e = now
+  redis.call('rpush', K_WAIT[ARGV[5]], ARGV[4])
+end
+info.d = now + tonumber(ARGV[6])
+redis.call('hset', K_TICKET, ARGV[4], cjson.encode(info))
+sweep()
+dispatch()
+return claim(ARGV[4])
+"""
+
+# Leave the line. Returns the token if the ticket has been served in the meantime
+CANCEL_SCRIPT = _LUA_PRELUDE + """
+redis.call('hdel', K_TICKET, ARGV[4])
+redis.call('lrem', K_WAIT[ARGV[5]], 1, ARGV[4])
+return claim(ARGV[4])
+"""
+
+# Pick up the token of a served ticket. Returns nil if the ticket has not been served
+CLAIM_SCRIPT = _LUA_PRELUDE + """
+return claim(ARGV[4])
+"""
+
+# The token is only returned to the pool if it is still leased to the ticket, so releasing twice is harmless,
+# and a holder whose lease has expired does not release a slot handed to someone else since
+RELEASE_SCRIPT = _LUA_PRELUDE + """
+sweep()
+if holds(ARGV[7], ARGV[4]) then
+  drop_lease(ARGV[7])
+  return_token(ARGV[7])
+  dispatch()
+  return 1
+end
+dispatch()
+return 0
+"""
+
+# Extend the lease of a token. Returns 0 if it is no longer leased to the ticket
+HEARTBEAT_SCRIPT = _LUA_PRELUDE + """
+if holds(ARGV[7], ARGV[4]) then
+  redis.call('zadd', K_LEASE, now + tonumber(ARGV[2]), ARGV[7])
+  return 1
+end
+return 0
+"""
+
+SWEEP_SCRIPT = _LUA_PRELUDE + """
+sweep()
+dispatch()
+"""
+
+# ARGV after the common ones: server id, tokens of the server...
+EVICT_SCRIPT = _LUA_PRELUDE + """
+redis.call('sadd', K_EVICTED, ARGV[9])
+for i = 10, #ARGV do
+  take_free(ARGV[i])
+end
+"""
+
+RESTORE_SCRIPT = _LUA_PRELUDE + """
+if redis.call('srem', K_EVICTED, ARGV[9]) == 1 then
+  for i = 10, #ARGV do
+    if redis.call('hexists', K_GRABBED, ARGV[i]) == 0 then
+      add_free(ARGV[i])
+    end
+  end
+end
+dispatch()
+"""
+
+# Drop the tickets of waiters gone while the semaphore was down, and tickets in no wait list;
+# live waiters put theirs back on the next renew
+PURGE_SCRIPT = _LUA_PRELUDE + """
+local queued = {}
+for _, class in ipairs(CLASSES) do
+  for _, ticket in ipairs(redis.call('lrange', K_WAIT[class], 0, -1)) do
+    local raw = redis.call('hget', K_TICKET, ticket)
+    if queued[ticket] then
+      redis.call('lrem', K_WAIT[class], -1, ticket)  -- queued twice, keep the first
+    elseif raw and cjson.decode(raw).d >= now then
+      queued[ticket] = true
+    else
+      redis.call('lrem', K_WAIT[class], 0, ticket)
+      redis.call('hdel', K_TICKET, ticket)
+    end
+  end
+end
+for _, ticket in ipairs(redis.call('hkeys', K_TICKET)) do
+  if not queued[ticket] then
+    redis.call('hdel', K_TICKET, ticket)
+  end
+end
+"""
+
+
 class Semaphore(object):
   """
   Modified from: https://github.com/bluele/redis-semaphore/blob/master/redis_semaphore/__init__.py
+
+  Every acquirer queues up a ticket in the wait list of its priority class; free tokens are handed to
+  the head of the most urgent class, which is the class with the lowest (rank - waited seconds / AGING_SECONDS),
+  classes holding less than their PRIORITY_SHARE of slots going first. The token is put aside for the ticket,
+  and the waiter, blocking on a pub/sub channel of its own, is told to pick it up. Among servers with free
+  slots, the one with the most (free slots * weight) is chosen, where weights are maintained by `dispatcher.scheduler`.
+  Servers an acquirer will not take (`deny`, or those missing from a non-empty `allow`) are skipped for it,
+  and the first few tickets of each class are looked at, so such a ticket does not hold up the whole class.
+
+  A token is a lease of `lease_ttl` seconds, which the holder extends with `heartbeat` while it is judging.
+  Expired leases are swept (looking at the expired ones only) by every script call and by the health monitor,
+  so the slots of dead workers come back within `lease_ttl`. A holder finding its lease gone (it stopped
+  heartbeating for too long) keeps judging, but the event is recorded, see `lease_status`.
+
+  Acquire, renew, cancel, release, heartbeat and sweep are atomic Lua scripts costing one round trip each.
+  Every key they touch is passed in as KEYS and shares the hash tag of the namespace, so a semaphore lives
+  in one slot of a Redis Cluster. Wake-ups are not stored: a waiter missing one picks its token up on its next
+  renew, at most WAKE_INTERVAL seconds later.
   """
 
   exists_val = 'ok'
 
-  def __init__(self, client, stale_client_timeout=None, blocking=True):
+  def __init__(self, client, lease_ttl=LEASE_TTL, blocking=True, namespace=DEFAULT_NAMESPACE, priority=PRACTICE,
+               allow=None, deny=None):
     self.client = client or StrictRedis()
-    self.namespace = 'SEMAPHORE'
-    self.stale_client_timeout = stale_client_timeout
+    self.namespace = namespace
+    self.lease_ttl = lease_ttl
     self.is_use_local_time = False
     self.blocking = blocking
+    self.priority = priority if priority in PRIORITY_CLASSES else PRACTICE
+    self.allow = list(allow or [])
+    self.deny = list(deny or [])
+    self.ticket = None
     self._local_tokens = list()
+    self._leases = dict()  # token -> ticket it was handed to
+    self._keys = [self.get_namespaced_key(suffix) for suffix in SCRIPT_KEYS]
+    self._acquire_script = self.client.register_script(ACQUIRE_SCRIPT)
+    self._claim_script = self.client.register_script(CLAIM_SCRIPT)
+    self._renew_script = self.client.register_script(RENEW_SCRIPT)
+    self._cancel_script = self.client.register_script(CANCEL_SCRIPT)
+    self._release_script = self.client.register_script(RELEASE_SCRIPT)
+    self._heartbeat_script = self.client.register_script(HEARTBEAT_SCRIPT)
+    self._sweep_script = self.client.register_script(SWEEP_SCRIPT)
+    self._evict_script = self.client.register_script(EVICT_SCRIPT)
+    self._restore_script = self.client.register_script(RESTORE_SCRIPT)
+    self._purge_script = self.client.register_script(PURGE_SCRIPT)
 
   def exists_or_init(self):
     old_key = self.client.getset(self.check_exists_key, self.exists_val)
@@ -31,42 +460,105 @@ class Semaphore(object):
       return False
     return self._init()
 
-  def _init(self):
-    self.client.expire(self.check_exists_key, 10)
+  @staticmethod
+  def get_server_tokens(server):
+    return ["%d:%d" % (server.id, x) for x in range(server.concurrency)]
+
+  def get_tokens(self):
     keys = []
-    for server in Server.objects.filter(enabled=True):
-      keys += ["%d:%d" % (server.id, x) for x in range(server.concurrency)]
+    evicted = set(map(int, self.client.smembers(self.evicted_key)))
+    for server in Server.objects.filter(enabled=True).exclude(id__in=evicted):
+      keys += self.get_server_tokens(server)
     if not keys:
       keys = ['0:0']  # this will raise no server error
+    return keys
+
+  def _init(self):
+    self.client.expire(self.check_exists_key, 10)
+    keys = self.get_tokens()
 
     with self.client.pipeline() as pipe:
       pipe.multi()
-      pipe.delete(self.grabbed_key, self.available_key)
-      pipe.rpush(self.available_key, *keys)
+      pipe.delete(self.grabbed_key, self.available_key, self.free_key, self.inflight_key, self.owner_key,
+                  self.lease_key, self.holder_key, self.served_key)
+      pipe.zadd(self.available_key, {key: int(key.split(":")[0]) for key in keys})
+      pipe.hmset(self.free_key, Counter(key.split(":")[0] for key in keys))
       pipe.execute()
+    for suffix in LEGACY_KEYS:  # one by one, they are not in the slot of the namespace
+      self.client.delete('%s:%s' % (self.namespace, suffix))
     self.client.persist(self.check_exists_key)
+    self._purge_script(keys=self._keys, args=self._args())
+    self.sweep()  # serve whoever is still waiting
 
   @property
   def available_count(self):
-    return self.client.llen(self.available_key)
+    return self.client.zcard(self.available_key)
+
+  def available_tokens(self):
+    return [token.decode() for token in self.client.zrange(self.available_key, 0, -1)]
+
+  def free_counts(self):
+    """
+    :return: dict server id -> number of free slots
+    """
+    return {int(k): int(v) for k, v in self.client.hgetall(self.free_key).items()}
+
+  def _args(self, token='', ticket=None):
+    return [self.wake_prefix, self.lease_ttl, SWEEP_LIMIT, ticket or self.ticket or '', self.priority, TICKET_TTL,
+            token, json.dumps({"allow": self.allow, "deny": self.deny})]
+
+  def enqueue(self):
+    """
+    Queue up a new ticket.
+
+    :return: the token if one is handed out right away, None otherwise
+    """
+    self.ticket = random_string()
+    for _ in range(50):
+      token = self._acquire_script(keys=self._keys, args=self._args())
+      if token != -1:
+        return token
+      if self.exists_or_init() is False:
+        time.sleep(0.1)  # someone else is initializing
+    raise NotAvailable
+
+  def check(self):
+    """
+    :return: the token if the ticket has been served, None otherwise
+    """
+    return self._claim_script(keys=self._keys, args=self._args())
+
+  def renew(self):
+    return self._renew_script(keys=self._keys, args=self._args())
+
+  def cancel(self):
+    return self._cancel_script(keys=self._keys, args=self._args())
 
   def acquire(self, timeout=0, target=None):
-    self.exists_or_init()
-    if self.stale_client_timeout is not None:
-      self.release_stale_locks()
-
-    if self.blocking:
-      pair = self.client.blpop(self.available_key, timeout)
-      if pair is None:
-        raise NotAvailable
-      token = pair[1]
-    else:
-      token = self.client.lpop(self.available_key)
-      if token is None:
-        raise NotAvailable
+    token = self.enqueue()
+    deadline = time.time() + timeout if timeout else None
+    pubsub = None
+    try:
+      while token is None:
+        wait = WAKE_INTERVAL if deadline is None else min(WAKE_INTERVAL, deadline - time.time())
+        if not self.blocking or wait <= 0:
+          token = self.cancel()
+          if token is None:
+            raise NotAvailable
+          break
+        if pubsub is None:
+          pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+          pubsub.subscribe(self.wake_channel)
+          token = self.check()  # served before subscribing
+        elif pubsub.get_message(timeout=wait) is not None:
+          token = self.check()
+        else:
+          token = self.renew()
+    finally:
+      if pubsub is not None:
+        pubsub.close()
 
-    self._local_tokens.append(token)
-    self.client.hset(self.grabbed_key, token, self.current_time)
+    self.hold(token)
     if target is not None:
       try:
         target(token)
@@ -74,18 +566,32 @@ class Semaphore(object):
         self.signal(token)
     return token
 
-  def release_stale_locks(self, expires=10):
-    token = self.client.getset(self.check_release_locks_key, self.exists_val)
-    if token:
-      return False
-    self.client.expire(self.check_release_locks_key, expires)
-    try:
-      for token, looked_at in self.client.hgetall(self.grabbed_key).items():
-        timed_out_at = float(looked_at) + self.stale_client_timeout
-        if timed_out_at < self.current_time:
-          self.signal(token)
-    finally:
-      self.client.delete(self.check_release_locks_key)
+  def hold(self, token):
+    """
+    Keep track of a token handed to the current ticket
+    """
+    self._local_tokens.append(token)
+    self._leases[token] = self.ticket
+
+  def heartbeat(self):
+    """
+    Extend the leases of the tokens held
+
+    :return: False if one of them is no longer held
+    """
+    ok = True
+    for token in self._local_tokens:
+      if not self._heartbeat_script(keys=self._keys, args=self._args(token, self._leases.get(token))):
+        logger.warning("lease of judge slot %s has expired while in use", token)
+        ok = False
+    return ok
+
+  def sweep(self):
+    """
+    Return the tokens of expired leases to the pool and serve waiters with them
+    """
+    self._sweep_script(keys=self._keys,
+                       args=[self.wake_prefix, self.lease_ttl, SWEEP_LIMIT, '', self.priority, TICKET_TTL, '', '{}'])
 
   def _is_locked(self, token):
     return self.client.hexists(self.grabbed_key, token)
@@ -97,25 +603,65 @@ class Semaphore(object):
     return False
 
   def release(self):
-    if not self.has_lock():
+    if not self._local_tokens:
       return False
-    return self.signal(self._local_tokens.pop())
+    return self.signal(self._local_tokens.pop()) or False
 
   def reset(self):
     self._init()
 
   def signal(self, token):
+    """
+    :return: the token if it was grabbed and is now back in the pool, None otherwise
+    """
     if token is None:
       return None
-    with self.client.pipeline() as pipe:
-      pipe.multi()
-      pipe.hdel(self.grabbed_key, token)
-      pipe.lpush(self.available_key, token)
-      pipe.execute()
+    if self._release_script(keys=self._keys, args=self._args(token, self._leases.pop(token, None))):
       return token
+    return None
+
+  def evict_server(self, server):
+    """
+    Take the free slots of a server out of the pool; slots in use are dropped when they are released
+    """
+    self._evict_script(keys=self._keys, args=self._args() + [server.id] + self.get_server_tokens(server))
+
+  def restore_server(self, server):
+    self._restore_script(keys=self._keys, args=self._args() + [server.id] + self.get_server_tokens(server))
+
+  def evicted_servers(self):
+    return set(map(int, self.client.smembers(self.evicted_key)))
+
+  def lease_status(self):
+    """
+    :return: (dict token -> seconds left on its lease, dict of counters: "expired" leases swept,
+             "lost" and "oversubscribed" when a holder found its lease gone, the latter if the slot had been
+             handed to someone else already, list of the latest such events)
+    """
+    with self.client.pipeline() as pipe:
+      pipe.zrange(self.lease_key, 0, -1, withscores=True)
+      pipe.hgetall(self.get_namespaced_key('LEASE_STATS'))
+      pipe.lrange(self.get_namespaced_key('LEASE_EVENTS'), 0, -1)
+      leases, stats, events = pipe.execute()
+    now = self.current_time
+    return ({token.decode(): expiry - now for token, expiry in leases},
+            {k.decode(): int(v) for k, v in stats.items()},
+            [json.loads(event.decode()) for event in events])
+
+  def queue_status(self):
+    """
+    :return: list of (priority class, waiting count, running count)
+    """
+    with self.client.pipeline() as pipe:
+      for priority in PRIORITY_CLASSES:
+        pipe.llen(self.get_namespaced_key('WAIT:' + priority))
+      pipe.hgetall(self.inflight_key)
+      results = pipe.execute()
+    inflight = {k.decode(): int(v) for k, v in results[-1].items()}
+    return [(priority, results[idx], inflight.get(priority, 0)) for idx, priority in enumerate(PRIORITY_CLASSES)]
 
   def get_namespaced_key(self, suffix):
-    return '{0}:{1}'.format(self.namespace, suffix)
+    return namespaced_key(self.namespace, suffix)
 
   @property
   def check_exists_key(self):
@@ -130,8 +676,47 @@ class Semaphore(object):
     return self._get_and_set_key('_grabbed_key', 'GRABBED')
 
   @property
-  def check_release_locks_key(self):
-    return self._get_and_set_key('_release_locks_ley', 'RELEASE_LOCKS')
+  def weight_key(self):
+    return self._get_and_set_key('_weight_key', 'WEIGHT')
+
+  @property
+  def inflight_key(self):
+    return self._get_and_set_key('_inflight_key', 'INFLIGHT')
+
+  @property
+  def owner_key(self):
+    return self._get_and_set_key('_owner_key', 'OWNER')
+
+  @property
+  def lease_key(self):
+    return self._get_and_set_key('_lease_key', 'LEASE')
+
+  @property
+  def holder_key(self):
+    return self._get_and_set_key('_holder_key', 'HOLDER')
+
+  @property
+  def evicted_key(self):
+    return self._get_and_set_key('_evicted_key', 'EVICTED')
+
+  @property
+  def served_key(self):
+    return self._get_and_set_key('_served_key', 'SERVED')
+
+  @property
+  def free_key(self):
+    return self._get_and_set_key('_free_key', 'FREE')
+
+  @property
+  def wake_prefix(self):
+    """
+    A served ticket is told so on the channel of this prefix followed by the ticket
+    """
+    return self._get_and_set_key('_wake_prefix', 'WAKE:')
+
+  @property
+  def wake_channel(self):
+    return self.wake_prefix + (self.ticket or '')
 
   def _get_and_set_key(self, key_name, namespace_suffix):
     if not hasattr(self, key_name):
@@ -0,0 +1,62 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .utils import DEFAULT_USERNAME
+
+DEFAULT_TIMEOUT = 30
+
+_registry_lock = threading.Lock()
+_registry = {}
+
+
+class ServerSession(requests.Session):
+  """
+  A keep-alive session to one judge server: authenticated, with a bounded connection pool,
+  retries on connection failures (and on gateway errors for idempotent requests) and a default timeout
+  """
+
+  def __init__(self, server):
+    super().__init__()
+    self.auth = (DEFAULT_USERNAME, server.token)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(server.concurrency, 1) * 2 + 2,
+                          max_retries=Retry(total=3, connect=3, read=1, status=1, backoff_factor=0.2,
+                                            status_forcelist=(502, 503, 504)))
+    self.mount('http://', adapter)
+    self.mount('https://', adapter)
+
+  def request(self, method, url, **kwargs):  # pylint: disable=arguments-differ
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    return super().request(method, url, **kwargs)
+
+
+def _session_fingerprint(server):
+  return server.ip, server.port, server.token, server.concurrency
+
+
+def get_session(server):
+  """
+  :type server: dispatcher.models.Server
+  :return: the pooled session of this server, rebuilt if its address or token has changed
+  """
+  key = (os.getpid(), server.pk)  # pools must not be shared with forked children
+  fingerprint = _session_fingerprint(server)
+  with _registry_lock:
+    entry = _registry.get(key)
+    if entry is not None and entry[0] == fingerprint:
+      return entry[1]
+    session = ServerSession(server)
+    _registry[key] = (fingerprint, session)
+  if entry is not None:
+    entry[1].close()
+  return session
+
+
+def invalidate_session(server_id):
+  with _registry_lock:
+    entry = _registry.pop((os.getpid(), server_id), None)
+  if entry is not None:
+    entry[1].close()
@@ -0,0 +1,199 @@
+import json
+import logging
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import path
+
+from django.db import connection
+from django_q.tasks import async_task
+from django_redis import get_redis_connection
+
+from problem.models import Problem, SpecialProgram
+from problem.models.problem import get_input_path, get_output_path
+from .capability import record_programs
+from .manage import case_exists, stream_case, upload_checker, upload_interactor, upload_validator
+from .models import Server, ServerProblemStatus
+
+logger = logging.getLogger(__name__)
+
+# case hashes a server is known to have
+MANIFEST_PREFIX = 'JUDGE:MANIFEST:'
+SYNC_WORKERS = 8
+
+# warm state of a problem on each server, see `start_prewarm`
+WARM_PREFIX = 'JUDGE:WARM:'
+WARM_TTL = 86400
+PENDING, WARMING, WARM, FAILED = 'pending', 'warming', 'warm', 'failed'
+
+
+def _manifest_key(server):
+  return MANIFEST_PREFIX + str(server.pk)
+
+
+def problem_cases(problem):
+  return set(problem.pretest_list + problem.sample_list + problem.case_list)
+
+
+def _push_case(server, case):
+  """
+  :return: (bytes sent, seconds, error message or '')
+  """
+  start = time.time()
+  try:
+    return stream_case(server, case), time.time() - start, ''
+  except:
+    return 0, time.time() - start, traceback.format_exc()
+
+
+def diff_manifest(server, problems, refresh=False):
+  """
+  Work out in one pass which cases of `problems` the server lacks. Cases are looked up in the manifest
+  first; only those not in it are asked for (concurrently), and the ones found are added to the manifest.
+
+  :param refresh: forget the manifest and ask for every case, e.g. after a server lost its data
+  :return: (set of cases to upload, set of cases missing from TESTDATA_DIR)
+  """
+  client = get_redis_connection("judge")
+  if refresh:
+    client.delete(_manifest_key(server))
+  wanted = set()
+  for problem in problems:
+    wanted |= problem_cases(problem)
+  if not wanted:
+    return set(), set()
+  known = set(x.decode() for x in client.smembers(_manifest_key(server)))
+  unknown = sorted(wanted - known)
+  absent = set(case for case in unknown
+               if not (path.exists(get_input_path(case)) and path.exists(get_output_path(case))))
+  unknown = [case for case in unknown if case not in absent]
+  with ThreadPoolExecutor(SYNC_WORKERS) as executor:
+    exists = list(executor.map(lambda case: case_exists(server, case), unknown))
+  present = [case for case, ok in zip(unknown, exists) if ok]
+  if present:
+    client.sadd(_manifest_key(server), *present)
+  return set(case for case, ok in zip(unknown, exists) if not ok), absent
+
+
+def sync_server(server, problems, refresh=False, workers=SYNC_WORKERS):
+  """
+  Push the test data and special programs of `problems` to a server. Missing cases are streamed
+  over at most `workers` connections; each case is sent once even if several problems share it.
+  The bytes, seconds and errors are recorded in the ServerProblemStatus of every problem.
+
+  :return: dict problem id -> ServerProblemStatus
+  """
+  problems = list(problems)
+  start = time.time()
+  if server.version >= 3:
+    to_upload, absent = set(), set()  # these servers fetch test data by themselves
+  else:
+    to_upload, absent = diff_manifest(server, problems, refresh)
+  with ThreadPoolExecutor(max(1, min(workers, server.concurrency * 2))) as executor:
+    results = dict(zip(to_upload, executor.map(lambda case: _push_case(server, case), to_upload)))
+  uploaded = [case for case, (_, _, error) in results.items() if not error]
+  if uploaded:
+    get_redis_connection("judge").sadd(_manifest_key(server), *uploaded)
+
+  programs_done = {}
+  accounted = set()
+  statuses = {}
+  for problem in problems:
+    sent, seconds, errors = 0, 0., []
+    for case in sorted(problem_cases(problem)):
+      if case in absent:
+        errors.append("%s: test data missing on this site" % case)
+      if case not in results:
+        continue
+      if case not in accounted:  # shared cases count towards the first problem only
+        accounted.add(case)
+        sent, seconds = sent + results[case][0], seconds + results[case][1]
+      if results[case][2]:
+        errors.append(results[case][2])
+    for fingerprint, upload in ((problem.checker, upload_checker), (problem.validator, upload_validator),
+                                (problem.interactor, upload_interactor)):
+      if not fingerprint:
+        continue
+      if fingerprint not in programs_done:
+        try:
+          upload(server, SpecialProgram.objects.get(fingerprint=fingerprint))
+          programs_done[fingerprint] = ''
+        except:
+          programs_done[fingerprint] = traceback.format_exc()
+      if programs_done[fingerprint]:
+        errors.append(programs_done[fingerprint])
+    status, _ = ServerProblemStatus.objects.get_or_create(server=server, problem=problem)
+    status.last_status = '\n'.join(errors)
+    status.last_bytes, status.last_seconds = sent, seconds
+    status.save()
+    statuses[problem.pk] = status
+    record_programs(server, [fingerprint for fingerprint, error in programs_done.items() if not error])
+    set_warm_state(problem.pk, server.pk, FAILED if errors else WARM, bytes=sent, seconds=seconds,
+                   error=status.last_status)
+
+  server.last_synchronize_time = datetime.now()
+  server.save(update_fields=['last_synchronize_time'])
+  logger.info("synchronized %d problems to %s: %d cases, %d bytes in %.1f seconds", len(problems), server,
+              len(results), sum(r[0] for r in results.values()), time.time() - start)
+  return statuses
+
+
+def set_warm_state(problem_id, server_id, state, **kwargs):
+  try:
+    client = get_redis_connection("judge")
+    record = dict(kwargs, state=state, updated=time.time())
+    with client.pipeline() as pipe:
+      pipe.hset(WARM_PREFIX + str(problem_id), str(server_id), json.dumps(record))
+      pipe.expire(WARM_PREFIX + str(problem_id), WARM_TTL)
+      pipe.execute()
+  except:
+    logger.warning(traceback.format_exc())
+
+
+def get_warm_status(problem_id):
+  """
+  :return: dict server id -> {"state": ..., "updated": timestamp, and "bytes", "seconds", "error" when finished}
+  """
+  raw = get_redis_connection("judge").hgetall(WARM_PREFIX + str(problem_id))
+  return {int(k): json.loads(v.decode()) for k, v in raw.items()}
+
+
+def cold_servers(problem_id):
+  """
+  Servers that are still being warmed up with (or failed to receive) the data of a problem.
+  Problems that have not been prewarmed lately have no cold servers.
+  """
+  try:
+    return set(server_id for server_id, record in get_warm_status(problem_id).items() if record["state"] != WARM)
+  except:
+    logger.warning(traceback.format_exc())
+    return set()
+
+
+def start_prewarm(problem):
+  """
+  Mark the problem cold on every enabled server and queue pushing its data to all of them
+  """
+  for server in Server.objects.filter(enabled=True):
+    set_warm_state(problem.pk, server.pk, PENDING)
+  async_task(prewarm_problem, problem.pk)
+
+
+def _warm(server, problem):
+  set_warm_state(problem.pk, server.pk, WARMING)
+  try:
+    sync_server(server, [problem])
+  except:
+    set_warm_state(problem.pk, server.pk, FAILED, error=traceback.format_exc())
+  finally:
+    connection.close()
+
+
+def prewarm_problem(problem_id):
+  problem = Problem.objects.get(pk=problem_id)
+  servers = list(Server.objects.filter(enabled=True))
+  if not servers:
+    return
+  with ThreadPoolExecutor(len(servers)) as executor:
+    list(executor.map(lambda server: _warm(server, problem), servers))
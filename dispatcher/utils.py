@@ -1,2 +1,5 @@
+DEFAULT_USERNAME = 'ejudge'
+
+
 def is_success_response(response):
   return response.get('status') == 'received'
@@ -0,0 +1,68 @@
+import binascii
+import hmac
+import json
+from base64 import b64decode
+
+from django.conf import settings
+from django.http import JsonResponse, HttpResponse, HttpResponseForbidden
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django_redis import get_redis_connection
+
+from account.permissions import is_admin_or_root
+from .channel import push_result, watching_server
+from .metrics import render_prometheus
+from .models import Server
+from .utils import DEFAULT_USERNAME
+
+
+def is_server_request(request, server):
+  """
+  Whether a request carries the credentials the dispatcher uses toward the server (basic auth)
+  """
+  scheme, _, encoded = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+  if scheme != 'Basic':
+    return False
+  try:
+    username, _, password = b64decode(encoded.encode()).decode().partition(':')
+  except (binascii.Error, UnicodeDecodeError):
+    return False
+  return hmac.compare_digest(username.encode(), DEFAULT_USERNAME.encode()) and \
+         hmac.compare_digest(password.encode(), server.token.encode())
+
+
+@csrf_exempt
+@require_POST
+def judge_callback(request, fingerprint):
+  """
+  Judge servers push (possibly preliminary) results here; the watching worker is woken up with the data.
+  A fingerprint is only accepted while someone is watching it, and only from the server it has been sent to,
+  authenticated with the same credentials the dispatcher uses toward that server.
+  """
+  client = get_redis_connection("judge")
+  server_id = watching_server(client, fingerprint)
+  if server_id is None:
+    return JsonResponse({"status": "reject", "message": "unknown fingerprint"}, status=404)
+  server = Server.objects.filter(pk=server_id).first()
+  if server is None or not is_server_request(request, server):
+    return JsonResponse({"status": "reject", "message": "unauthorized"}, status=403)
+  try:
+    data = json.loads(request.body.decode())
+  except ValueError:
+    return JsonResponse({"status": "reject", "message": "invalid json"}, status=400)
+  if not push_result(client, fingerprint, data):
+    return JsonResponse({"status": "reject", "message": "unknown fingerprint"}, status=404)
+  return JsonResponse({"status": "received"})
+
+
+def judge_metrics(request):
+  """
+  Judge metrics in the Prometheus text format. Scrapers authenticate with JUDGE_METRICS_TOKEN as a bearer
+  token (never in the URL, which ends up in logs); admins can read it from the browser.
+  """
+  token = settings.JUDGE_METRICS_TOKEN
+  scheme, _, provided = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+  authorized = bool(token) and scheme == 'Bearer' and hmac.compare_digest(provided.encode(), token.encode())
+  if not authorized and not is_admin_or_root(request.user):
+    return HttpResponseForbidden()
+  return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -100,6 +100,16 @@ if 'ADMIN_EMAIL' in os.environ:
   ADMIN_EMAIL_LIST = os.getenv('ADMIN_EMAIL').split(';')
   ADMINS = [(os.getenv('ADMIN_NAME', 'support'), ADMIN_EMAIL_LIST[0])]
 
+# judge dispatcher
+
+if 'JUDGE_CALLBACK_HOST' in os.environ:
+  JUDGE_CALLBACK_HOST = os.getenv('JUDGE_CALLBACK_HOST')
+
+if 'JUDGE_ASYNC_DISPATCHER' in os.environ:
+  JUDGE_ASYNC_DISPATCHER = os.getenv('JUDGE_ASYNC_DISPATCHER') == 'True'
+  JUDGE_ASYNC_MAX_INFLIGHT = int(os.getenv('JUDGE_ASYNC_MAX_INFLIGHT', '256'))
+  JUDGE_ASYNC_DB_THREADS = int(os.getenv('JUDGE_ASYNC_DB_THREADS', '8'))
+
 # recommendation service
 
 if 'RECOMMENDATION_SERVICE' in os.environ:
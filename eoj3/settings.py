@@ -391,9 +391,45 @@ LOGGING = {
   },
 }
 
+# judge dispatcher
+
+# address of this site as seen from judge servers, e.g. "http://10.0.0.2:8080"
+# judge servers will push results here instead of being polled; leave it blank to poll
+# (pushes must carry the basic auth credentials the dispatcher uses toward the pushing server)
+JUDGE_CALLBACK_HOST = ""
+
+# hand submissions to the asyncio dispatcher (`python manage.py runscript judge_dispatcher`) instead of django-q
+JUDGE_ASYNC_DISPATCHER = False
+JUDGE_ASYNC_MAX_INFLIGHT = 256
+JUDGE_ASYNC_DB_THREADS = 8
+
+# intermediate judge results of a submission are written at most once in this many milliseconds
+JUDGE_WRITE_DEBOUNCE_MS = 1000
+
+# a submission is sent to another judge server if its server makes no progress in
+# max(time limit * case count * JUDGE_HEDGE_FACTOR, JUDGE_HEDGE_MIN_SECONDS) seconds,
+# at most JUDGE_HEDGE_MAX_ATTEMPTS times
+JUDGE_HEDGE_FACTOR = 3
+JUDGE_HEDGE_MIN_SECONDS = 60
+JUDGE_HEDGE_MAX_ATTEMPTS = 2
+
+# seconds a judge result is kept for reuse by identical judgements (rejudges in memoize mode)
+JUDGE_MEMO_TTL = 7 * 86400
+
+# seconds each calibration program takes on a server with runtime multiplier 1, see dispatcher.calibration;
+# measure with `python manage.py runscript calibrate_judges --script-args baseline=<id of the reference server>`
+JUDGE_CALIBRATION_BASELINE = {}
+# a server is flagged when its runtime multiplier is off by more than this share of the measured one
+JUDGE_CALIBRATION_DRIFT = 0.1
+
+# bearer token for scraping /judge/metrics/ (Prometheus format); leave it blank to allow admins only
+JUDGE_METRICS_TOKEN = ""
+
 # recommendation service
 
 RECOMMENDATION_SERVICE_URL = "127.0.0.1:20019"
+# users per call to the service, see problem.prediction
+RECOMMENDATION_BATCH_SIZE = 100
 
 
 # local settings override
@@ -6,11 +6,12 @@ from django.views.static import serve
 from account.profile import ProfileView, ProgressTreeView
 from account.views import my_login, RegisterView, FeedbackView
 from blog.views import GetRewardsView
+from dispatcher.views import judge_callback, judge_metrics
 from home.museum import museum_view
 from home.search import search_view
 from home.views import home_view, faq_view, TestView, forbidden_view, not_found_view, server_error_view, PasteView
 from migrate.views import migrate_view
-from tests.views import judge_mock, query_mock, query_report_mock
+from tests.views import judge_mock, query_mock, query_report_mock, predict_mock
 from utils.auth_view import logout
 from utils.comment import login_required_post_comment
 from utils.site_settings import force_closed
@@ -45,6 +46,8 @@ urlpatterns = [
   url(r'^profile/(?P<pk>\d+)/$', ProfileView.as_view(), name='profile', kwargs=force_closed()),
   # url(r'^i18n/', include('django.conf.urls.i18n')),  # TODO: delete?
   url(r'^reward/(?P<pk>\d+)/$', GetRewardsView.as_view(), name='rewardslist', kwargs=force_closed()),
+  url(r'^judge/callback/(?P<fingerprint>\w+)/$', judge_callback, name='judge_callback'),
+  url(r'^judge/metrics/$', judge_metrics, name='judge_metrics'),
 ]
 
 urlpatterns += [
@@ -79,6 +82,9 @@ if DEBUG:
     url(r'^judge$', judge_mock),
     url(r'^query$', query_mock),
     url(r'^query/report$', query_report_mock),
+    # stub recommendation service
+    url(r'^predict$', predict_mock),
+    url(r'^predict/batch$', predict_mock),
   ]
 else:
   urlpatterns += [
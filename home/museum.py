@@ -5,6 +5,7 @@ from django.db.models.functions import TruncDate, TruncYear
 from django.shortcuts import render
 
 from account.models import User
+from dispatcher.health import get_health
 from dispatcher.manage import ping
 from dispatcher.models import Server
 from problem.models import Problem
@@ -56,9 +57,16 @@ def museum_view(request):
       continue
     user['count'] += ctx['problem_stat'][idx - 1]['count']
 
-  ctx['servers'] = servers = Server.objects.filter(enabled=True)
+  ctx['servers'] = servers = list(Server.objects.filter(enabled=True))
 
+  try:
+    health = get_health(servers)
+  except:
+    health = {}
   for server in servers:
-    server.status = ping(server)
+    if server.pk in health:
+      server.status = health[server.pk]["ok"]
+    else:  # health monitor is not running, or has stopped
+      server.status = ping(server)
 
   return render(request, 'museum.jinja2', context=ctx)
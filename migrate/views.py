@@ -14,7 +14,7 @@ from account.models import User
 from account.payment import reward_problem_ac
 from migrate.forms import MigrateForm
 from problem.models import ProblemRewardStatus
-from problem.statistics import invalidate_problem
+from problem.statistics import invalidate_problem_user, reset_user_status
 from submission.models import Submission
 from submission.util import SubmissionStatus
 from .models import OldUser
@@ -67,6 +67,7 @@ class MigrationThread(threading.Thread):
   def run(self):
     try:
       with transaction.atomic():
+        problem_ids = set()
         for submission in Submission.objects.filter(author=self.old_user).order_by("create_time").all():
           if submission.contest_id:
             # Clone one
@@ -88,7 +89,7 @@ class MigrationThread(threading.Thread):
             s.author = self.new_user
             s.save(update_fields=["author_id"])
 
-          invalidate_problem(s.problem)
+          problem_ids.add(s.problem_id)
 
           if s.status == SubmissionStatus.ACCEPTED:
             # Add reward
@@ -97,6 +98,10 @@ class MigrationThread(threading.Thread):
             if created:
               reward_problem_ac(self.new_user, s.problem.reward, s.problem_id)
 
+        for problem_id in problem_ids:
+          invalidate_problem_user(problem_id, self.old_user.pk)
+          invalidate_problem_user(problem_id, self.new_user.pk)
+        reset_user_status([self.old_user.pk, self.new_user.pk])
         self.old_user.is_active = False
         self.old_user.save(update_fields=['is_active'])
     except:
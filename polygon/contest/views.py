@@ -2,7 +2,6 @@ import json
 import logging
 import re
 from datetime import timedelta
-from threading import Thread
 
 import shortuuid
 from django.contrib import messages
@@ -28,6 +27,7 @@ from polygon.rejudge import (
   rejudge_submission_set
 )
 from problem.models import Problem
+from problem.statistics import reset_user_status
 from problem.views import StatusList
 from submission.util import SubmissionStatus
 from utils.csv_writer import write_csv
@@ -445,10 +445,12 @@ class ContestClarificationAnswer(PolygonContestMixin, View):
 class RejudgeContestProblemSubmission(PolygonContestMixin, View):
   def post(self, request, pk):
     my_problem = request.POST['problem']
+    memoize = bool(request.POST.get('memoize'))
     if my_problem == 'all':
-      rejudge_all_submission_on_contest(self.contest)
+      rejudge_all_submission_on_contest(self.contest, memoize=memoize, user=request.user)
     else:
-      rejudge_all_submission_on_contest_problem(self.contest, get_object_or_404(Problem, pk=my_problem))
+      rejudge_all_submission_on_contest_problem(self.contest, get_object_or_404(Problem, pk=my_problem),
+                                                memoize=memoize, user=request.user)
     return redirect(reverse('polygon:contest_status', kwargs={'pk': self.contest.id}))
 
 
@@ -466,8 +468,8 @@ class ContestSystemTestView(PolygonContestMixin, View):
                                                                       SubmissionStatus.PRETEST_PASSED]) \
         .order_by("create_time")
 
-    if len(submission_set) > 0:
-      Thread(target=rejudge_submission_set, args=(submission_set,)).start()
+    if submission_set.exists():
+      rejudge_submission_set(submission_set, user=request.user, label="Contest #%d system test" % self.contest.pk)
     return redirect(reverse('polygon:contest_status', kwargs={'pk': self.contest.id}))
 
 
@@ -646,6 +648,7 @@ class ContestGhostRecordImport(PolygonContestMixin, FormView):
                                                  status_percent=100 if verdict == SubmissionStatus.ACCEPTED else 0)
           s.create_time = submit_time
           s.save(update_fields=["create_time"])
+        reset_user_status(user_ids + list(team_id_map.values()))
 
       return redirect(reverse('polygon:contest_status', kwargs={'pk': self.contest.pk}))
     except Exception as e:
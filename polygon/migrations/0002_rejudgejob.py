@@ -0,0 +1,33 @@
+# Generated by Django 2.2.17 on 2026-10-18 11:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('polygon', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RejudgeJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(blank=True, max_length=192)),
+                ('submissions', models.TextField(blank=True)),
+                ('memoize', models.BooleanField(default=False)),
+                ('status', models.IntegerField(choices=[(0, '进行中'), (1, '已暂停'), (2, '已取消'), (3, '已完成')], default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('dispatched', models.PositiveIntegerField(default=0)),
+                ('done', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('finish_time', models.DateTimeField(null=True)),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
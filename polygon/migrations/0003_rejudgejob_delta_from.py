@@ -0,0 +1,18 @@
+# Generated by Django 2.2.17 on 2026-10-18 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polygon', '0002_rejudgejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rejudgejob',
+            name='delta_from',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.17 on 2026-10-18 21:12
+
+from django.db import migrations, models
+
+from utils.idset import pack_ids
+
+
+def pack_submissions(apps, schema_editor):
+    RejudgeJob = apps.get_model('polygon', 'RejudgeJob')
+    for job in RejudgeJob.objects.only('id', 'submissions').iterator():
+        job.submission_data = pack_ids(map(int, filter(None, job.submissions.split(','))))
+        job.save(update_fields=['submission_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polygon', '0003_rejudgejob_delta_from'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rejudgejob',
+            name='submission_data',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(pack_submissions, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='rejudgejob',
+            name='submissions',
+        ),
+        migrations.RenameField(
+            model_name='rejudgejob',
+            old_name='submission_data',
+            new_name='submissions',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.17 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+def convert_delta(apps, schema_editor):
+    RejudgeJob = apps.get_model('polygon', 'RejudgeJob')
+    RejudgeJob.objects.exclude(delta_from='').update(delta=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polygon', '0004_rejudgejob_packed_submissions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rejudgejob',
+            name='delta',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(convert_delta, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='rejudgejob',
+            name='delta_from',
+        ),
+    ]
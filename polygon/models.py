@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage
 from django.core.validators import RegexValidator
@@ -6,6 +8,7 @@ from django.db import models
 from account.models import User
 from problem.models import Problem
 from utils.hash import sha_hash, case_hash
+from utils.idset import unpack_ids
 from utils.language import LANG_CHOICE
 
 repo_storage = FileSystemStorage(location=settings.REPO_DIR)
@@ -265,3 +268,49 @@ class CodeforcesPackage(Package):
   short_name = models.CharField(null=True, blank=True, max_length=192)
   revision = models.IntegerField(null=True)
   size = models.FloatField(null=True)
+
+
+class RejudgeJob(models.Model):
+  """
+  A batch of submissions to rejudge, fed to the judges a few at a time by `polygon.rejudge.pump_rejudge_jobs`
+  """
+  RUNNING, PAUSED, CANCELED, FINISHED = 0, 1, 2, 3
+  STATUS_CHOICE = (
+    (RUNNING, '进行中'),
+    (PAUSED, '已暂停'),
+    (CANCELED, '已取消'),
+    (FINISHED, '已完成')
+  )
+
+  user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+  label = models.CharField(max_length=192, blank=True)
+  submissions = models.BinaryField(default=b'')  # submission ids in judging order, see utils.idset.pack_ids
+  memoize = models.BooleanField(default=False)
+  delta = models.BooleanField(default=False)  # rejudge only cases whose results cannot be reused
+  status = models.IntegerField(choices=STATUS_CHOICE, default=RUNNING)
+  total = models.PositiveIntegerField(default=0)
+  dispatched = models.PositiveIntegerField(default=0)
+  done = models.PositiveIntegerField(default=0)
+  failed = models.PositiveIntegerField(default=0)
+  create_time = models.DateTimeField(auto_now_add=True)
+  finish_time = models.DateTimeField(null=True)
+
+  def get_submission_ids(self, start=0, stop=None):
+    """
+    :return: ids of the submissions from position `start` up to `stop` in judging order
+    """
+    return unpack_ids(self.submissions, start, stop).tolist()
+
+  @property
+  def finished_count(self):
+    return self.done + self.failed
+
+  @property
+  def eta(self):
+    """
+    :return: estimated seconds to go at the rate so far, None if unknown
+    """
+    elapsed = (datetime.now() - self.create_time).total_seconds()
+    if self.status != self.RUNNING or not self.finished_count or elapsed <= 0:
+      return None
+    return (self.total - self.finished_count) / (self.finished_count / elapsed)
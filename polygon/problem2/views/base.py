@@ -293,7 +293,8 @@ class ProblemRevisionMixin(PolygonProblemMixin):
 
 class ProblemRejudge(PolygonProblemMixin, View):
   def post(self, request, *args, **kwargs):
-    rejudge_all_submission_on_problem(self.problem)
+    rejudge_all_submission_on_problem(self.problem, memoize=bool(request.POST.get('memoize')), user=request.user,
+                                      delta=bool(request.POST.get('delta')))
     return HttpResponse()
 
 
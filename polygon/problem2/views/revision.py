@@ -4,7 +4,6 @@ from datetime import datetime
 from shutil import copyfile
 
 from django.conf import settings
-from django.contrib import messages
 from django.core.files.base import ContentFile, File
 from django.db import transaction
 from django.db.models import Max
@@ -15,12 +14,11 @@ from django.views import View
 from django.views.generic import UpdateView
 
 from dispatcher.models import Server
-from dispatcher.models import ServerProblemStatus
+from dispatcher.sync import start_prewarm, get_warm_status
 from polygon.models import Revision
 from polygon.problem2.forms import RevisionUpdateForm
 from polygon.problem2.views.base import ProblemRevisionMixin, PolygonProblemMixin
 from problem.models import SpecialProgram, get_input_path, get_output_path
-from problem.tasks import upload_problem_to_judge_server
 from problem.views import StatusList
 from submission.models import Submission
 
@@ -165,6 +163,11 @@ class RevisionUpdateView(ProblemRevisionMixin, UpdateView):
     """
     data = super().get_context_data(**kwargs)
     data["revision_list"] = self.problem.revisions.select_related("user").order_by("-revision").all()
+    warm_status = get_warm_status(self.problem.pk)
+    for record in warm_status.values():
+      record["updated"] = datetime.fromtimestamp(record["updated"])
+    data["warm_status"] = [(server, warm_status[server.pk]) for server in
+                           Server.objects.filter(pk__in=warm_status.keys())]
     pk_to_revision = {revision.pk: revision.revision for revision in data["revision_list"]}
     for revision in data["revision_list"]:
       revision.based_on = pk_to_revision.get(revision.parent_id)
@@ -234,18 +237,12 @@ class RevisionConfirmView(ProblemRevisionMixin, View):
     self.problem.time_limit = self.revision.time_limit
     self.problem.memory_limit = self.revision.memory_limit
 
-    try:
-      for server in Server.objects.filter(enabled=True).all():
-        upload_problem_to_judge_server(self.problem, server)
-        status, _ = ServerProblemStatus.objects.get_or_create(problem=self.problem, server=server)
-        status.save()
-        server.last_synchronize_time = datetime.now()
-        server.save(update_fields=['last_synchronize_time'])
-      self.problem.save()
-      self.revision.status = 1
-      self.revision.save(update_fields=["status"])
-    except Exception as e:
-      messages.error(self.request, "Upload failed: " + str(e))
+    self.problem.save()
+    self.revision.status = 1
+    self.revision.save(update_fields=["status"])
+    # judge servers avoid this problem's submissions until they have the new data
+    problem = self.problem
+    transaction.on_commit(lambda: start_prewarm(problem))
     return redirect(reverse('polygon:revision_update', kwargs=self.kwargs))
 
 
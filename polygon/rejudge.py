@@ -1,49 +1,214 @@
-from threading import Thread
+import logging
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
 
+from django.conf import settings
 from django.db import transaction
+from django.db.models import F
 from django_q.tasks import async_task
+from django_redis import get_redis_connection
 
 from contest.models import Contest
 from contest.tasks import judge_submission_on_contest
+from dispatcher.semaphore import REJUDGE
+from polygon.models import RejudgeJob
 from problem.models import Problem
+from problem.statistics import record_user_verdicts, invalidate_problem, invalidate_problem_user, \
+  USER_ACCEPTED_STATUSES
 from problem.tasks import judge_submission_on_problem
+from submission.models import Submission
 from submission.util import SubmissionStatus
+from utils.idset import pack_ids
 
+logger = logging.getLogger(__name__)
+
+# at most this many rejudge tasks of all jobs are queued or running at the same time
 REJUDGE_TASK_LIMIT = 24
-REJUDGE_COUNTER = 'rejudge_counter'
+REJUDGE_PUMP_LOCK = 'REJUDGE:PUMP'
+# rejudge tasks queued or running, as "<job id>:<submission id>" scored by the time they were queued or started
+REJUDGE_INFLIGHT_KEY = 'REJUDGE:INFLIGHT'
+# django-q kills tasks running longer than its timeout, so a task not heard of for that long has been lost
+REJUDGE_LOST_AFTER = settings.Q_CLUSTER['timeout']
 
 
-def rejudge_submission(submission, callback=None, run_until_complete=False):
+def rejudge_submission(submission, callback=None, run_until_complete=False, memoize=False, delta=False):
+  """
+  :param memoize: take the result of an identical earlier judgement (same code, language, test data, checker,
+                  interactor and limits) instead of running again, see dispatcher.memo
+  :param delta: run only the cases not judged before with the current checker, interactor and limits
+                (submissions out of contests only)
+  """
   if submission.contest_id:
-    judge_submission_on_contest(submission, callback=callback, sync=True)
+    judge_submission_on_contest(submission, callback=callback, sync=True, priority=REJUDGE, memoize=memoize)
   else:
-    judge_submission_on_problem(submission, callback=callback, sync=True, run_until_complete=run_until_complete)
+    judge_submission_on_problem(submission, callback=callback, sync=True, run_until_complete=run_until_complete,
+                                priority=REJUDGE, memoize=memoize, delta=delta)
+
+
+def rejudge_submission_set(submission_set, memoize=False, user=None, label='', delta=False):
+  """
+  Reset all submissions in one UPDATE, and create a job feeding them to the judges.
+  Delta rejudges keep the details, which the new results are merged into.
+
+  :type submission_set: QuerySet
+  :rtype: RejudgeJob
+  """
+  ids = list(submission_set.values_list("id", flat=True))
+  with transaction.atomic():
+    accepted = list(Submission.objects.filter(id__in=ids, status__in=USER_ACCEPTED_STATUSES)
+                    .only("author_id", "contest_id", "problem_id", "status"))
+    if not delta:
+      Submission.objects.filter(id__in=ids).update(status=SubmissionStatus.WAITING, status_test=0, status_percent=0,
+                                                   status_detail="", status_message="")
+    else:
+      Submission.objects.filter(id__in=ids).update(status=SubmissionStatus.WAITING)
+    # their verdicts stop counting until they are judged again
+    changes = []
+    for submission in accepted:
+      previous_status, submission.status = submission.status, SubmissionStatus.WAITING
+      changes.append((submission, previous_status))
+    record_user_verdicts(changes, recommend=False)
+    job = RejudgeJob.objects.create(user=user, label=label, memoize=memoize, total=len(ids),
+                                    submissions=pack_ids(ids), delta=delta)
+  transaction.on_commit(pump_rejudge_jobs)
+  return job
 
 
-def rejudge_submission_set(submission_set):
+def _give_up_submissions(submission_filter, message):
+  """
+  Mark rejudged submissions that will not be judged after all as crashed, counting the change of verdict
+  like a judgement would
+
+  :return: set of (problem id, user id) whose problem counters are to be updated
+  """
   with transaction.atomic():
-    for submission in submission_set:
-      submission.status = SubmissionStatus.WAITING
-      submission.status_test = 0
-      submission.status_percent = 0
-      submission.status_detail = ""
-      submission.status_message = ""
-      submission.save(update_fields=["status", "status_detail", "status_message", "status_test", "status_percent"])
+    submissions = list(submission_filter.select_for_update()
+                       .filter(status__in=[SubmissionStatus.WAITING, SubmissionStatus.JUDGING])
+                       .only("author_id", "contest_id", "problem_id", "status"))
+    Submission.objects.filter(id__in=[submission.pk for submission in submissions]) \
+      .update(status=SubmissionStatus.SYSTEM_ERROR, status_message=message)
+    changes = []
+    for submission in submissions:
+      previous_status, submission.status = submission.status, SubmissionStatus.SYSTEM_ERROR
+      changes.append((submission, previous_status))
+    record_user_verdicts(changes)
+  return {(submission.problem_id, submission.author_id) for submission in submissions}
+
+
+def _inflight_member(job_id, submission_id):
+  return "%d:%d" % (job_id, submission_id)
+
+
+def _collect_inflight(client):
+  """
+  Give up on rejudge tasks lost on the way: they count as failed, and their submissions as crashed
+
+  :return: dict job id -> number of its rejudge tasks queued or running
+  """
+  for member in client.zrangebyscore(REJUDGE_INFLIGHT_KEY, '-inf', time.time() - REJUDGE_LOST_AFTER):
+    if not client.zrem(REJUDGE_INFLIGHT_KEY, member):
+      continue
+    job_id, submission_id = map(int, member.decode().split(':'))
+    logger.warning("rejudge of submission %d (job %d) has been lost", submission_id, job_id)
+    RejudgeJob.objects.filter(pk=job_id).update(failed=F('failed') + 1)
+    for problem_id, user_id in _give_up_submissions(Submission.objects.filter(pk=submission_id), "Rejudge lost."):
+      invalidate_problem_user(problem_id, user_id)
+  return Counter(int(member.decode().split(':')[0]) for member in client.zrange(REJUDGE_INFLIGHT_KEY, 0, -1))
+
+
+def pump_rejudge_jobs():
+  """
+  Queue the next submissions of running jobs, as long as there are fewer than REJUDGE_TASK_LIMIT rejudge tasks
+  queued or running. Runs whenever a job is created or resumed, and whenever a rejudge task finishes.
+  """
+  client = get_redis_connection("judge")
+  with client.lock(REJUDGE_PUMP_LOCK, timeout=60):
+    inflight = _collect_inflight(client)
+    jobs = list(RejudgeJob.objects.filter(status__in=[RejudgeJob.RUNNING, RejudgeJob.PAUSED])
+                .defer("submissions").order_by("pk"))
+    free = REJUDGE_TASK_LIMIT - sum(inflight.values())
+    for job in jobs:
+      if job.status == RejudgeJob.RUNNING and job.dispatched >= job.total and not inflight[job.pk]:
+        RejudgeJob.objects.filter(pk=job.pk).update(status=RejudgeJob.FINISHED, finish_time=datetime.now())
+        continue
+      if free <= 0 or job.status != RejudgeJob.RUNNING or job.dispatched >= job.total:
+        continue
+      batch = job.get_submission_ids(job.dispatched, job.dispatched + free)
+      now = time.time()
+      client.zadd(REJUDGE_INFLIGHT_KEY, {_inflight_member(job.pk, submission_id): now for submission_id in batch})
+      RejudgeJob.objects.filter(pk=job.pk).update(dispatched=F('dispatched') + len(batch))
+      for submission_id in batch:
+        async_task(rejudge_job_submission, job.pk, submission_id)
+      free -= len(batch)
+
+
+def rejudge_job_submission(job_id, submission_id):
+  client = get_redis_connection("judge")
+  member = _inflight_member(job_id, submission_id)
+  client.zadd(REJUDGE_INFLIGHT_KEY, {member: time.time()}, xx=True)  # started, not to be given up on for a while
+  failed = True
+  try:
+    job = RejudgeJob.objects.get(pk=job_id)
+    submission = Submission.objects.get(pk=submission_id)
+    rejudge_submission(submission, memoize=job.memoize, delta=job.delta)
+    failed = submission.status == SubmissionStatus.SYSTEM_ERROR
+  except:
+    logger.error(traceback.format_exc())
+  finally:
+    # a task given up on as lost has been counted already
+    if client.zrem(REJUDGE_INFLIGHT_KEY, member):
+      if failed:
+        RejudgeJob.objects.filter(pk=job_id).update(failed=F('failed') + 1)
+      else:
+        RejudgeJob.objects.filter(pk=job_id).update(done=F('done') + 1)
+    pump_rejudge_jobs()
+
+
+def pause_rejudge_job(job):
+  with get_redis_connection("judge").lock(REJUDGE_PUMP_LOCK, timeout=60):
+    RejudgeJob.objects.filter(pk=job.pk, status=RejudgeJob.RUNNING).update(status=RejudgeJob.PAUSED)
+
+
+def resume_rejudge_job(job):
+  with get_redis_connection("judge").lock(REJUDGE_PUMP_LOCK, timeout=60):
+    RejudgeJob.objects.filter(pk=job.pk, status=RejudgeJob.PAUSED).update(status=RejudgeJob.RUNNING)
+  pump_rejudge_jobs()
+
 
-  for submission in submission_set:
-    async_task(rejudge_submission, submission)
+def cancel_rejudge_job(job):
+  """
+  Submissions already queued are still judged; the rest, having been reset, are marked as failed
+  so that they can be found with the other crashed submissions
+  """
+  with get_redis_connection("judge").lock(REJUDGE_PUMP_LOCK, timeout=60):
+    job = RejudgeJob.objects.get(pk=job.pk)
+    if job.status not in (RejudgeJob.RUNNING, RejudgeJob.PAUSED):
+      return
+    affected = _give_up_submissions(Submission.objects.filter(id__in=job.get_submission_ids(job.dispatched)),
+                                    "Rejudge canceled.")
+    RejudgeJob.objects.filter(pk=job.pk).update(status=RejudgeJob.CANCELED, finish_time=datetime.now())
+  # a cancel may leave many users of a problem crashed; recount each problem once
+  for problem in Problem.objects.filter(pk__in={problem_id for problem_id, _ in affected}):
+    invalidate_problem(problem)
 
 
-def rejudge_all_submission_on_contest(contest: Contest):
-  Thread(target=rejudge_submission_set, args=(contest.submission_set.exclude(lang="").order_by("create_time"),)).start()
+def rejudge_all_submission_on_contest(contest: Contest, memoize=False, user=None):
+  return rejudge_submission_set(contest.submission_set.exclude(lang="").order_by("create_time"),
+                                memoize=memoize, user=user, label="Contest #%d" % contest.pk)
 
 
-def rejudge_all_submission_on_contest_problem(contest: Contest, problem: Problem):
-  Thread(target=rejudge_submission_set,
-         args=(contest.submission_set.exclude(lang="").order_by("create_time").filter(problem=problem),)).start()
+def rejudge_all_submission_on_contest_problem(contest: Contest, problem: Problem, memoize=False, user=None):
+  return rejudge_submission_set(contest.submission_set.exclude(lang="").order_by("create_time").filter(problem=problem),
+                                memoize=memoize, user=user, label="Contest #%d, problem #%d" % (contest.pk, problem.pk))
 
 
-def rejudge_all_submission_on_problem(problem: Problem):
-  Thread(target=rejudge_submission_set,
-         args=(problem.submission_set.exclude(lang="").order_by("create_time").filter(contest__isnull=True),)) \
-    .start()
+def rejudge_all_submission_on_problem(problem: Problem, memoize=False, user=None, delta=False):
+  """
+  :param delta: rejudge only new or changed cases, see `problem.tasks.judge_setup`
+  """
+  return rejudge_submission_set(problem.submission_set.exclude(lang="").order_by("create_time")
+                                .filter(contest__isnull=True),
+                                memoize=memoize, user=user, delta=delta,
+                                label="Problem #%d%s" % (problem.pk, " (delta)" if delta else ""))
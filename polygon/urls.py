@@ -8,6 +8,9 @@ urlpatterns = [
   url(r'^$', v.home_view, name='home'),
   url(r'^register/$', v.register_view, name='register'),
   url(r'^rejudge/(?P<sid>\d+)/$', v.RejudgeSubmission.as_view(), name='rejudge_submission'),
+  url(r'^rejudge/jobs/$', v.RejudgeJobList.as_view(), name='rejudge_jobs'),
+  url(r'^rejudge/jobs/(?P<pk>\d+)/(?P<action>pause|resume|cancel)/$', v.RejudgeJobControl.as_view(),
+      name='rejudge_job_control'),
   url(r'^submission/(?P<sid>\d+)/hidden/$', v.ToggleSubmissionHidden.as_view(), name='toggle_submission_hidden'),
   url(r'^problem/', include('polygon.problem2.urls')),
   url(r'^contest/', include('polygon.contest.urls')),
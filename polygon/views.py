@@ -9,11 +9,12 @@ from django.views.generic import ListView, FormView, DetailView
 from django_q.tasks import async_task
 from rest_framework.views import APIView
 
-from account.permissions import is_coach
+from account.permissions import is_coach, is_admin_or_root
 from polygon.base_views import PolygonBaseMixin
-from polygon.models import Run, CodeforcesPackage
+from polygon.models import Run, CodeforcesPackage, RejudgeJob
 from polygon.package import codeforces
-from polygon.rejudge import rejudge_submission
+from polygon.rejudge import rejudge_submission, pause_rejudge_job, resume_rejudge_job, cancel_rejudge_job
+from problem.statistics import invalidate_problem_user
 from submission.models import Submission
 from utils.permission import is_problem_manager, is_contest_manager
 
@@ -66,9 +67,39 @@ class RejudgeSubmission(PolygonBaseMixin, APIView):
 class ToggleSubmissionHidden(RejudgeSubmission):
   def post(self, request, *args, **kwargs):
     Submission.objects.filter(pk=self.submission.pk).update(visible=not self.submission.visible)
+    invalidate_problem_user(self.submission.problem_id, self.submission.author_id)
     return redirect(self.get_redirect_url())
 
 
+class RejudgeJobList(PolygonBaseMixin, ListView):
+  template_name = 'polygon/rejudge_jobs.jinja2'
+  paginate_by = 50
+  context_object_name = 'rejudge_job_list'
+
+  def get_queryset(self):
+    queryset = RejudgeJob.objects.select_related("user").defer("submissions").order_by("-pk")
+    if not is_admin_or_root(self.request.user):
+      queryset = queryset.filter(user=self.request.user)
+    return queryset
+
+
+class RejudgeJobControl(PolygonBaseMixin, View):
+  actions = {'pause': pause_rejudge_job, 'resume': resume_rejudge_job, 'cancel': cancel_rejudge_job}
+
+  def dispatch(self, request, *args, **kwargs):
+    self.job = get_object_or_404(RejudgeJob, pk=kwargs.get('pk'))
+    return super().dispatch(request, *args, **kwargs)
+
+  def test_func(self):
+    if is_admin_or_root(self.request.user) or self.job.user_id == self.request.user.pk:
+      return super().test_func()
+    return False
+
+  def post(self, request, pk, action):
+    self.actions[action](self.job)
+    return redirect(request.META.get('HTTP_REFERER') or reverse('polygon:rejudge_jobs'))
+
+
 class RunsList(PolygonBaseMixin, ListView):
   template_name = 'polygon/runs.jinja2'
   paginate_by = 100
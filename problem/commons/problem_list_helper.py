@@ -4,17 +4,17 @@ from django.contrib.contenttypes.models import ContentType
 from tagging.models import TaggedItem
 
 from problem.models import Problem
-from problem.statistics import get_attempted_problem_list, get_accept_problem_list
+from problem.statistics import get_attempted_problem_set, get_accept_problem_set
 
 
 def attach_personal_solve_info(problems, user_id):
-  attempt_list = set(get_attempted_problem_list(user_id))
-  accept_list = set(get_accept_problem_list(user_id))
+  attempt_set = get_attempted_problem_set(user_id)
+  accept_set = get_accept_problem_set(user_id)
   for problem in problems:
     problem.personal_label = 0
-    if problem.id in accept_list:
+    if problem.id in accept_set:
       problem.personal_label = 1
-    elif problem.id in attempt_list:
+    elif problem.id in attempt_set:
       problem.personal_label = -1
 
 
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.17 on 2026-10-18 17:48
+
+from django.db import migrations, models
+
+from utils.idset import IdSet
+
+
+def pack_lists(apps, schema_editor):
+    UserStatus = apps.get_model('problem', 'UserStatus')
+    for status in UserStatus.objects.only('id', 'total_list', 'ac_list').iterator():
+        status.total_ids = IdSet(map(int, filter(None, status.total_list.split(',')))).to_bytes()
+        status.ac_ids = IdSet(map(int, filter(None, status.ac_list.split(',')))).to_bytes()
+        status.save(update_fields=['total_ids', 'ac_ids'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0003_problemuserstatus'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstatus',
+            name='ac_ids',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='userstatus',
+            name='total_ids',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(pack_lists, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='userstatus',
+            name='ac_list',
+        ),
+        migrations.RemoveField(
+            model_name='userstatus',
+            name='total_list',
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.17 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+def drop_problem_user_status(apps, schema_editor):
+    # per-user counts without histograms; every problem is recounted in full when next judged
+    apps.get_model('problem', 'ProblemUserStatus').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0004_userstatus_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='last_submit_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='verdict_counts',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='problemuserstatus',
+            name='verdict_counts',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(drop_problem_user_status, migrations.RunPython.noop),
+    ]
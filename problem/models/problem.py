@@ -1,5 +1,6 @@
 import json
 import re
+from collections import Counter
 from os import path, makedirs
 
 from django.conf import settings
@@ -14,6 +15,13 @@ from submission.util import SubmissionStatus
 from utils.language import LANG_CHOICE
 
 
+def load_verdict_histogram(text):
+  try:
+    return json.loads(text) if text else {}
+  except ValueError:
+    return {}
+
+
 class AliasValidator(RegexValidator):
   regex = r'^[a-z0-9]{2,30}$'
   message = _(
@@ -76,6 +84,9 @@ class Problem(models.Model):
   ac_count = models.PositiveIntegerField(default=0)
   total_count = models.PositiveIntegerField(default=0)
   reward = models.FloatField(default=9.9)
+  # visible submissions by verdict and language, see `verdict_histogram`
+  verdict_counts = models.TextField(blank=True)
+  last_submit_time = models.DateTimeField(null=True, blank=True)
 
 
   def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
@@ -143,8 +154,16 @@ class Problem(models.Model):
   def sample_display(self):
     return [get_input_and_output_for_case(case) for case in self.sample_list]
 
-  def _status_count(self, status):
-    return self.submission_set.filter(status=status, visible=True).values("id").count()
+  @property
+  def verdict_histogram(self):
+    """
+    :return: dict verdict (as str) -> language -> number of visible submissions, maintained by problem.statistics
+    """
+    return load_verdict_histogram(self.verdict_counts)
+
+  @verdict_histogram.setter
+  def verdict_histogram(self, histogram):
+    self.verdict_counts = json.dumps(histogram, sort_keys=True)
 
   @property
   def ac_user_ratio(self):
@@ -156,16 +175,34 @@ class Problem(models.Model):
 
   @property
   def stats(self):
+    histogram = self.verdict_histogram
+
+    def count(status):
+      return sum(histogram.get(str(status), {}).values())
+
     ret = {
       "ac": self.ac_count,
-      "wa": self._status_count(SubmissionStatus.WRONG_ANSWER),
-      "tle": self._status_count(SubmissionStatus.TIME_LIMIT_EXCEEDED),
-      "re": self._status_count(SubmissionStatus.RUNTIME_ERROR),
-      "ce": self._status_count(SubmissionStatus.COMPILE_ERROR)
+      "wa": count(SubmissionStatus.WRONG_ANSWER),
+      "tle": count(SubmissionStatus.TIME_LIMIT_EXCEEDED),
+      "re": count(SubmissionStatus.RUNTIME_ERROR),
+      "ce": count(SubmissionStatus.COMPILE_ERROR)
     }
     ret["others"] = self.total_count - sum(ret.values())
     return ret
 
+  @property
+  def language_stats(self):
+    """
+    :return: list of (language, accepted, total) by descending total
+    """
+    accepted, total = Counter(), Counter()
+    for status, by_lang in self.verdict_histogram.items():
+      for lang, count in by_lang.items():
+        total[lang] += count
+        if status == str(SubmissionStatus.ACCEPTED):
+          accepted[lang] += count
+    return [(lang, accepted[lang], count) for lang, count in total.most_common()]
+
 
 register(Problem)
 
@@ -1,18 +1,64 @@
+import json
+
 from django.db import models
 
 from account.models import User
+from utils.idset import IdSet
+from .problem import Problem, load_verdict_histogram
 
 
 class UserStatus(models.Model):
   user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="submission_status")
   contest_id = models.PositiveIntegerField(db_index=True)
   total_count = models.PositiveIntegerField()
-  total_list = models.TextField(blank=True)
+  # problems attempted and solved, packed by utils.idset.IdSet
+  total_ids = models.BinaryField(default=b'')
   ac_count = models.PositiveIntegerField()
   ac_distinct_count = models.PositiveIntegerField()
-  ac_list = models.TextField(blank=True)
+  ac_ids = models.BinaryField(default=b'')
   predict_list = models.TextField(blank=True)
   update_time = models.DateTimeField(auto_now=True)
 
   class Meta:
     unique_together = ('user', 'contest_id')
+
+  @property
+  def total_set(self):
+    return IdSet.from_bytes(self.total_ids)
+
+  @total_set.setter
+  def total_set(self, ids):
+    self.total_ids = IdSet(ids).to_bytes()
+
+  @property
+  def ac_set(self):
+    return IdSet.from_bytes(self.ac_ids)
+
+  @ac_set.setter
+  def ac_set(self, ids):
+    self.ac_ids = IdSet(ids).to_bytes()
+
+
+class ProblemUserStatus(models.Model):
+  """
+  Visible submissions of a user on a problem, which the counters of the problem are the sum of
+  """
+  user = models.ForeignKey(User, on_delete=models.CASCADE)
+  problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
+  total_count = models.PositiveIntegerField(default=0)
+  ac_count = models.PositiveIntegerField(default=0)
+  verdict_counts = models.TextField(blank=True)
+
+  class Meta:
+    unique_together = ('user', 'problem')
+
+  @property
+  def verdict_histogram(self):
+    """
+    :return: dict verdict (as str) -> language -> number of visible submissions
+    """
+    return load_verdict_histogram(self.verdict_counts)
+
+  @verdict_histogram.setter
+  def verdict_histogram(self, histogram):
+    self.verdict_counts = json.dumps(histogram, sort_keys=True)
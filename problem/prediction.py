@@ -0,0 +1,113 @@
+"""
+Problems the recommendation service (settings.RECOMMENDATION_SERVICE_URL) predicts each user to solve next.
+
+Refreshes never run where they are requested: `request_prediction` adds users to a Redis set, which coalesces
+repeated requests for the same user, and makes sure one django-q task is on its way to drain the set. The task
+asks the service for up to RECOMMENDATION_BATCH_SIZE users per call. Readers only look at the cache: they get
+the last prediction however old it is (asking for a refresh when it is old) or nothing.
+"""
+import logging
+import time
+import traceback
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django_q.tasks import async_task
+from django_redis import get_redis_connection
+
+from problem.models import UserStatus
+
+logger = logging.getLogger(__name__)
+
+PREDICTION_KEY = "NEXT_PROBLEM_{}"
+PENDING_KEY = "RECOMMENDATION:PENDING"
+FLUSHING_KEY = "RECOMMENDATION:FLUSHING"
+FLUSH_DELAY = 2  # seconds the first requests wait for others to join their batch
+FLUSHING_TTL = 600  # a flush task lost on the way is replaced after this many seconds
+REFRESH_AGE = 3600 * 24 * 7  # predictions older than this are refreshed when read
+KEEP_TIME = 3600 * 24 * 56  # and served meanwhile, until they are this old
+
+
+def _schedule_flush(client):
+  if client.set(FLUSHING_KEY, 1, nx=True, ex=FLUSHING_TTL):
+    async_task(flush_predictions)
+
+
+def request_prediction(user_ids):
+  """
+  Queue a refresh of the predictions of users; returns at once
+  """
+  if not user_ids:
+    return
+  try:
+    client = get_redis_connection("default")
+    client.sadd(PENDING_KEY, *user_ids)
+    _schedule_flush(client)
+  except:
+    logger.warning(traceback.format_exc())
+
+
+def _service_url(path):
+  return "http://{}{}".format(settings.RECOMMENDATION_SERVICE_URL, path)
+
+
+def query_service(solved):
+  """
+  :param solved: dict user id -> ids of the problems they solved
+  :return: dict user id -> predicted problem ids; services without /predict/batch are asked user by user
+  """
+  response = requests.post(_service_url("/predict/batch"), timeout=30,
+                           json={"users": [{"user": user_id, "solved": problems}
+                                           for user_id, problems in solved.items()]})
+  if response.status_code == 404:
+    return {user_id: requests.post(_service_url("/predict"), json={"solved": problems}, timeout=10)
+      .json()["prediction"] for user_id, problems in solved.items()}
+  response.raise_for_status()
+  return {int(user_id): prediction for user_id, prediction in response.json()["predictions"].items()}
+
+
+def predict(user_ids):
+  solved = {user_id: [] for user_id in user_ids}
+  for status in UserStatus.objects.filter(user_id__in=user_ids, contest_id=0).only("user_id", "ac_ids"):
+    solved[status.user_id] = list(status.ac_set)
+  predictions = query_service(solved)
+  now = time.time()
+  cache.set_many({PREDICTION_KEY.format(user_id): {"prediction": prediction, "time": now}
+                  for user_id, prediction in predictions.items()}, timeout=KEEP_TIME)
+
+
+def flush_predictions():
+  """
+  Drain the queue in batches; users of a failed batch keep their previous predictions until asked again
+  """
+  client = get_redis_connection("default")
+  time.sleep(FLUSH_DELAY)
+  try:
+    while True:
+      user_ids = [int(user_id) for user_id in client.spop(PENDING_KEY, settings.RECOMMENDATION_BATCH_SIZE)]
+      if not user_ids:
+        break
+      client.expire(FLUSHING_KEY, FLUSHING_TTL)
+      try:
+        predict(user_ids)
+      except:
+        logger.warning(traceback.format_exc())
+  finally:
+    client.delete(FLUSHING_KEY)
+  # requests that came after the last batch but before the flag was cleared
+  if client.scard(PENDING_KEY):
+    _schedule_flush(client)
+
+
+def get_prediction(user_id):
+  """
+  :return: predicted problem ids, possibly stale, or None if the user has none yet; a refresh is queued if needed
+  """
+  cached = cache.get(PREDICTION_KEY.format(user_id))
+  if isinstance(cached, list):  # cached before predictions were timestamped
+    request_prediction([user_id])
+    return cached
+  if cached is None or time.time() - cached["time"] > REFRESH_AGE:
+    request_prediction([user_id])
+  return cached["prediction"] if cached is not None else None
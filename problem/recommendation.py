@@ -10,8 +10,9 @@ from tagging.models import TaggedItem
 from problem.commons.problem_list_helper import get_problems_entity_list_helper, attach_personal_solve_info, \
   no_tags_entity_list_helper
 from problem.models import Problem
-from problem.statistics import get_accept_problem_list, tags_stat, get_next_k_recommended_problems
+from problem.statistics import get_accept_problem_set, tags_stat, get_next_k_recommended_problems
 from submission.models import Submission
+from utils.idset import IdSet
 
 
 def use_cached_result(func):
@@ -65,7 +66,7 @@ def random_unsolved_problems_with_difficulty(solved_list, k):
 @no_tags_entity_list_helper
 @use_cached_result
 def hard_problems(user_id):
-  ac_list = get_accept_problem_list(user_id)
+  ac_list = list(get_accept_problem_set(user_id))
   ac_difficulty = sorted(list(Problem.objects.filter(id__in=ac_list).values_list("reward", flat=True)), reverse=True)
   try:
     ac_difficulty = ac_difficulty[:int(0.2 * len(ac_difficulty))]
@@ -78,7 +79,7 @@ def hard_problems(user_id):
 @no_tags_entity_list_helper
 @use_cached_result
 def med_problems(user_id):
-  ac_list = get_accept_problem_list(user_id)
+  ac_list = list(get_accept_problem_set(user_id))
   ac_difficulty = sorted(list(Problem.objects.filter(id__in=ac_list).values_list("reward", flat=True)), reverse=True)
   try:
     difficulty_level = sum(ac_difficulty) / len(ac_difficulty)
@@ -90,20 +91,20 @@ def med_problems(user_id):
 
 
 def select_with_tags(user_id, tags_record, max_count_per_tag=1):
-  user_accept_all = set(get_accept_problem_list(user_id))
+  user_accept_all = get_accept_problem_set(user_id)
   ret = set()
   for k, _ in tags_record:
     available_problems = TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Problem)) \
       .filter(tag_id=k).values_list("object_id", flat=True)
-    accept_problems = set(available_problems) & user_accept_all
+    accept_problems = user_accept_all & available_problems
     if not accept_problems:
       ref_reward = 0.
     else:
-      accept_problems_reward = Problem.objects.filter(id__in=accept_problems) \
+      accept_problems_reward = Problem.objects.filter(id__in=list(accept_problems)) \
                                  .order_by("-reward").values_list("reward", flat=True)[:3]
       ref_reward = sum(accept_problems_reward) / len(accept_problems)
     retrieve_list = list(Problem.objects.filter(reward__gte=ref_reward, reward__lte=ref_reward + 2, visible=True,
-                                                id__in=set(available_problems) - user_accept_all).
+                                                id__in=list(IdSet(available_problems) - user_accept_all)).
                          values_list("id", flat=True))
     random.shuffle(retrieve_list)
     ret = ret.union(retrieve_list[:min(len(retrieve_list), max_count_per_tag)])
@@ -131,7 +132,7 @@ def unfamiliar_problems(user_id):
 @get_problems_entity_list_helper
 def coming_up_magic_problems(user_id):
   fetch_pool = Problem.objects.filter(visible=True). \
-    exclude(pk__in=get_accept_problem_list(user_id)). \
+    exclude(pk__in=list(get_accept_problem_set(user_id))). \
     values_list("id", flat=True)
   recommended_problems = get_next_k_recommended_problems(user_id, fetch_pool, k=5)
   return recommended_problems
@@ -3,15 +3,17 @@ import traceback
 from collections import Counter
 from math import log10
 
-import requests
-from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
 from tagging.models import TaggedItem, Tag
 
-from problem.models import UserStatus, TagInfo, Problem
+from problem.models import UserStatus, TagInfo, Problem, ProblemUserStatus
+from problem.prediction import request_prediction, get_prediction
 from submission.models import Submission
 from submission.util import SubmissionStatus
+from utils.idset import IdSet
 from utils.permission import is_problem_manager
 
 logger = logging.getLogger(__name__)
@@ -19,84 +21,363 @@ logger = logging.getLogger(__name__)
 FORTNIGHT = 3600 * 24 * 7
 
 
-def invalidate_problem(problem: Problem, save=True):
-  query_list = list(problem.submission_set.filter(visible=True).values("author_id", "status"))
-  ac_list = list(filter(lambda x: x["status"] == SubmissionStatus.ACCEPTED, query_list))
-  problem.ac_user_count = len(set(map(lambda x: x["author_id"], ac_list)))
-  problem.total_user_count = len(set(map(lambda x: x["author_id"], query_list)))
-  problem.ac_count = len(ac_list)
-  problem.total_count = len(query_list)
+COUNTER_FIELDS = ["ac_user_count", "total_user_count", "ac_count", "total_count", "reward", "verdict_counts",
+                  "last_submit_time"]
+
+
+def _estimate_reward(problem: Problem):
   reward_est = 5 - (2 * problem.ac_ratio + 3 * problem.ac_user_ratio) * min(log10(problem.ac_user_count + 1), 1.2) \
                + max(6 - 2 * log10(problem.ac_user_count + 1), 0)
   # reward_est = (max(reward_est, 0.) ** 2) / 10
-  problem.reward = max(min(reward_est, 9.9), 0.1)
-  for field in problem._meta.local_fields:  # pylint: disable=protected-access
-    if field.name == "update_time":
-      field.auto_now = False
-  if save:
-    problem.save(update_fields=["ac_user_count", "total_user_count", "ac_count", "total_count", "reward"])
+  return max(min(reward_est, 9.9), 0.1)
+
+
+def _add_verdicts(histogram, status, lang, count):
+  lang = lang or ""  # imported submissions have none
+  by_lang = histogram.setdefault(str(status), {})
+  by_lang[lang] = by_lang.get(lang, 0) + count
+  if not by_lang[lang]:
+    del by_lang[lang]
+  if not by_lang:
+    del histogram[str(status)]
+
+
+def _merge_histogram(histogram, other, sign=1):
+  for status, by_lang in other.items():
+    for lang, count in by_lang.items():
+      _add_verdicts(histogram, status, lang, sign * count)
+
+
+def _histogram_totals(histogram):
+  """
+  :return: (submission count, accepted count)
+  """
+  total = sum(count for by_lang in histogram.values() for count in by_lang.values())
+  return total, sum(histogram.get(str(SubmissionStatus.ACCEPTED), {}).values())
+
+
+def _later(time, other):
+  return other if time is None or (other is not None and other > time) else time
+
+
+def _recount_problem(problem: Problem):
+  """
+  :return: (dict user id -> verdict histogram of their visible submissions, time of the last one)
+  """
+  histograms = {}
+  last_submit_time = None
+  for author_id, status, lang, create_time in problem.submission_set.filter(visible=True) \
+      .values_list("author_id", "status", "lang", "create_time"):
+    _add_verdicts(histograms.setdefault(author_id, {}), status, lang, 1)
+    last_submit_time = _later(last_submit_time, create_time)
+  return histograms, last_submit_time
+
+
+def _set_problem_counters(problem: Problem, histograms, last_submit_time):
+  histogram = {}
+  problem.ac_user_count = problem.total_user_count = problem.ac_count = problem.total_count = 0
+  for user_histogram in histograms.values():
+    total, ac = _histogram_totals(user_histogram)
+    _merge_histogram(histogram, user_histogram)
+    problem.ac_user_count += int(ac > 0)
+    problem.total_user_count += 1
+    problem.ac_count += ac
+    problem.total_count += total
+  problem.verdict_histogram = histogram
+  problem.last_submit_time = last_submit_time
+  problem.reward = _estimate_reward(problem)
+
+
+def invalidate_problem(problem: Problem, save=True):
+  """
+  Recount the problem from all its visible submissions and rebuild the per-user counts that
+  `invalidate_problem_user` updates incrementally. Use it for bulk changes and repairs.
+  When saving, the problem row is locked from the recount on, so incremental updates wait for the rebuild.
+  """
+  with transaction.atomic():
+    if save:
+      Problem.objects.select_for_update().only("pk").get(pk=problem.pk)
+    histograms, last_submit_time = _recount_problem(problem)
+    _set_problem_counters(problem, histograms, last_submit_time)
+    for field in problem._meta.local_fields:  # pylint: disable=protected-access
+      if field.name == "update_time":
+        field.auto_now = False
+    if save:
+      statuses = []
+      for user_id, histogram in histograms.items():
+        status = ProblemUserStatus(problem_id=problem.pk, user_id=user_id)
+        status.total_count, status.ac_count = _histogram_totals(histogram)
+        status.verdict_histogram = histogram
+        statuses.append(status)
+      ProblemUserStatus.objects.filter(problem=problem).delete()
+      ProblemUserStatus.objects.bulk_create(statuses, batch_size=1000)
+      problem.save(update_fields=COUNTER_FIELDS)
+
+
+def invalidate_problem_user(problem_id, user_id):
+  """
+  Update the counters and the verdict histogram of a problem after the visible submissions of one user on it
+  changed (judged, rejudged, hidden, moved), counting the submissions of that user only and applying the difference.
+  Problems whose per-user counts were never built get a full recount instead.
+  The problem row is locked first, as `invalidate_problem` does, so the two never interleave.
+  """
+  if not ProblemUserStatus.objects.filter(problem_id=problem_id).exists():
+    problem = Problem.objects.get(pk=problem_id)
+    if problem.total_count > 0:
+      invalidate_problem(problem)
+      return
+  with transaction.atomic():
+    problem = Problem.objects.select_for_update().only(*COUNTER_FIELDS).get(pk=problem_id)
+    status, _ = ProblemUserStatus.objects.select_for_update().get_or_create(problem_id=problem_id, user_id=user_id)
+    histogram = {}
+    last_submit_time = None
+    for verdict, lang, count, last in Submission.objects.filter(problem_id=problem_id, author_id=user_id,
+                                                                visible=True).order_by() \
+        .values("status", "lang").annotate(count=Count("id"), last=Max("create_time")) \
+        .values_list("status", "lang", "count", "last"):
+      _add_verdicts(histogram, verdict, lang, count)
+      last_submit_time = _later(last_submit_time, last)
+    previous = status.verdict_histogram
+    if histogram == previous:
+      return
+    total, ac = _histogram_totals(histogram)
+    problem.total_count += total - status.total_count
+    problem.ac_count += ac - status.ac_count
+    problem.total_user_count += int(total > 0) - int(status.total_count > 0)
+    problem.ac_user_count += int(ac > 0) - int(status.ac_count > 0)
+    problem_histogram = problem.verdict_histogram
+    _merge_histogram(problem_histogram, previous, -1)
+    _merge_histogram(problem_histogram, histogram)
+    problem.verdict_histogram = problem_histogram
+    problem.last_submit_time = _later(problem.last_submit_time, last_submit_time)
+    problem.reward = _estimate_reward(problem)
+    problem.save(update_fields=COUNTER_FIELDS)
+    status.total_count, status.ac_count = total, ac
+    status.verdict_histogram = histogram
+    status.save(update_fields=["total_count", "ac_count", "verdict_counts"])
+
+
+def get_problem_stats(problem: Problem):
+  """
+  Verdict histogram of a problem as `Problem.stats`, recounted once for problems that do not have one yet
+  """
+  if problem.total_count > 0 and not problem.verdict_counts:
+    invalidate_problem(problem)
+  return problem.stats
+
+
+def reconcile_problem(problem: Problem, fix=False):
+  """
+  Verify the counters of a problem, its verdict histogram and its per-user counts against a full recount
+
+  :return: dict field -> (stored, recounted) of the counters that differ, "users" standing for the per-user counts
+  """
+  histograms, last_submit_time = _recount_problem(problem)
+  recounted = Problem(pk=problem.pk)
+  _set_problem_counters(recounted, histograms, last_submit_time)
+  drift = {field: (getattr(problem, field), getattr(recounted, field))
+           for field in ("ac_user_count", "total_user_count", "ac_count", "total_count")
+           if getattr(problem, field) != getattr(recounted, field)}
+  if problem.verdict_histogram != recounted.verdict_histogram:
+    drift["verdict_counts"] = (problem.verdict_counts, recounted.verdict_counts)
+  stored = {status.user_id: status.verdict_histogram for status in ProblemUserStatus.objects.filter(problem=problem)
+            if status.total_count}
+  if stored != histograms:
+    drift["users"] = (len(stored), len(histograms))
+  if drift and fix:
+    invalidate_problem(problem)
+  return drift
+
+
+def reconcile_problems(fix=True):
+  """
+  Reconcile every problem, meant to run periodically (as a django-q schedule or a cron job)
+
+  :return: dict problem id -> drift
+  """
+  report = {}
+  for problem in Problem.objects.all():
+    drift = reconcile_problem(problem, fix)
+    if drift:
+      logger.warning("counters of problem %d drifted: %s", problem.pk, drift)
+      report[problem.pk] = drift
+  return report
+
+
+USER_ACCEPTED_STATUSES = (SubmissionStatus.ACCEPTED, SubmissionStatus.PRETEST_PASSED)
+
+
+USER_STATUS_CACHE_KEY = "USER_STATUS_{}_{}"
+USER_STATUS_CACHED_FIELDS = ("total_count", "ac_count", "ac_distinct_count", "total_ids", "ac_ids")
+
+
+def _user_scopes(contest_id):
+  return [0, contest_id] if contest_id else [0]
+
+
+def _cached_user_status(us):
+  return {field: bytes(getattr(us, field)) if field.endswith("_ids") else getattr(us, field)
+          for field in USER_STATUS_CACHED_FIELDS}
+
+
+def _uncache_user_status(us):
+  """
+  Drop the cached status once the transaction saving it is committed, for the next reader to fill in.
+  Commit hooks of concurrent updates may run in any order, so caching the new status from them could leave
+  an older one in the cache; a delete is right whichever runs last. A reader that loaded the row just before
+  the commit can still put that back, until the next change of the status.
+  """
+  transaction.on_commit(lambda: cache.delete(USER_STATUS_CACHE_KEY.format(us.user_id, us.contest_id)))
 
 
 def invalidate_user(user_id, contest_id=0):
+  """
+  Recompute the status of a user (in a contest, or overall for 0) from all their submissions.
+  It is kept up to date by `record_user_submission` and `record_user_verdict` afterwards,
+  so this is only needed to build it for the first time or to repair it.
+  """
   if contest_id is None:
     contest_id = 0
-  if contest_id:
-    invalidate_user(user_id)
 
   if contest_id:
     submission_filter = Submission.objects.filter(author_id=user_id, contest_id=contest_id).all()
   else:
     submission_filter = Submission.objects.filter(author_id=user_id).all()
-  ac_filter = submission_filter.filter(status__in=[SubmissionStatus.ACCEPTED, SubmissionStatus.PRETEST_PASSED]). \
-    only("problem_id", "id", "author_id", "status", "create_time").all()
+  ac_filter = submission_filter.filter(status__in=USER_ACCEPTED_STATUSES)
 
   total_count = submission_filter.count()
-  total_list = list(submission_filter.order_by().values_list("problem_id", flat=True).distinct())
+  total_set = IdSet(submission_filter.order_by().values_list("problem_id", flat=True).distinct())
   accept_count = ac_filter.count()
-  accept_list = list(ac_filter.order_by().values_list("problem_id", flat=True).distinct())
-  accept_diff = len(accept_list)
+  accept_set = IdSet(ac_filter.order_by().values_list("problem_id", flat=True).distinct())
+  accept_diff = len(accept_set)
 
   us, created = UserStatus.objects.get_or_create(user_id=user_id, contest_id=contest_id,
                                                  defaults={
                                                    "total_count": total_count,
-                                                   "total_list": ",".join(map(str, total_list)),
+                                                   "total_ids": total_set.to_bytes(),
                                                    "ac_count": accept_count,
-                                                   "ac_list": ",".join(map(str, accept_list)),
+                                                   "ac_ids": accept_set.to_bytes(),
                                                    "ac_distinct_count": accept_diff
                                                  })
 
   new_solved = created or us.ac_count != accept_count
   if not created:
     us.total_count = total_count
-    us.total_list = ",".join(map(str, total_list))
+    us.total_set = total_set
     us.ac_count = accept_count
-    us.ac_list = ",".join(map(str, accept_list))
+    us.ac_set = accept_set
     us.ac_distinct_count = accept_diff
     us.save()
+  _uncache_user_status(us)
 
-  next_problem_key = "NEXT_PROBLEM_{}".format(user_id)
-  if contest_id == 0 and (new_solved or cache.get(next_problem_key) is None):
-    try:
-      already_ac_set = set()
-      ac_time_ordered_list = []
-      for ac_sub in ac_filter.order_by("create_time"):
-        if ac_sub.id not in already_ac_set:
-          already_ac_set.add(ac_sub.id)
-          ac_time_ordered_list.append(ac_sub.id)
-      predict_list = requests.post("http://{}/predict".format(settings.RECOMMENDATION_SERVICE_URL),
-                                   json={"solved": accept_list}).json()
-      cache.set(next_problem_key, predict_list["prediction"], timeout=FORTNIGHT)
-    except:
-      logger.warning(traceback.format_exc())
-      cache.set(next_problem_key, [], timeout=FORTNIGHT)
+  if contest_id == 0 and new_solved:
+    request_prediction([user_id])
   return us
 
 
+def _lock_user_status(user_id, contest_id):
+  """
+  :return: the status row locked until the end of the transaction, None if it has not been built yet
+           (it will be, from all submissions, when first read)
+  """
+  return UserStatus.objects.select_for_update().filter(user_id=user_id, contest_id=contest_id).first()
+
+
+def record_user_submission(submission: Submission):
+  """
+  Count a new submission in the status of its author, overall and in its contest
+  """
+  for contest_id in _user_scopes(submission.contest_id):
+    with transaction.atomic():
+      us = _lock_user_status(submission.author_id, contest_id)
+      if us is None:
+        continue
+      total_set = us.total_set
+      total_set.add(submission.problem_id)
+      us.total_count += 1
+      us.total_set = total_set
+      us.save(update_fields=["total_count", "total_ids", "update_time"])
+      _uncache_user_status(us)
+  if submission.status in USER_ACCEPTED_STATUSES:
+    record_user_verdict(submission, None)
+
+
+def record_user_verdict(submission: Submission, previous_status, recommend=True):
+  """
+  Apply the change of verdict of a submission (judged, rejudged, reset for a rejudge) to the status of its author.
+  The new verdict must already be saved.
+
+  :param previous_status: the verdict the status was counting so far
+  :param recommend: queue a refresh of the recommended problems of the author if their solved problems changed
+  """
+  record_user_verdicts([(submission, previous_status)], recommend=recommend)
+
+
+def record_user_verdicts(changes, recommend=True):
+  """
+  Same as `record_user_verdict` for many submissions, updating the status of each author once per scope
+  whatever the number of their submissions
+
+  :param changes: list of (submission, previous_status)
+  """
+  deltas = {}  # (user id, contest id) -> [change of ac_count, problems accepted, problems maybe no longer accepted]
+  for submission, previous_status in changes:
+    accepted = submission.status in USER_ACCEPTED_STATUSES
+    if accepted == (previous_status in USER_ACCEPTED_STATUSES):
+      continue
+    for contest_id in _user_scopes(submission.contest_id):
+      delta = deltas.setdefault((submission.author_id, contest_id), [0, set(), set()])
+      delta[0] += 1 if accepted else -1
+      delta[1 if accepted else 2].add(submission.problem_id)
+  solved_changed = set()
+  for (user_id, contest_id), (count, gained, lost) in deltas.items():
+    with transaction.atomic():
+      us = _lock_user_status(user_id, contest_id)
+      if us is None:
+        continue
+      ac_set = us.ac_set
+      for problem_id in gained:
+        ac_set.add(problem_id)
+      lost -= gained
+      if lost:
+        still_accepted = Submission.objects.filter(author_id=user_id, problem_id__in=lost,
+                                                   status__in=USER_ACCEPTED_STATUSES)
+        if contest_id:
+          still_accepted = still_accepted.filter(contest_id=contest_id)
+        for problem_id in lost - set(still_accepted.order_by().values_list("problem_id", flat=True).distinct()):
+          ac_set.discard(problem_id)
+      us.ac_count = max(us.ac_count + count, 0)
+      us.ac_set = ac_set
+      us.ac_distinct_count = len(ac_set)
+      us.save(update_fields=["ac_count", "ac_ids", "ac_distinct_count", "update_time"])
+      _uncache_user_status(us)
+      if contest_id == 0:
+        solved_changed.add(user_id)
+  if recommend and solved_changed:
+    request_prediction(sorted(solved_changed))
+
+
+def reset_user_status(user_ids):
+  """
+  Drop the status of users after their submissions changed in bulk; it is rebuilt when next read
+  """
+  statuses = UserStatus.objects.filter(user_id__in=user_ids)
+  cache.delete_many([USER_STATUS_CACHE_KEY.format(user_id, contest_id)
+                     for user_id, contest_id in statuses.values_list("user_id", "contest_id")])
+  statuses.delete()
+
+
 def _get_or_invalidate_user(user_id, contest_id, field_name):
-  try:
-    return getattr(UserStatus.objects.get(user_id=user_id, contest_id=contest_id), field_name)
-  except:
-    return getattr(invalidate_user(user_id, contest_id), field_name)
+  key = USER_STATUS_CACHE_KEY.format(user_id, contest_id)
+  cached = cache.get(key)
+  if cached is None:
+    try:
+      us = UserStatus.objects.get(user_id=user_id, contest_id=contest_id)
+    except UserStatus.DoesNotExist:
+      us = invalidate_user(user_id, contest_id)
+    cached = _cached_user_status(us)
+    cache.add(key, cached, timeout=FORTNIGHT)
+  return cached[field_name]
 
 
 def get_accept_submission_count(user_id, contest_id=0):
@@ -107,22 +388,22 @@ def get_accept_problem_count(user_id, contest_id=0):
   return _get_or_invalidate_user(user_id, contest_id, "ac_distinct_count")
 
 
-def get_accept_problem_list(user_id, contest_id=0):
-  t = _get_or_invalidate_user(user_id, contest_id, "ac_list")
-  if not t:
-    return []
-  return list(map(int, t.split(',')))
+def get_accept_problem_set(user_id, contest_id=0):
+  """
+  :rtype: IdSet
+  """
+  return IdSet.from_bytes(_get_or_invalidate_user(user_id, contest_id, "ac_ids"))
 
 
 def get_total_submission_count(user_id, contest_id=0):
   return _get_or_invalidate_user(user_id, contest_id, "total_count")
 
 
-def get_attempted_problem_list(user_id, contest_id=0):
-  t = _get_or_invalidate_user(user_id, contest_id, "total_list")
-  if not t:
-    return []
-  return list(map(int, t.split(',')))
+def get_attempted_problem_set(user_id, contest_id=0):
+  """
+  :rtype: IdSet
+  """
+  return IdSet.from_bytes(_get_or_invalidate_user(user_id, contest_id, "total_ids"))
 
 
 def is_problem_accepted(user, problem):
@@ -144,23 +425,23 @@ def get_children_tag_id(tag: int = -1):
 def tags_stat(user_id):
   all_count = {t.id: t.count for t in Tag.objects.usage_for_model(Problem, counts=True)}
   accept_counter = Counter()
-  accept_list = get_accept_problem_list(user_id)
+  accept_set = get_accept_problem_set(user_id)
   for tag_id in TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Problem)) \
-      .filter(object_id__in=accept_list).values_list("tag_id", flat=True):
+      .filter(object_id__in=list(accept_set)).values_list("tag_id", flat=True):
     accept_counter[tag_id] += 1
   return {tag_id: (accept_counter[tag_id], cnt) for tag_id, cnt in all_count.items()}
 
 
 def get_next_k_recommended_problems(user_id, problem_ids, k=5):
+  """
+  :param problem_ids: problems to pick from
+  :return: up to k of them, as last predicted for the user; the most solved ones until there is a prediction
+  """
   try:
-    problem_list = []
-    for _ in range(3):  # retry 3 times
-      problem_list = cache.get("NEXT_PROBLEM_{}".format(user_id))
-      if problem_list is None:
-        invalidate_user(user_id)
+    problem_list = get_prediction(user_id)
     if problem_list is None:
-      logger.error("Out of retry count")
-      problem_list = []
+      problem_list = Problem.objects.filter(pk__in=problem_ids).order_by("-ac_user_count") \
+                       .values_list("id", flat=True)[:k]
     problem_ids = set(problem_ids)
     ret = []
     for prob in problem_list:
@@ -1,20 +1,34 @@
+import json
+import logging
 import re
+import time
+import traceback
 from collections import Counter
 from datetime import datetime
 
 from django.conf import settings
+from django_redis import get_redis_connection
 
 from account.models import User
 from account.payment import reward_problem_ac, reward_contest_ac
 from dispatcher.judge import send_judge_through_watch
-from dispatcher.manage import upload_case, upload_checker, upload_interactor, upload_validator
-from problem.statistics import invalidate_user
+from dispatcher.semaphore import PRACTICE, REJUDGE
+from dispatcher.sync import sync_server, cold_servers
+from problem.statistics import record_user_submission, record_user_verdict
 from submission.models import Submission, SubmissionReport
+from submission.report import parse_report, pack_report, EMPTY_CASE
 from submission.util import SubmissionStatus
-from utils.detail_formatter import response_fail_with_timestamp
+from utils.detail_formatter import response_fail_with_timestamp, add_timestamp_to_reply
+from utils.hash import sha_hash
 from utils.permission import is_problem_manager, is_contest_manager
-from .models import Problem, SpecialProgram, ProblemRewardStatus
-from .statistics import invalidate_problem
+from .models import Problem, ProblemRewardStatus
+from .statistics import invalidate_problem_user
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_FIELDS = ['status_message', 'status_detail', 'status', 'status_percent', 'status_test', 'judge_server']
+FINAL_FIELDS = PROGRESS_FIELDS + ['status_time', 'status_memory', 'judge_end_time']
+WRITE_STATS_KEY = 'JUDGE:WRITE_STATS'
 
 
 def upload_problem_to_judge_server(problem, server):
@@ -23,14 +37,9 @@ def upload_problem_to_judge_server(problem, server):
   :type problem: Problem
   :type server: Server
   """
-  for case in set(problem.pretest_list + problem.sample_list + problem.case_list):
-    upload_case(server, case)
-  if problem.checker:
-    upload_checker(server, SpecialProgram.objects.get(fingerprint=problem.checker))
-  if problem.validator:
-    upload_validator(server, SpecialProgram.objects.get(fingerprint=problem.validator))
-  if problem.interactor:
-    upload_interactor(server, SpecialProgram.objects.get(fingerprint=problem.interactor))
+  status = sync_server(server, [problem])[problem.pk]
+  if status.last_status:
+    raise ValueError(status.last_status)
 
 
 def create_submission(problem, author: User, code, lang, contest=None, status=SubmissionStatus.WAITING, ip='',
@@ -54,8 +63,10 @@ def create_submission(problem, author: User, code, lang, contest=None, status=Su
       visible = False
   elif is_problem_manager(author, problem):
     visible = False
-  return Submission.objects.create(lang=lang, code=code, author=author, problem=problem, contest=contest,
-                                   status=status, ip=ip, visible=visible)
+  submission = Submission.objects.create(lang=lang, code=code, author=author, problem=problem, contest=contest,
+                                         status=status, ip=ip, visible=visible)
+  record_user_submission(submission)
+  return submission
 
 
 def process_failed_test(details):
@@ -68,16 +79,162 @@ def process_failed_test(details):
     return 0
 
 
+class SubmissionWriter(object):
+  """
+  Persists the judge progress of a submission. Intermediate results are written only when they differ
+  from what was last written, and at most once every JUDGE_WRITE_DEBOUNCE_MS; the final verdict is always
+  written right away.
+  """
+
+  def __init__(self, submission):
+    self.submission = submission
+    self.last_written = self._snapshot()
+    self.last_write_time = 0.
+    self.writes = 0
+    self.updates = 0
+
+  def _snapshot(self):
+    return tuple(getattr(self.submission, field) for field in PROGRESS_FIELDS)
+
+  def _write(self, fields):
+    self.submission.save(update_fields=fields)
+    self.last_written = self._snapshot()
+    self.last_write_time = time.time()
+    self.writes += 1
+
+  def progress(self):
+    self.updates += 1
+    if self._snapshot() == self.last_written or \
+        time.time() - self.last_write_time < settings.JUDGE_WRITE_DEBOUNCE_MS / 1000:
+      return
+    self._write(PROGRESS_FIELDS)
+
+  def final(self, fields=None):
+    self.updates += 1
+    self._write(fields or FINAL_FIELDS)
+    logger.info("submission %d: %d writes for %d judge updates", self.submission.pk, self.writes, self.updates)
+    try:
+      with get_redis_connection("judge").pipeline() as pipe:
+        pipe.hincrby(WRITE_STATS_KEY, 'submissions', 1)
+        pipe.hincrby(WRITE_STATS_KEY, 'writes', self.writes)
+        pipe.hincrby(WRITE_STATS_KEY, 'updates', self.updates)
+        pipe.execute()
+    except:
+      logger.warning(traceback.format_exc())
+
+
+def judge_setup(problem, code, lang):
+  """
+  Fingerprint of what the result of a case depends on besides its data: code, language, limits, checker and
+  interactor. It is recorded in every detail, and results are only reused by a judgement of the same setup.
+  """
+  return sha_hash(json.dumps([code, lang, problem.time_limit, problem.memory_limit,
+                              problem.checker, problem.interactor]))[:16]
+
+
+def previous_results(submission, setup):
+  """
+  Results of the last judgement of a submission that are still valid, keyed by case hash. Only details recording
+  the case they belong to and the setup they were judged with are looked at.
+
+  :return: dict case hash -> detail, or None if there is nothing to reuse (e.g. a compile error)
+  """
+  if submission.status == SubmissionStatus.COMPILE_ERROR:
+    return None
+  try:
+    details = submission.status_detail_list
+  except ValueError:
+    return None
+  known = {}
+  for detail in details:
+    if detail.get('case') and detail.get('setup') == setup and detail.get('verdict') is not None:
+      known[detail['case']] = {k: v for k, v in detail.items() if k != 'point'}
+  return known or None
+
+
+def previous_report(submission, report_instance, known):
+  """
+  :return: dict case hash -> (meta, fields) of the previous report, for the cases whose results are reused
+  """
+  try:
+    details = submission.status_detail_list
+    cases = report_instance.report.cases
+  except:
+    logger.warning(traceback.format_exc())
+    return {}
+  if len(details) != len(cases):  # not reported case by case, or not at all
+    return {}
+  return {detail['case']: (case.meta, {name: getattr(case, name) for name in EMPTY_CASE})
+          for detail, case in zip(details, cases) if detail.get('case') in known}
+
+
+def merge_delta_result(data, known, case_list, judged_cases):
+  """
+  Put the results of the cases just judged among the previous ones, in the order of `case_list`;
+  a final verdict is recomputed as the first failure among all cases.
+
+  :return: a new reply; `data` is left as received, since it may be memoized
+  """
+  judged = dict(zip(judged_cases, data.get('detail', [])))
+  merged = []
+  for case in case_list:
+    detail = known.get(case) or judged.get(case)
+    if detail is None:
+      break
+    merged.append(dict(detail))
+  data = dict(data, detail=merged)
+  if SubmissionStatus.is_judged(data.get('verdict')) and data.get('verdict') != SubmissionStatus.COMPILE_ERROR:
+    data['verdict'] = next((d['verdict'] for d in merged if d.get('verdict') != SubmissionStatus.ACCEPTED),
+                           SubmissionStatus.ACCEPTED)
+  return data
+
+
+class DeltaReport(object):
+  """
+  Stands for the report of a delta judgement: the cases just judged are put among the reused ones of the
+  previous report, in the order of `case_list`, so that the report lines up with the merged details
+  """
+
+  def __init__(self, instance, reused, case_list, judged_cases):
+    self.instance = instance
+    self.reused = reused
+    self.case_list = case_list
+    self.judged_cases = judged_cases
+
+  def set_content(self, text):
+    try:
+      judged = dict(zip(self.judged_cases, parse_report(text))) if text.strip() else {}
+    except ValueError:
+      judged = {}
+    cases = []
+    for case in self.case_list:
+      entry = self.reused.get(case) or judged.get(case)
+      if entry is None:
+        break
+      cases.append(entry)
+    self.instance.data, self.instance.content = pack_report(cases) if cases else None, ""
+
+  def save(self):
+    self.instance.save()
+
+
 def judge_submission_on_problem(submission, callback=None, **kwargs):
   """
   :type submission: Submission
   :param callback: function, call when judge result is received
   :param case: can be pretest or sample or all
+  :param watch: function with the signature of `send_judge_through_watch`, which is the default
+  :param priority: judge queue priority class, practice by default
+  :param memoize: reuse the result of an identical earlier judgement, see dispatcher.memo
+  :param delta: only cases not judged before with the same setup (see `judge_setup`) are sent to the judge,
+                and their results are merged into the previous ones
   :return:
   """
 
   problem = submission.problem
   code = submission.code
+  # the verdict the status of the author counts, replaced by the one judged here
+  counted_status = submission.status
 
   # concat code for template judging
   templates = problem.template_dict
@@ -112,16 +269,33 @@ def judge_submission_on_problem(submission, callback=None, **kwargs):
     total_score = max(1, sum(map(lambda x: point_query.get(x, 10), case_list)))
   status_for_pretest = kwargs.get('status_for_pretest', False)
 
+  judge_cases, judge_group_config = case_list, group_config
+  run_until_complete = kwargs.get('run_until_complete', False)
+  setup = judge_setup(problem, code, submission.lang)
+  known = None
+  if kwargs.get('delta') and case_list == problem.case_list:
+    known = previous_results(submission, setup)
+  if known is not None:
+    # every new case is run, so that the verdict can be taken from the merged results
+    judge_cases = [case for case in case_list if case not in known]
+    judge_group_config = {"on": False}
+    run_until_complete = True
+
   def process_accepted(status):
     if status == SubmissionStatus.ACCEPTED and status_for_pretest:
       return SubmissionStatus.PRETEST_PASSED
     else:
       return status
 
+  writer = SubmissionWriter(submission)
+
   def on_receive_data(data):
+    nonlocal counted_status
     judge_time = datetime.fromtimestamp(data['timestamp'])
     if submission.judge_end_time and judge_time < submission.judge_end_time:
       return True
+    if known is not None and data.get('status') == 'received':
+      data = merge_delta_result(data, known, case_list, judge_cases)
     if data.get('status') == 'received':
       if 'message' in data:
         submission.status_message = data['message']
@@ -142,12 +316,12 @@ def judge_submission_on_problem(submission, callback=None, **kwargs):
         except:
           pass
         submission.status_percent = score
+      for case, detail in zip(case_list, details):
+        detail['case'], detail['setup'] = case, setup
       display_details = details + [{}] * max(0, len(case_list) - len(details))
       submission.status_detail_list = display_details
       submission.status_test = process_failed_test(display_details)
       submission.judge_server = data.get('server', 0)
-      submission.save(update_fields=['status_message', 'status_detail', 'status',
-                                     'status_percent', 'status_test', 'judge_server'])
 
       if SubmissionStatus.is_judged(data.get('verdict')):
         if group_config["on"] and data.get('verdict') != SubmissionStatus.COMPILE_ERROR:
@@ -180,8 +354,7 @@ def judge_submission_on_problem(submission, callback=None, **kwargs):
           pass
         submission.judge_end_time = judge_time
 
-        submission.save(update_fields=['status_time', 'status_memory',
-                                       'judge_end_time', 'status_message', 'status_percent'])
+        writer.final()
 
         if submission.status == SubmissionStatus.ACCEPTED:
           # Add reward
@@ -193,25 +366,39 @@ def judge_submission_on_problem(submission, callback=None, **kwargs):
             else:
               reward_problem_ac(submission.author, problem.reward, submission.problem_id)
 
-        invalidate_user(submission.author_id, submission.contest_id)
-        invalidate_problem(submission.problem)
+        record_user_verdict(submission, counted_status)
+        counted_status = submission.status
+        invalidate_problem_user(submission.problem_id, submission.author_id)
         if callback:
           callback()
         return True
+      writer.progress()
       return False
     else:
       submission.status = SubmissionStatus.SYSTEM_ERROR
       submission.status_message = data['message']
-      submission.save(update_fields=['status', 'status_message'])
+      writer.final(['status', 'status_message'])
+      record_user_verdict(submission, counted_status)
+      counted_status = submission.status
       return True
 
   try:
     report_instance, _ = SubmissionReport.objects.get_or_create(submission=submission)
-    report_instance.content = ""
+    if known is not None:
+      report_instance = DeltaReport(report_instance, previous_report(submission, report_instance, known),
+                                    case_list, judge_cases)
+    report_instance.set_content("")
     report_instance.save()
-    send_judge_through_watch(code, submission.lang, problem.time_limit, problem.memory_limit,
-                             kwargs.get('run_until_complete', False),
-                             case_list, problem.checker, problem.interactor, group_config,
-                             on_receive_data, report_instance=report_instance)
+    if known is not None and not judge_cases:
+      on_receive_data(add_timestamp_to_reply({"status": "received", "verdict": SubmissionStatus.ACCEPTED}))
+      return
+    watch = kwargs.get('watch') or send_judge_through_watch
+    priority = kwargs.get('priority', PRACTICE)
+    # a rejudge is timed from when its task starts judging, not from when the submission was made
+    queued_at = submission.create_time.timestamp() if priority != REJUDGE else None
+    watch(code, submission.lang, problem.time_limit, problem.memory_limit, run_until_complete,
+          judge_cases, problem.checker, problem.interactor, judge_group_config,
+          on_receive_data, report_instance=report_instance, priority=priority,
+          memoize=kwargs.get('memoize', False), avoid_servers=list(cold_servers(problem.pk)), queued_at=queued_at)
   except:
     on_receive_data(response_fail_with_timestamp())
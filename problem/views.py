@@ -23,11 +23,13 @@ from tagging.models import Tag, TaggedItem, ContentType
 from account.models import User
 from account.permissions import is_admin_or_root
 from blog.models import Blog
+from dispatcher.aio import enqueue_submission
 from dispatcher.models import Server
 from problem import recommendation
 from problem.commons.problem_list_helper import attach_personal_solve_info, attach_tag_info
 from problem.models.feedback import FeedbackCompare
-from problem.statistics import get_accept_problem_list, get_attempted_problem_list, is_problem_accepted
+from problem.statistics import get_accept_problem_set, get_attempted_problem_set, is_problem_accepted, \
+  get_problem_stats
 from submission.models import Submission
 from submission.util import SubmissionStatus, STATUS_CHOICE
 from submission.views import render_submission, render_submission_report
@@ -68,11 +70,12 @@ class ProblemList(ListView):
       queryset = Problem.objects.all()
     if self.request.user.is_authenticated and compared_user and compared_user.isdigit():
       self.compare_user = get_object_or_404(User, pk=compared_user)
-      self.her_attempt = set(get_attempted_problem_list(compared_user))
-      self.her_solved = set(get_accept_problem_list(compared_user))
-      self.my_attempt = set(get_attempted_problem_list(self.request.user.id))
-      self.my_solved = set(get_accept_problem_list(self.request.user.id))
-      queryset = queryset.filter(pk__in=self.her_attempt | self.her_solved | self.my_attempt | self.my_solved)
+      self.her_attempt = get_attempted_problem_set(compared_user)
+      self.her_solved = get_accept_problem_set(compared_user)
+      self.my_attempt = get_attempted_problem_set(self.request.user.id)
+      self.my_solved = get_accept_problem_set(self.request.user.id)
+      # solved problems are attempted ones as well
+      queryset = queryset.filter(pk__in=list(self.her_attempt | self.my_attempt))
       self.comparing = True
       self.paginate_by = 200
     else:
@@ -123,11 +126,11 @@ class ProblemList(ListView):
         reversed = False
       else:
         reversed = True
-      ref = {problem_id: 1 for problem_id in self.her_attempt}
-      ref.update({problem_id: -1 for problem_id in self.her_solved})
-      ref2 = {problem_id: -1 for problem_id in self.my_attempt}
-      ref2.update({problem_id: 1 for problem_id in self.my_solved})
-      ret = sorted(ret, key=lambda x: (ref2.get(x.id, 0), ref.get(x.id, 0)), reverse=reversed)
+      def label(x, solved, attempt):
+        return 1 if x.id in solved else (-1 if x.id in attempt else 0)
+
+      ret = sorted(ret, key=lambda x: (label(x, self.my_solved, self.my_attempt),
+                                       -label(x, self.her_solved, self.her_attempt)), reverse=reversed)
     return ret
 
   def get_context_data(self, **kwargs):  # pylint: disable=arguments-differ
@@ -228,13 +231,9 @@ class ProblemView(ProblemDetailMixin, TemplateView):
       'ac_count': self.problem.ac_count,
       'all_count': self.problem.total_count,
       'difficulty': self.problem.reward,
-      'stats': self.problem.stats,
+      'stats': get_problem_stats(self.problem),
+      'last_sub_time': self.problem.last_submit_time,
     }
-    try:
-      last_sub_time = self.problem.submission_set.first().create_time
-    except:
-      last_sub_time = None
-    data.update(last_sub_time=last_sub_time)
     return data
 
   def get_tag_info(self):
@@ -274,7 +273,10 @@ class ProblemSubmitView(ProblemDetailMixin, View):
         raise ValueError("语言无效。")
       submission = create_submission(self.problem, self.user, request.POST.get('code', ''), lang, ip=get_ip(request))
       running_complete = bool(is_problem_manager(self.user, self.problem) and request.POST.get('complete'))
-      async_task(judge_submission_on_problem, submission, run_until_complete=running_complete)
+      if settings.JUDGE_ASYNC_DISPATCHER:
+        enqueue_submission(submission.pk, run_until_complete=running_complete)
+      else:
+        async_task(judge_submission_on_problem, submission, run_until_complete=running_complete)
       return JsonResponse({"url": reverse('problem:submission_api',
                                           kwargs={'pk': self.problem.id, 'sid': submission.id})})
     except Exception as e:
@@ -415,7 +417,10 @@ class ProblemStatisticsView(ProblemDetailMixin, StatusList):
     data['all_count'] = self.problem.total_count
     data['ratio'] = self.problem.ac_ratio * 100
     data['difficulty'] = self.problem.reward
-    data['stats'] = self.problem.stats
+    data['stats'] = get_problem_stats(self.problem)
+    lang_names = dict(LANG_CHOICE)
+    data['language_stats'] = [(lang_names.get(lang, lang or "N/A"), accepted, total)
+                              for lang, accepted, total in self.problem.language_stats]
     data['param_type'] = self.request.GET.get('type', 'latest')
     data['tags'] = edit_string_for_tags(self.problem.tags)
     data['tags_choices'] = Tag.objects.all().values_list("name", flat=True)
@@ -490,7 +495,7 @@ class ProblemSubmissionView(LoginRequiredMixin, TemplateView):
       permission = get_permission_for_submission(self.request.user, submission, special_permission=True)
       data['submission_block'] = render_submission(submission, permission=permission)
       if permission == 2 or self.request.user == submission.author:
-        data['report_block'] = render_submission_report(submission.pk)
+        data['report_block'] = render_submission_report(submission.pk, self.request.GET.get('case'))
       else:
         data['report_block'] = ''
     else:
@@ -546,12 +551,12 @@ class ArchiveList(TemplateView):
       problem_set = problem_set.union(skill.parsed_problem_list)
     problem_set = {problem.pk: problem for problem in Problem.objects.only("title").filter(pk__in=problem_set)}
     skill_list = {skill.pk: skill for skill in skill_list}
-    attempt_list = set(get_attempted_problem_list(self.request.user.id))
-    accept_list = set(get_accept_problem_list(self.request.user.id))
+    attempt_set = get_attempted_problem_set(self.request.user.id)
+    accept_set = get_accept_problem_set(self.request.user.id)
     for problem in problem_set.values():
-      if problem.pk in accept_list:
+      if problem.pk in accept_set:
         problem.personal_label = 1
-      elif problem.pk in attempt_list:
+      elif problem.pk in attempt_set:
         problem.personal_label = -1
     data.update(children_list=children_list, problem_list=problem_list, problem_set=problem_set, skill_list=skill_list)
     return data
@@ -600,7 +605,7 @@ class ProblemFeedbackCompare(LoginRequiredMixin, TemplateView):
 
   def get_context_data(self, **kwargs):
     data = super().get_context_data(**kwargs)
-    accept_problems = list(Problem.objects.filter(id__in=get_accept_problem_list(self.request.user.pk),
+    accept_problems = list(Problem.objects.filter(id__in=list(get_accept_problem_set(self.request.user.pk)),
                                                   visible=True).values_list("id", flat=True))
     if len(accept_problems) < 2:
       raise PermissionDenied
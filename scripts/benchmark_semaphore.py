@@ -0,0 +1,95 @@
+"""
+Compare judge slot handoff throughput of the Lua scripted semaphore against the previous command sequence.
+
+  python manage.py runscript benchmark_semaphore --script-args 8 20000
+
+The first arg is the number of concurrent clients, the second the total number of handoffs.
+A separate namespace is used, so the production semaphore is not touched.
+"""
+import threading
+import time
+
+from django_redis import get_redis_connection
+
+from dispatcher.semaphore import Semaphore, namespaced_key
+
+SLOTS = 4
+# The keys the semaphore used before it was scripted, kept apart from the ones of BenchmarkSemaphore
+LEGACY = {suffix: namespaced_key('SEMAPHORE_BENCHMARK', 'LEGACY:' + suffix)
+          for suffix in ('EXISTS', 'AVAILABLE', 'GRABBED', 'RELEASE_LOCKS')}
+
+
+class BenchmarkSemaphore(Semaphore):
+  def __init__(self, client):
+    super().__init__(client, lease_ttl=60, namespace='SEMAPHORE_BENCHMARK')
+
+  def get_tokens(self):
+    return ["0:%d" % x for x in range(SLOTS)]
+
+
+def legacy_reset(client):
+  client.delete(LEGACY['AVAILABLE'], LEGACY['GRABBED'])
+  client.rpush(LEGACY['AVAILABLE'], *["0:%d" % x for x in range(SLOTS)])
+
+
+def legacy_handoff(sem):
+  """
+  The round trips the semaphore used to make for one acquire and one release
+  """
+  client = sem.client
+  client.getset(LEGACY['EXISTS'], sem.exists_val)
+  if not client.getset(LEGACY['RELEASE_LOCKS'], sem.exists_val):
+    client.expire(LEGACY['RELEASE_LOCKS'], 10)
+    for _ in client.hgetall(LEGACY['GRABBED']).items():
+      pass
+    client.delete(LEGACY['RELEASE_LOCKS'])
+  _, token = client.blpop(LEGACY['AVAILABLE'], 0)
+  client.hset(LEGACY['GRABBED'], token, sem.current_time)
+  client.hexists(LEGACY['GRABBED'], token)
+  with client.pipeline() as pipe:
+    pipe.multi()
+    pipe.hdel(LEGACY['GRABBED'], token)
+    pipe.lpush(LEGACY['AVAILABLE'], token)
+    pipe.execute()
+
+
+def lua_reset(client):
+  BenchmarkSemaphore(client).reset()
+
+
+def lua_handoff(sem):
+  sem.acquire()
+  sem.release()
+
+
+def measure(reset, handoff, clients, total):
+  client = get_redis_connection("judge")
+  reset(client)
+  per_client = total // clients
+
+  def work():
+    sem = BenchmarkSemaphore(client)
+    for _ in range(per_client):
+      handoff(sem)
+
+  threads = [threading.Thread(target=work) for _ in range(clients)]
+  start = time.time()
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  return per_client * clients / (time.time() - start)
+
+
+def run(*args):
+  clients = int(args[0]) if len(args) > 0 else 8
+  total = int(args[1]) if len(args) > 1 else 20000
+  legacy = measure(legacy_reset, legacy_handoff, clients, total)
+  lua = measure(lua_reset, lua_handoff, clients, total)
+  print("clients: %d, slots: %d, handoffs: %d" % (clients, SLOTS, total))
+  print("legacy: %.1f handoffs/s" % legacy)
+  print("lua:    %.1f handoffs/s (%.2fx)" % (lua, lua / legacy))
+  client = get_redis_connection("judge")
+  keys = client.keys(namespaced_key('SEMAPHORE_BENCHMARK', '*'))
+  if keys:
+    client.delete(*keys)
@@ -0,0 +1,30 @@
+"""
+Measure the speed of judge servers with the calibration programs of dispatcher.calibration.
+
+  python manage.py runscript calibrate_judges                              # every enabled server
+  python manage.py runscript calibrate_judges --script-args 3 5            # servers 3 and 5
+  python manage.py runscript calibrate_judges --script-args baseline=3     # print a baseline from server 3
+  python manage.py runscript calibrate_judges --script-args apply 3        # also apply drifted multipliers
+"""
+import json
+
+from dispatcher.calibration import calibrate_servers, baseline_from, apply_calibration
+from dispatcher.models import Server
+
+
+def run(*args):
+  options = dict(arg.split("=", 1) for arg in args if "=" in arg)
+  if "baseline" in options:
+    baseline = baseline_from(Server.objects.get(pk=int(options["baseline"])))
+    print("JUDGE_CALIBRATION_BASELINE = %s" % json.dumps(baseline))
+    return
+  server_ids = [int(arg) for arg in args if arg.isdigit()] or None
+  for calibration in calibrate_servers(server_ids):
+    if calibration is None:
+      continue
+    print("%s: %.3f [%.3f, %.3f], currently %.3f%s" % (
+      calibration.server, calibration.multiplier, calibration.lower, calibration.upper,
+      calibration.previous_multiplier, " DRIFTED" if calibration.drifted else ""))
+    if calibration.drifted and "apply" in args:
+      apply_calibration(calibration)
+      print("  applied")
@@ -0,0 +1,42 @@
+from django.db import transaction
+from django.db.models import Q
+from django.template.defaultfilters import filesizeformat
+
+from submission.models import SubmissionReport
+
+BATCH_SIZE = 500
+
+
+def run(*args):
+  """
+  Pack the reports stored as plain text: `python manage.py runscript compress_submission_reports`.
+  With `--script-args dry`, nothing is written, only the space that would be saved is reported.
+  Reports that cannot be parsed are left as they are.
+  """
+  dry = "dry" in args
+  before, after, packed, skipped = 0, 0, 0, 0
+  last_pk = 0
+  while True:
+    batch = list(SubmissionReport.objects.filter(pk__gt=last_pk).filter(~Q(content=""))
+                 .only("id", "content").order_by("pk")[:BATCH_SIZE])
+    if not batch:
+      break
+    last_pk = batch[-1].pk
+    with transaction.atomic():
+      for report in batch:
+        size = len(report.content.encode())
+        report.set_content(report.content)
+        if report.content:
+          skipped += 1
+          continue
+        before += size
+        after += len(report.data or b'')
+        packed += 1
+        if not dry:
+          report.save(update_fields=["content", "data"])
+    print("%d reports packed, %d skipped, %s -> %s" % (packed, skipped, filesizeformat(before), filesizeformat(after)))
+
+  saved = before - after
+  print("Done%s: %d reports packed, %d left as text. %s -> %s, %s saved (%.1f%%)." % (
+    " (dry run)" if dry else "", packed, skipped, filesizeformat(before), filesizeformat(after),
+    filesizeformat(saved), saved * 100 / before if before else 0))
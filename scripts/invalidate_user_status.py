@@ -0,0 +1,20 @@
+"""
+Rebuild the status of users (solved and attempted problems, submission counts) from all their submissions.
+
+  python manage.py runscript invalidate_user_status [--script-args <user id> ...]
+
+Every user with a status by default. The statuses are kept up to date submission by submission,
+so this is only needed after submissions were changed behind the site's back.
+"""
+import progressbar
+
+from problem.models import UserStatus
+from problem.statistics import invalidate_user
+
+
+def run(*args):
+  statuses = UserStatus.objects.order_by("user_id", "contest_id")
+  if args:
+    statuses = statuses.filter(user_id__in=list(map(int, args)))
+  for user_id, contest_id in progressbar.progressbar(list(statuses.values_list("user_id", "contest_id"))):
+    invalidate_user(user_id, contest_id)
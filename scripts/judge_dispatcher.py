@@ -0,0 +1,16 @@
+from contest.tasks import judge_submission_on_contest
+from dispatcher.aio import AsyncDispatcher
+from problem.tasks import judge_submission_on_problem
+from submission.models import Submission
+
+
+def handle(submission_id, watch, **kwargs):
+  submission = Submission.objects.get(pk=submission_id)
+  if submission.contest_id:
+    judge_submission_on_contest(submission, watch=watch, **kwargs)
+  else:
+    judge_submission_on_problem(submission, watch=watch, **kwargs)
+
+
+def run(*args):
+  AsyncDispatcher(handle).run_forever()
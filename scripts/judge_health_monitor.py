@@ -0,0 +1,5 @@
+from dispatcher.health import run_monitor
+
+
+def run(*args):
+  run_monitor()
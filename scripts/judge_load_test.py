@@ -0,0 +1,138 @@
+"""
+Push synthetic submissions through `judge_submission_on_problem` and measure the dispatcher.
+
+  python manage.py runscript judge_load_test --script-args problem=1 n=500 threads=32 mock=2 concurrency=8
+
+  problem: id of the problem to submit to (required)
+  user: username of the author, the first superuser by default
+  n: number of submissions; threads: number of submissions judged at the same time
+  mock: start this many emulated judge servers (tests/mock_judge.py) in this process, and register them
+        as enabled servers for the duration of the test; 0 to use the servers already enabled
+  concurrency, case_seconds, compile_seconds, fail_rate, stall_rate, reject_rate: settings of the emulators
+  keep: 1 to keep the submissions afterwards
+
+Run it against a staging database: submissions are judged for real as far as the site is concerned
+(statistics, rewards), and the semaphore is reset when the emulated servers come and go.
+Redis ops are counted server-wide, so they include whatever else talks to the same Redis.
+"""
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django_redis import get_redis_connection
+
+from account.models import User
+from dispatcher.models import Server
+from dispatcher.semaphore import Semaphore
+from problem.models import Problem
+from problem.statistics import invalidate_problem, reset_user_status
+from problem.tasks import judge_submission_on_problem, WRITE_STATS_KEY
+from submission.models import Submission
+from submission.util import SubmissionStatus, STATUS_CHOICE
+from tests.mock_judge import MockJudge, MockJudgeConfig, make_server
+
+MOCK_NAME = "loadtest-%d"
+MOCK_OPTIONS = ("concurrency", "case_seconds", "compile_seconds", "fail_rate", "stall_rate", "reject_rate")
+
+
+def percentile(values, q):
+  if not values:
+    return 0.
+  values = sorted(values)
+  return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def start_mocks(count, options):
+  config = MockJudgeConfig(**options)
+  mocks = []
+  for index in range(count):
+    judge = MockJudge(config)
+    http_server = make_server(judge, "127.0.0.1", 0)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    server = Server.objects.create(name=MOCK_NAME % index, ip="127.0.0.1", port=http_server.server_address[1],
+                                   token="mock", enabled=True, concurrency=config.concurrency, version=3)
+    mocks.append((judge, http_server, server))
+  Semaphore(get_redis_connection("judge")).reset()
+  return mocks
+
+
+def stop_mocks(mocks):
+  for _, http_server, server in mocks:
+    http_server.shutdown()
+    server.delete()
+  Semaphore(get_redis_connection("judge")).reset()
+
+
+class WriteCounter(object):
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.count = 0
+
+  def __call__(self, execute, sql, params, many, context):
+    if sql.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+      with self.lock:
+        self.count += 1
+    return execute(sql, params, many, context)
+
+
+def run(*args):
+  options = dict(arg.split("=", 1) for arg in args)
+  problem = Problem.objects.get(pk=int(options["problem"]))
+  if "user" in options:
+    author = User.objects.get(username=options["user"])
+  else:
+    author = User.objects.filter(is_superuser=True).order_by("pk").first()
+  total, threads = int(options.get("n", 100)), int(options.get("threads", 16))
+  mock_options = {key: (int if key == "concurrency" else float)(options[key]) for key in MOCK_OPTIONS
+                  if key in options}
+
+  mocks = start_mocks(int(options.get("mock", 1)), mock_options)
+  submissions = [Submission.objects.create(lang="cpp", code="// load test %d" % index, problem=problem,
+                                           author=author, status=SubmissionStatus.WAITING)
+                 for index in range(total)]
+  client = get_redis_connection("judge")
+  writes = WriteCounter()
+  turnaround = []
+  redis_before = client.info("stats")["total_commands_processed"]
+  updates_before = {k.decode(): int(v) for k, v in client.hgetall(WRITE_STATS_KEY).items()}
+
+  def judge_one(submission):
+    start = time.time()
+    try:
+      with connection.execute_wrapper(writes):
+        judge_submission_on_problem(submission)
+    finally:
+      connection.close()
+    turnaround.append(time.time() - start)
+
+  start = time.time()
+  try:
+    with ThreadPoolExecutor(threads) as executor:
+      list(executor.map(judge_one, submissions))
+    elapsed = time.time() - start
+    redis_ops = client.info("stats")["total_commands_processed"] - redis_before
+    updates_after = {k.decode(): int(v) for k, v in client.hgetall(WRITE_STATS_KEY).items()}
+    verdicts = Counter(Submission.objects.filter(pk__in=[s.pk for s in submissions])
+                       .values_list("status", flat=True))
+  finally:
+    stop_mocks(mocks)
+    if options.get("keep") != "1":
+      Submission.objects.filter(pk__in=[s.pk for s in submissions]).delete()
+      invalidate_problem(problem)
+      reset_user_status([author.pk])
+
+  print("submissions: %d, threads: %d, servers: %s" % (total, threads, len(mocks) or "enabled"))
+  print("throughput: %.2f submissions/s in %.1f s" % (total / elapsed, elapsed))
+  print("turnaround: p50 %.3f s, p99 %.3f s, max %.3f s" % (percentile(turnaround, .5), percentile(turnaround, .99),
+                                                           max(turnaround or [0])))
+  print("db writes: %d (%.1f per submission); judge updates: %d, submission writes: %d" % (
+    writes.count, writes.count / total, updates_after.get("updates", 0) - updates_before.get("updates", 0),
+    updates_after.get("writes", 0) - updates_before.get("writes", 0)))
+  print("redis ops: %d (%.1f per submission)" % (redis_ops, redis_ops / total))
+  names = dict(STATUS_CHOICE)
+  print("verdicts: " + ", ".join("%s %d" % (names.get(k, k), v) for k, v in verdicts.most_common()))
+  for judge, _, server in mocks:
+    print("%s: %s" % (server.name, judge.stats))
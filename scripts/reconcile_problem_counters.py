@@ -0,0 +1,17 @@
+"""
+Verify the counters of every problem against a full recount of its visible submissions.
+
+  python manage.py runscript reconcile_problem_counters [--script-args fix]
+
+With `fix`, problems that drifted are recounted. To run it periodically, schedule
+`problem.statistics.reconcile_problems` with django-q (admin, Scheduled tasks) or run this script from cron.
+"""
+from problem.statistics import reconcile_problems
+
+
+def run(*args):
+  report = reconcile_problems(fix="fix" in args)
+  for problem_id, drift in sorted(report.items()):
+    print("%d: %s" % (problem_id, ", ".join("%s %s -> %s" % (field, stored, recounted)
+                                            for field, (stored, recounted) in sorted(drift.items()))))
+  print("%d problems drifted" % len(report))
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.17 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submissionreport',
+            name='data',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
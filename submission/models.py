@@ -5,6 +5,7 @@ from django.db import models
 from account.models import User
 from contest.models import Contest
 from problem.models import Problem
+from submission.report import Report, pack_report, parse_report
 from submission.util import SubmissionStatus, STATUS_CHOICE
 from utils.language import LANG_CHOICE, transform_code_to_html
 from utils.time import datetime_display
@@ -131,7 +132,28 @@ class Submission(models.Model):
 
 class SubmissionReport(models.Model):
   submission = models.OneToOneField(Submission, on_delete=models.CASCADE)
-  content = models.TextField(blank=True)
+  content = models.TextField(blank=True)  # as reported by the judge server; only in rows not yet packed
+  data = models.BinaryField(blank=True, null=True)  # packed, see submission.report
+
+  def set_content(self, text):
+    """
+    Pack a report as received from the judge server (does not save).
+    Reports that cannot be parsed are kept as they are.
+    """
+    try:
+      self.data = pack_report(parse_report(text)) if text.strip() else None
+      self.content = ""
+    except ValueError:
+      self.data, self.content = None, text
+
+  @property
+  def report(self):
+    """
+    :rtype: submission.report.Report
+    """
+    if self.content:
+      return Report(pack_report(parse_report(self.content)))
+    return Report(self.data)
 
 
 class PrintManager(models.Model):
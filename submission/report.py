@@ -0,0 +1,108 @@
+"""
+Storage of judge reports (`SubmissionReport`).
+
+Judge servers send a report as one line per case: "meta|b64|b64|...", with 4 (input, output, answer, checker),
+5 (stderr after output) or 7 (pipes of the interactor at the end) base64 fields. It is stored packed:
+
+  4 bytes: length of the index, big endian
+  index: zlib-compressed JSON, [[meta, offset, length], ...]
+  chunks: one zlib-compressed JSON object of the decoded fields per case, at `offset` from the end of the index
+
+so that listing the cases reads the index only, and showing a case decompresses that case only.
+"""
+
+import json
+import struct
+import zlib
+from base64 import b64decode
+
+FIELDS = {
+  4: ('input', 'output', 'answer', 'checker'),
+  5: ('input', 'output', 'stderr', 'answer', 'checker'),
+  7: ('input', 'output', 'stderr', 'answer', 'checker', 'pipe1', 'pipe2'),
+}
+EMPTY_CASE = {'input': '', 'output': '', 'stderr': '', 'answer': '', 'checker': '', 'pipe1': '', 'pipe2': ''}
+
+
+def parse_report(text):
+  """
+  :return: list of (meta, dict of fields) from the text reported by a judge server
+  :raises ValueError: if a line has an unknown number of fields
+  """
+  cases = []
+  for line in text.strip().split("\n"):
+    if not line:
+      continue
+    meta, *b64s = line.split('|')
+    if len(b64s) not in FIELDS:
+      raise ValueError("unexpected report line with %d fields" % len(b64s))
+    cases.append((meta, {name: b64decode(txt.encode()).decode(errors='replace')
+                         for name, txt in zip(FIELDS[len(b64s)], b64s)}))
+  return cases
+
+
+def pack_report(cases, level=6):
+  """
+  :param cases: list of (meta, dict of fields)
+  :rtype: bytes
+  """
+  index, chunks, offset = [], [], 0
+  for meta, fields in cases:
+    chunk = zlib.compress(json.dumps(fields).encode(), level)
+    index.append([meta, offset, len(chunk)])
+    chunks.append(chunk)
+    offset += len(chunk)
+  index = zlib.compress(json.dumps(index).encode(), level)
+  return struct.pack('>I', len(index)) + index + b''.join(chunks)
+
+
+class ReportCase(object):
+  """
+  A case of a packed report; fields are decompressed on first access
+  """
+
+  def __init__(self, report, number, meta, offset, length):
+    self._report = report
+    self.number = number
+    self.meta = meta
+    self._offset, self._length = offset, length
+    self._fields = None
+
+  def __getattr__(self, name):
+    if name not in EMPTY_CASE:
+      raise AttributeError(name)
+    if self._fields is None:
+      self._fields = self._report.decode_chunk(self._offset, self._length)
+    return self._fields.get(name, '')
+
+
+class Report(object):
+
+  def __init__(self, data):
+    data = bytes(data or b'')
+    if data:
+      index_length, = struct.unpack('>I', data[:4])
+      self._body_start = 4 + index_length
+      index = json.loads(zlib.decompress(data[4:self._body_start]).decode())
+    else:
+      self._body_start, index = 0, []
+    self._data = data
+    self.cases = [ReportCase(self, number, *entry) for number, entry in enumerate(index, start=1)]
+
+  def decode_chunk(self, offset, length):
+    start = self._body_start + offset
+    return json.loads(zlib.decompress(self._data[start:start + length]).decode())
+
+  def __len__(self):
+    return len(self.cases)
+
+  def __iter__(self):
+    return iter(self.cases)
+
+  def __getitem__(self, number):
+    """
+    :param number: case number, starting from 1
+    """
+    if not 1 <= number <= len(self.cases):
+      raise IndexError(number)
+    return self.cases[number - 1]
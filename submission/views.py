@@ -1,5 +1,5 @@
 import datetime
-from base64 import b64decode
+import zlib
 
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
@@ -53,26 +53,20 @@ def render_submission(submission: Submission, permission=1, hide_problem=False,
                                  GlobalRequestMiddleware.get_current_request())
 
 
-def render_submission_report(pk):
+def render_submission_report(pk, case=None):
+  """
+  :param case: number of the only case to show (starting from 1), all cases by default;
+               the cases not shown are never decompressed
+  """
   try:
-    report = SubmissionReport.objects.get(submission_id=pk)
-    lines = report.content.strip().split("\n")
-    ans = []
-    for line in lines:
-      meta, *b64s = line.split('|')
-      stderr, pipe1, pipe2 = "", "", ""
-      if len(b64s) == 4:
-        input, output, answer, checker = map(lambda txt: b64decode(txt.encode()).decode(), b64s)
-
-      elif len(b64s) == 5:
-        input, output, stderr, answer, checker = map(lambda txt: b64decode(txt.encode()).decode(), b64s)
-      else:
-        input, output, stderr, answer, checker, pipe1, pipe2 = map(lambda txt: b64decode(txt.encode()).decode(), b64s)
-      ans.append({'meta': meta, 'input': input, 'output': output, 'stderr': stderr,
-                  'answer': answer, 'checker': checker, 'pipe1': pipe1, 'pipe2': pipe2})
+    report = SubmissionReport.objects.get(submission_id=pk).report
+    if case is not None:
+      testcases = [report[int(case)]]
+    else:
+      testcases = report.cases
     t = loader.get_template('components/submission_report.jinja2')
-    return t.render(Context({'testcases': ans}))
-  except (SubmissionReport.DoesNotExist, ValueError):
+    return t.render(Context({'report': report, 'testcases': testcases, 'single': case is not None}))
+  except (SubmissionReport.DoesNotExist, ValueError, IndexError, zlib.error):
     return ''
 
 
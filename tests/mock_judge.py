@@ -0,0 +1,246 @@
+"""
+An emulated judge server, for load testing the dispatcher without running any code.
+
+  python tests/mock_judge.py --port 5001 --concurrency 4 --case-seconds 0.05 --fail-rate 0.01
+
+It speaks enough of the judge server API for judging (/judge, /query, /query/report, pushing to `callback_url`),
+synchronizing (/exist/case, /upload/*, /list/spj) and health checks (/ping). Every judgement takes
+`compile_seconds` plus `case_seconds` for each case, both varied by up to `jitter`; at most `concurrency`
+judgements run at a time and the rest wait, as on a real server. Failures are injected at the given rates:
+
+  reject: /judge replies with status "reject"
+  fail: the HTTP request fails with 500 (any endpoint)
+  stall: the judgement stops making progress after the first case and never finishes
+
+Nothing but the standard library is used, so that the emulator runs on any machine of the testing network;
+`MockJudge` can also be run in process, see scripts/judge_load_test.py.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.request
+from base64 import b64encode
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ACCEPTED, WRONG_ANSWER, JUDGING = 0, -1, -2
+
+
+class MockJudgeConfig(object):
+
+  def __init__(self, concurrency=4, compile_seconds=0.2, case_seconds=0.05, jitter=0.5, cases=None,
+               accept_rate=0.7, reject_rate=0., fail_rate=0., stall_rate=0., report_bytes=64, push=True):
+    """
+    :param cases: pretend every judgement has this many cases, instead of the number in the request
+    :param accept_rate: rate of accepted verdicts; the rest get wrong answer on a random case
+    :param report_bytes: size of each field of the report of a case
+    :param push: push progress to `callback_url` when the request has one
+    """
+    self.concurrency = concurrency
+    self.compile_seconds = compile_seconds
+    self.case_seconds = case_seconds
+    self.jitter = jitter
+    self.cases = cases
+    self.accept_rate = accept_rate
+    self.reject_rate = reject_rate
+    self.fail_rate = fail_rate
+    self.stall_rate = stall_rate
+    self.report_bytes = report_bytes
+    self.push = push
+
+
+class MockJudge(object):
+  """
+  State of an emulated judge server; `handle(method, path, body)` answers one request
+  """
+  KEEP_RESULTS = 10000
+
+  def __init__(self, config=None):
+    self.config = config or MockJudgeConfig()
+    self.slots = threading.Semaphore(self.config.concurrency)
+    self.lock = threading.Lock()
+    self.results = OrderedDict()
+    self.cases = set()
+    self.running = 0
+    self.stats = {"judge": 0, "query": 0, "report": 0, "push": 0, "reject": 0, "fail": 0, "stall": 0,
+                  "max_running": 0, "waiting": 0}
+
+  def _count(self, key, amount=1):
+    with self.lock:
+      self.stats[key] += amount
+
+  def _sleep(self, seconds):
+    time.sleep(seconds * (1 + random.uniform(-self.config.jitter, self.config.jitter)))
+
+  def _publish(self, fingerprint, result, callback_url, authorization=None):
+    with self.lock:
+      self.results[fingerprint] = result
+      self.results.move_to_end(fingerprint)
+      while len(self.results) > self.KEEP_RESULTS:
+        self.results.popitem(last=False)
+    if callback_url and self.config.push:
+      self._count("push")
+      headers = {"Content-Type": "application/json"}
+      if authorization:  # a judge server pushes with the credentials it is called with
+        headers["Authorization"] = authorization
+      request = urllib.request.Request(callback_url, data=json.dumps(result).encode(), headers=headers)
+      try:
+        urllib.request.urlopen(request, timeout=5).close()
+      except Exception:  # the dispatcher queries once in a while anyway
+        pass
+
+  def _run(self, fingerprint, case_count, callback_url, authorization):
+    config = self.config
+    stall = random.random() < config.stall_rate
+    wrong_case = random.randrange(case_count) if case_count and random.random() >= config.accept_rate else None
+    self._count("waiting")
+    with self.slots:
+      with self.lock:
+        self.stats["waiting"] -= 1
+        self.running += 1
+        self.stats["max_running"] = max(self.stats["max_running"], self.running)
+      try:
+        self._sleep(config.compile_seconds)
+        detail = []
+        for index in range(case_count):
+          self._sleep(config.case_seconds)
+          verdict = WRONG_ANSWER if index == wrong_case else ACCEPTED
+          detail.append({"verdict": verdict, "time": round(random.uniform(0, config.case_seconds), 3),
+                         "memory": round(random.uniform(1, 64), 1)})
+          self._publish(fingerprint, {"status": "received", "verdict": JUDGING, "detail": list(detail)},
+                        callback_url, authorization)
+          if stall:
+            self._count("stall")
+            return
+          if verdict != ACCEPTED:
+            break
+        verdict = WRONG_ANSWER if any(d["verdict"] != ACCEPTED for d in detail) else ACCEPTED
+        self._publish(fingerprint, {"status": "received", "verdict": verdict, "detail": detail}, callback_url,
+                      authorization)
+      finally:
+        with self.lock:
+          self.running -= 1
+
+  def judge(self, data, authorization=None):
+    self._count("judge")
+    if random.random() < self.config.reject_rate:
+      self._count("reject")
+      return {"status": "reject", "message": "mock judge rejected the submission"}
+    fingerprint = data.get("fingerprint", "")
+    case_count = self.config.cases if self.config.cases is not None else len(data.get("cases", []))
+    self._publish(fingerprint, {"status": "received", "verdict": JUDGING, "detail": []}, None)
+    threading.Thread(target=self._run, args=(fingerprint, case_count, data.get("callback_url"), authorization),
+                     daemon=True).start()
+    return {"status": "received"}
+
+  def query(self, data):
+    self._count("query")
+    with self.lock:
+      result = self.results.get(data.get("fingerprint", ""))
+    if result is None:
+      return {"status": "reject", "message": "unknown fingerprint"}
+    return result
+
+  def report(self, data):
+    self._count("report")
+    with self.lock:
+      result = self.results.get(data.get("fingerprint", ""), {})
+    field = b64encode(b"x" * self.config.report_bytes).decode()
+    return "\n".join("%s|%s" % ("Accepted" if d["verdict"] == ACCEPTED else "Wrong answer", "|".join([field] * 4))
+                     for d in result.get("detail", []))
+
+  def handle(self, method, path, body, authorization=None):
+    """
+    :param authorization: Authorization header of the request, sent back along with pushes
+    :return: (HTTP status, content type, response body as str)
+    """
+    if random.random() < self.config.fail_rate:
+      self._count("fail")
+      return 500, "text/plain", "mock failure"
+    try:
+      data = json.loads(body.decode()) if body else {}
+    except ValueError:
+      data = {}
+    if not isinstance(data, dict):
+      data = {}
+    path = path.split("?")[0].rstrip("/")
+    if path == "/ping":
+      return 200, "text/plain", "pong"
+    if path == "/query/report":
+      return 200, "text/plain", self.report(data)
+    if method == "POST" and path == "/judge":
+      reply = self.judge(data, authorization)
+    elif path == "/query":
+      reply = self.query(data)
+    elif path.startswith("/exist/case/"):
+      reply = {"status": "received", "exist": path.split("/")[-1] in self.cases}
+    elif path.startswith("/upload/case/"):
+      self.cases.add(path.split("/")[3])
+      reply = {"status": "received"}
+    elif path == "/list/spj":
+      reply = {"status": "received", "spj": []}
+    elif method == "POST" and path.startswith(("/upload/", "/config/")):
+      reply = {"status": "received"}
+    else:
+      return 404, "text/plain", "not found"
+    return 200, "application/json", json.dumps(reply)
+
+
+def make_server(judge, host="0.0.0.0", port=5001):
+  """
+  :rtype: ThreadingHTTPServer
+  """
+
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as the dispatcher pools its sessions
+
+    def _serve(self):
+      body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+      status, content_type, reply = judge.handle(self.command, self.path, body, self.headers.get("Authorization"))
+      reply = reply.encode()
+      self.send_response(status)
+      self.send_header("Content-Type", content_type)
+      self.send_header("Content-Length", str(len(reply)))
+      self.end_headers()
+      self.wfile.write(reply)
+
+    do_GET = do_POST = _serve
+
+    def log_message(self, *args):
+      pass
+
+  server = ThreadingHTTPServer((host, port), Handler)
+  server.daemon_threads = True
+  return server
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Emulated judge server")
+  parser.add_argument("--host", default="0.0.0.0")
+  parser.add_argument("--port", type=int, default=5001)
+  parser.add_argument("--concurrency", type=int, default=4)
+  parser.add_argument("--compile-seconds", type=float, default=0.2)
+  parser.add_argument("--case-seconds", type=float, default=0.05)
+  parser.add_argument("--jitter", type=float, default=0.5)
+  parser.add_argument("--cases", type=int, default=None, help="case count of every judgement")
+  parser.add_argument("--accept-rate", type=float, default=0.7)
+  parser.add_argument("--reject-rate", type=float, default=0.)
+  parser.add_argument("--fail-rate", type=float, default=0.)
+  parser.add_argument("--stall-rate", type=float, default=0.)
+  parser.add_argument("--report-bytes", type=int, default=64)
+  parser.add_argument("--no-push", dest="push", action="store_false")
+  args = vars(parser.parse_args())
+  host, port = args.pop("host"), args.pop("port")
+  judge = MockJudge(MockJudgeConfig(**args))
+  print("mock judge listening on %s:%d" % (host, port))
+  try:
+    make_server(judge, host, port).serve_forever()
+  except KeyboardInterrupt:
+    print(json.dumps(judge.stats))
+
+
+if __name__ == "__main__":
+  main()
@@ -1,23 +1,52 @@
-from random import randint
+import json
 
-from django.http import JsonResponse, HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
+from problem.models import Problem
+from tests.mock_judge import MockJudge
 
-def response_ok():
-  return {"status": "received"}
+# this site acting as a judge server, with the default settings of the emulator
+mock_judge = MockJudge()
+
+STUB_PREDICTION_LENGTH = 50
+
+
+def _serve(request):
+  status, content_type, reply = mock_judge.handle(request.method, request.path, request.body,
+                                                  request.META.get('HTTP_AUTHORIZATION'))
+  return HttpResponse(reply, status=status, content_type=content_type)
 
 
 @csrf_exempt
 def judge_mock(request):
-  return JsonResponse(response_ok())
+  return _serve(request)
 
 
 @csrf_exempt
 def query_mock(request):
-  return JsonResponse({"status": "received", "verdict": randint(-2, 0)})
+  return _serve(request)
 
 
 @csrf_exempt
 def query_report_mock(request):
-  return HttpResponse()
+  return _serve(request)
+
+
+def _stub_prediction(popular, solved):
+  solved = set(solved)
+  return [problem_id for problem_id in popular if problem_id not in solved][:STUB_PREDICTION_LENGTH]
+
+
+@csrf_exempt
+def predict_mock(request):
+  """
+  Stub of the recommendation service, used when RECOMMENDATION_SERVICE_URL is the address of this site:
+  it predicts the most solved visible problems the user has not solved yet
+  """
+  data = json.loads(request.body.decode() or "{}")
+  popular = list(Problem.objects.filter(visible=True).order_by("-ac_user_count").values_list("id", flat=True)[:1000])
+  if request.path.rstrip("/").endswith("batch"):
+    return JsonResponse({"predictions": {str(user["user"]): _stub_prediction(popular, user.get("solved", []))
+                                         for user in data.get("users", [])}})
+  return JsonResponse({"prediction": _stub_prediction(popular, data.get("solved", []))})
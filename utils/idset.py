@@ -0,0 +1,105 @@
+import sys
+from array import array
+from bisect import bisect_left
+
+TYPECODE = "I"  # 32-bit unsigned
+ITEMSIZE = array(TYPECODE).itemsize
+
+
+def pack_ids(ids):
+  """
+  :param ids: iterable of ids, packed in the order given
+  :return: 4 little-endian bytes per id
+  """
+  ids = array(TYPECODE, ids)
+  if sys.byteorder == "big":
+    ids.byteswap()
+  return ids.tobytes()
+
+
+def unpack_ids(data, start=0, stop=None):
+  """
+  :return: array of the packed ids from position `start` up to `stop`; only those bytes are read
+  """
+  data = memoryview(data or b"")
+  ids = array(TYPECODE)
+  ids.frombytes(data[start * ITEMSIZE:len(data) if stop is None else stop * ITEMSIZE])
+  if sys.byteorder == "big":
+    ids.byteswap()
+  return ids
+
+
+class IdSet(object):
+  """
+  Set of ids kept as a sorted array of 32-bit unsigned integers, stored as 4 little-endian bytes per id.
+  Membership is a binary search over the array; loading it from bytes copies memory instead of parsing text.
+  """
+  __slots__ = ("ids",)
+
+  def __init__(self, ids=()):
+    if isinstance(ids, IdSet):
+      self.ids = array(TYPECODE, ids.ids)
+    else:
+      self.ids = array(TYPECODE, sorted(set(ids)))
+
+  @classmethod
+  def from_bytes(cls, data):
+    instance = cls.__new__(cls)
+    instance.ids = unpack_ids(data)
+    return instance
+
+  def to_bytes(self):
+    return pack_ids(self.ids)
+
+  def __contains__(self, item):
+    try:
+      item = int(item)
+    except (TypeError, ValueError):
+      return False
+    index = bisect_left(self.ids, item)
+    return index < len(self.ids) and self.ids[index] == item
+
+  def __iter__(self):
+    return iter(self.ids)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def __eq__(self, other):
+    return isinstance(other, IdSet) and self.ids == other.ids
+
+  def __repr__(self):
+    return "IdSet(%s)" % list(self.ids)
+
+  def add(self, item):
+    index = bisect_left(self.ids, item)
+    if index == len(self.ids) or self.ids[index] != item:
+      self.ids.insert(index, item)
+
+  def discard(self, item):
+    index = bisect_left(self.ids, item)
+    if index < len(self.ids) and self.ids[index] == item:
+      del self.ids[index]
+
+  def intersection(self, other):
+    """
+    :param other: IdSet or any iterable of ids; a small one is probed against this set instead of hashing both
+    """
+    if not isinstance(other, (IdSet, set, frozenset)):
+      other = list(other)
+    if len(other) * 16 < len(self.ids):
+      return IdSet(item for item in other if item in self)
+    return IdSet(set(self.ids).intersection(other))
+
+  def difference(self, other):
+    return IdSet(set(self.ids).difference(other))
+
+  def union(self, other):
+    return IdSet(set(self.ids).union(other))
+
+  __and__ = intersection
+  __sub__ = difference
+  __or__ = union
+
+  def __rsub__(self, other):
+    return IdSet(other).difference(self)